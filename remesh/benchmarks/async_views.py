@@ -0,0 +1,134 @@
+"""
+Compares throughput of the sync and async read views when served through the ASGI
+application (remesh/asgi.py), with many concurrent clients
+
+The requests go straight to the ASGI application in this process, so no server is
+needed. --latency makes every client slow to read its response, like a client on a
+slow network:
+    python -m benchmarks.async_views --clients 100 --seconds 10 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from .common import setup_django
+
+MODES = ["sync", "async"]
+
+
+def create_data():
+    from remesh_app.models import Conversation, Message, Thought
+
+    convo = Conversation.objects.create(title="Benchmark Conversation")
+    messages = Message.objects.bulk_create(
+        [Message(conversation=convo, text=f"Message {i}") for i in range(50)]
+    )
+    Thought.objects.bulk_create(
+        [
+            Thought(message=message, text=f"Thought {i}")
+            for message in messages
+            for i in range(3)
+        ]
+    )
+    return convo, messages[0]
+
+
+async def get(application, path: str, latency: float) -> int:
+    """
+    Sends one GET request to the ASGI application and returns the status code
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        elif latency:
+            await asyncio.sleep(latency)
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+async def run_load(application, paths, clients: int, seconds: float, latency: float):
+    """
+    Runs clients concurrent clients for seconds, each requesting the paths in turn
+    Returns (requests done, errors)
+    """
+    deadline = time.monotonic() + seconds
+    counts = {"requests": 0, "errors": 0}
+
+    async def client(offset):
+        i = offset
+        while time.monotonic() < deadline:
+            status = await get(application, paths[i % len(paths)], latency)
+            counts["requests" if status == 200 else "errors"] += 1
+            i += 1
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(Path(directory) / "bench.sqlite3")
+
+        from django.core.asgi import get_asgi_application
+        from django.urls import reverse
+
+        convo, message = create_data()
+        application = get_asgi_application()
+
+        results = {}
+        for mode in MODES:
+            prefix = "remesh_app:async_" if mode == "async" else "remesh_app:"
+            paths = [
+                reverse(f"{prefix}conversations"),
+                reverse(f"{prefix}conversation", args=[convo.id]),
+                reverse(f"{prefix}message", args=[message.id]),
+            ]
+            counts = asyncio.run(
+                run_load(application, paths, args.clients, args.seconds, args.latency)
+            )
+            counts["requests_per_second"] = counts["requests"] / args.seconds
+            results[mode] = counts
+
+    print(f"{'views':<8} {'req/s':>8} {'requests':>9} {'errors':>8}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<8} {result['requests_per_second']:>8.1f} "
+            f"{result['requests']:>9} {result['errors']:>8}"
+        )
+    base = results["sync"]["requests_per_second"]
+    if base:
+        gain = results["async"]["requests_per_second"] / base
+        print(f"async views throughput: {gain:.2f}x sync")
+
+
+if __name__ == "__main__":
+    main()
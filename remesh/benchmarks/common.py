@@ -0,0 +1,42 @@
+"""
+Helpers shared by the benchmark scripts
+
+The benchmarks run against a throwaway SQLite file, never the real db.sqlite3.
+Run them from the remesh directory, e.g. `python -m benchmarks.sqlite_tuning`
+"""
+
+import os
+import sys
+from pathlib import Path
+
+REMESH_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(db_path, profile="development", page_cache=False):
+    """
+    Configures Django to use the database at db_path with the given database profile,
+    and creates the tables
+    The page cache is turned off unless page_cache is True, so the benchmarks measure
+    the database and not the cache.
+    """
+    sys.path.insert(0, str(REMESH_DIR))
+    os.environ["DJANGO_SETTINGS_MODULE"] = "remesh.settings"
+    os.environ["REMESH_DB_PROFILE"] = profile
+
+    import django
+    from django.conf import settings
+
+    for database in settings.DATABASES.values():
+        database["NAME"] = str(db_path)
+    if not page_cache:
+        settings.CACHES["pages"] = {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache"
+        }
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+
+    # Lets the test client talk to the app
+    setup_test_environment()
+    call_command("migrate", verbosity=0)
@@ -0,0 +1,136 @@
+"""
+Measures creating thoughts from many concurrent submitters, with and without the group
+commit queue (see remesh_app/writes.py)
+
+Each submitter is a thread posting the new thought form through its own test client,
+as a threaded server would handle concurrent requests. Each mode runs in its own
+process, with the production database profile:
+    python -m benchmarks.group_commit --submitters 500 --seconds 10
+
+Modes:
+    off  - each request saves its thought in its own transaction
+    on   - the group commit queue saves the thoughts in shared transactions
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from .common import REMESH_DIR, setup_django
+
+MODES = ["off", "on"]
+
+
+def run_mode(mode: str, submitters: int, seconds: float) -> dict:
+    from django.db import connection
+    from django.test import Client
+    from django.urls import reverse
+
+    from remesh_app import writes
+    from remesh_app.models import Thought
+    from remesh_app.seeding import Seeder
+
+    Seeder(1, 1, 0, skew=0).run()
+    url = reverse("remesh_app:new_thought", args=[1])
+    connection.close()
+
+    submitted = 0
+    errors = 0
+    lock = threading.Lock()
+    ready = threading.Barrier(submitters + 1)
+    stop = threading.Event()
+
+    def submit(i):
+        nonlocal submitted, errors
+        client = Client(raise_request_exception=False)
+        ready.wait()
+        while not stop.is_set():
+            response = client.post(url, {"text": f"Thought from submitter {i}"})
+            with lock:
+                if response.status_code == 302:
+                    submitted += 1
+                else:
+                    errors += 1
+        connection.close()
+
+    threads = [threading.Thread(target=submit, args=[i]) for i in range(submitters)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    start = time.perf_counter()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # Without the queue every saved thought is its own commit
+    commits = writes.group_commit_queue.commits if mode == "on" else submitted
+    return {
+        "submissions_per_second": submitted / elapsed,
+        "commits_per_second": commits / elapsed,
+        "rows_per_commit": submitted / commits if commits else 0.0,
+        "errors": errors,
+        "saved": Thought.objects.count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--submitters", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Worker process for one mode, prints its result as JSON
+        os.environ["REMESH_GROUP_COMMIT"] = "1" if args.mode == "on" else "0"
+        with tempfile.TemporaryDirectory() as directory:
+            setup_django(Path(directory) / "bench.sqlite3", profile="production")
+            result = run_mode(args.mode, args.submitters, args.seconds)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.group_commit",
+                "--mode",
+                mode,
+                "--submitters",
+                str(args.submitters),
+                "--seconds",
+                str(args.seconds),
+            ],
+            cwd=REMESH_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(
+        f"{'mode':<5} {'submissions/s':>14} {'commits/s':>10} "
+        f"{'rows/commit':>12} {'errors':>7}"
+    )
+    for mode, result in results.items():
+        print(
+            f"{mode:<5} {result['submissions_per_second']:>14.1f} "
+            f"{result['commits_per_second']:>10.1f} "
+            f"{result['rows_per_commit']:>12.1f} {result['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
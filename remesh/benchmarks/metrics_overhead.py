@@ -0,0 +1,99 @@
+"""
+Measures the overhead of the request metrics middleware (REMESH_METRICS=1)
+
+The same pages are requested with the metrics off and on, each in its own process
+against a fresh database:
+    python -m benchmarks.metrics_overhead --requests 2000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .common import REMESH_DIR, setup_django
+
+MODES = ["off", "on"]
+
+
+def run_requests(count: int) -> dict:
+    """
+    Requests the conversation, message and conversations pages count times in turn
+    Returns the mean time per request in milliseconds
+    """
+    from django.test import Client
+    from django.urls import reverse
+
+    from remesh_app.models import Conversation, Message, Thought
+
+    convo = Conversation.objects.create(title="Benchmark Conversation")
+    messages = Message.objects.bulk_create(
+        [Message(conversation=convo, text=f"Message {i}") for i in range(50)]
+    )
+    Thought.objects.bulk_create(
+        [Thought(message=messages[0], text=f"Thought {i}") for i in range(50)]
+    )
+    urls = [
+        reverse("remesh_app:conversations"),
+        reverse("remesh_app:conversation", args=[convo.id]),
+        reverse("remesh_app:message", args=[messages[0].id]),
+    ]
+    client = Client()
+    for url in urls:
+        client.get(url)
+
+    start = time.perf_counter()
+    for i in range(count):
+        client.get(urls[i % len(urls)])
+    elapsed = time.perf_counter() - start
+    return {"ms_per_request": elapsed / count * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Worker process for one mode, prints its result as JSON
+        os.environ["REMESH_METRICS"] = "1" if args.mode == "on" else "0"
+        os.environ["REMESH_SERVER_TIMING"] = os.environ["REMESH_METRICS"]
+        with tempfile.TemporaryDirectory() as directory:
+            setup_django(Path(directory) / "bench.sqlite3")
+            result = run_requests(args.requests)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.metrics_overhead",
+                "--mode",
+                mode,
+                "--requests",
+                str(args.requests),
+            ],
+            cwd=REMESH_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    off = results["off"]["ms_per_request"]
+    on = results["on"]["ms_per_request"]
+    print(f"metrics off: {off:.3f} ms per request")
+    print(f"metrics on:  {on:.3f} ms per request")
+    print(f"overhead:    {on - off:.3f} ms ({(on - off) / off:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Compares throughput of the development and production database profiles
+under a mixed, concurrent load of page reads and new thoughts
+
+Each profile runs in its own process against a fresh database:
+    python -m benchmarks.sqlite_tuning --threads 16 --seconds 10
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from .common import REMESH_DIR, setup_django
+
+PROFILES = ["development", "production"]
+
+
+def run_load(threads: int, seconds: float, write_ratio: float) -> dict:
+    """
+    Runs the mixed load in this process and returns the counts
+    """
+    from django.db import connections
+    from django.test import Client
+    from django.urls import reverse
+
+    from remesh_app.models import Conversation, Message
+
+    convo = Conversation.objects.create(title="Benchmark Conversation")
+    messages = [
+        Message.objects.create(conversation=convo, text=f"Message {i}")
+        for i in range(20)
+    ]
+    connections.close_all()
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        # Exceptions are counted from the 500 responses, since the test client
+        # would otherwise re-raise exceptions from other threads' requests
+        client = Client(raise_request_exception=False)
+        done = {"reads": 0, "writes": 0, "errors": 0}
+        while time.monotonic() < deadline:
+            try:
+                if rng.random() < write_ratio:
+                    message = rng.choice(messages)
+                    response = client.post(
+                        reverse("remesh_app:new_thought", args=[message.id]),
+                        {"text": "Benchmark thought"},
+                    )
+                    kind = "writes"
+                else:
+                    response = client.get(
+                        reverse("remesh_app:conversation", args=[convo.id])
+                    )
+                    kind = "reads"
+            except Exception:
+                done["errors"] += 1
+                continue
+            # Mostly "database is locked"
+            done["errors" if response.status_code >= 500 else kind] += 1
+        connections.close_all()
+        with lock:
+            for key, value in done.items():
+                counts[key] += value
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    counts["requests_per_second"] = (counts["reads"] + counts["writes"]) / seconds
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--profile", choices=PROFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        # Worker process for one profile, prints its result as JSON
+        with tempfile.TemporaryDirectory() as directory:
+            setup_django(Path(directory) / "bench.sqlite3", args.profile)
+            result = run_load(args.threads, args.seconds, args.write_ratio)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for profile in PROFILES:
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.sqlite_tuning",
+                "--profile",
+                profile,
+                "--threads",
+                str(args.threads),
+                "--seconds",
+                str(args.seconds),
+                "--write-ratio",
+                str(args.write_ratio),
+            ],
+            cwd=REMESH_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[profile] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'profile':<12} {'req/s':>8} {'reads':>8} {'writes':>8} {'errors':>8}")
+    for profile, result in results.items():
+        print(
+            f"{profile:<12} {result['requests_per_second']:>8.1f} "
+            f"{result['reads']:>8} {result['writes']:>8} {result['errors']:>8}"
+        )
+    base = results["development"]["requests_per_second"]
+    if base:
+        gain = results["production"]["requests_per_second"] / base
+        print(f"production profile throughput: {gain:.2f}x development")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures the memory used by idle live update streams (Server-Sent Events), and how
+long it takes to deliver one new message to all of them
+
+The streams are opened straight on the ASGI application in this process:
+    python -m benchmarks.sse_connections --connections 5000
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from .common import setup_django
+
+
+async def open_stream(application, path: str, started: list, received: asyncio.Queue):
+    """
+    Opens one event stream and puts every event it receives in received
+    started gets an item once the stream is open
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    disconnect = asyncio.Event()
+
+    async def receive():
+        if not hasattr(receive, "done"):
+            receive.done = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            if message["body"].startswith(b"retry:"):
+                started.append(True)
+            elif message["body"].startswith(b"event:"):
+                received.put_nowait(message["body"])
+
+    await application(scope, receive, send)
+
+
+async def run(connections: int):
+    from asgiref.sync import sync_to_async
+    from django.core.asgi import get_asgi_application
+    from django.urls import reverse
+
+    from remesh_app.models import Conversation, Message
+
+    convo = await Conversation.objects.acreate(title="Benchmark Conversation")
+    path = reverse("remesh_app:conversation_events", args=[convo.id])
+    application = get_asgi_application()
+    started = []
+    received = asyncio.Queue()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    streams = [
+        asyncio.create_task(open_stream(application, path, started, received))
+        for _ in range(connections)
+    ]
+    while len(started) < connections:
+        await asyncio.sleep(0.1)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.monotonic()
+    await sync_to_async(Message.objects.create)(conversation=convo, text="Hello")
+    for _ in range(connections):
+        await received.get()
+    elapsed = time.monotonic() - start
+
+    for stream in streams:
+        stream.cancel()
+    await asyncio.gather(*streams, return_exceptions=True)
+    return memory, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(Path(directory) / "bench.sqlite3")
+        memory, elapsed = asyncio.run(run(args.connections))
+
+    print(f"idle streams:        {args.connections}")
+    print(f"memory per stream:   {memory / args.connections / 1024:.1f} KiB")
+    print(f"fan-out of 1 event:  {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
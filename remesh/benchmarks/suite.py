@@ -0,0 +1,346 @@
+"""
+Latency and throughput of every route in remesh_app/urls.py
+
+Seeds a database with synthetic data (see remesh_app/seeding.py), requests each route a number of
+times and reports the p50/p90/p99 latency and requests per second of each. By default
+the requests go through the test client in this process:
+    python -m benchmarks.suite --conversations 1000 --messages 50 --thoughts 5
+
+--server sends them over HTTP to a running server instead, using --concurrency client
+threads. The server must use the same database file, seeded beforehand:
+    python -m benchmarks.suite --database /tmp/bench.sqlite3 --seed-only
+    REMESH_DB_PATH=/tmp/bench.sqlite3 python manage.py runserver --noreload 8001
+    python -m benchmarks.suite --database /tmp/bench.sqlite3 \\
+        --server http://127.0.0.1:8001
+
+--output saves the results as JSON. --baseline compares a run with saved results and
+exits with status 1 if any route's p50 or p90 got slower by more than --tolerance
+(a fraction) and --min-delta milliseconds.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .common import setup_django
+
+# Routes that never finish a response, so can't be timed
+SKIPPED_ROUTES = {"conversation_events"}
+
+# Query string sent to the search routes
+SEARCH_QUERY = "people"
+
+COMPARED_STATS = ["p50", "p90"]
+
+
+def benchmark_targets():
+    """
+    Returns the id of the largest conversation and of the message with the most
+    thoughts, which give the slowest pages
+    """
+    from remesh_app.models import Conversation, Message
+
+    convo = Conversation.objects.order_by("-message_count", "id").first()
+    message = Message.objects.order_by("-thought_count", "id").first()
+    if convo is None or message is None:
+        sys.exit("The database has no messages, seed it first")
+    return convo.id, message.id
+
+
+def route_requests(conversation_id: int, message_id: int) -> list:
+    """
+    Returns a (name, method, path, body) request for each route in remesh_app/urls.py
+    """
+    from django.urls import reverse
+
+    from remesh_app.urls import app_name, urlpatterns
+
+    requests = []
+    for pattern in urlpatterns:
+        if pattern.name in SKIPPED_ROUTES:
+            continue
+        kwargs = {}
+        for name in pattern.pattern.converters:
+            if name == "conversation_id":
+                kwargs[name] = conversation_id
+            elif name == "message_id":
+                kwargs[name] = message_id
+            elif name == "search_type":
+                in_conversation = "conversation_id" in pattern.pattern.converters
+                kwargs[name] = "messages" if in_conversation else "conversations"
+            elif name == "export_format":
+                kwargs[name] = "ndjson"
+        path = reverse(f"{app_name}:{pattern.name}", kwargs=kwargs)
+        label = pattern.name
+        if "search_type" in kwargs:
+            path += f"?q={SEARCH_QUERY}"
+            label += f"_{kwargs['search_type']}"
+
+        if pattern.name.startswith("api_bulk_"):
+            key = pattern.name[len("api_bulk_") :]
+            field = "title" if key == "conversations" else "text"
+            body = json.dumps({key: [{field: f"Benchmark {key}"}]})
+            requests.append((label, "POST", path, body))
+        else:
+            requests.append((label, "GET", path, None))
+    return requests
+
+
+def client_requester():
+    """
+    Returns a function sending one request with the test client and returning its
+    status code
+    """
+    from django.test import Client
+
+    client = Client(raise_request_exception=False)
+
+    def send(method, path, body):
+        if method == "POST":
+            response = client.post(path, body, content_type="application/json")
+        else:
+            response = client.get(path)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response.status_code
+
+    return send
+
+
+def server_requester(base_url: str):
+    """
+    Returns a function sending one request over HTTP and returning its status code
+    """
+    base_url = base_url.rstrip("/")
+
+    def send(method, path, body):
+        request = urllib.request.Request(
+            base_url + path,
+            data=body.encode() if body is not None else None,
+            headers={"Content-Type": "application/json"} if body is not None else {},
+            method=method,
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    return send
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(latencies: list, elapsed: float, errors: int) -> dict:
+    """
+    Returns the statistics of one route, latencies in milliseconds
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50": percentile(latencies, 0.50),
+        "p90": percentile(latencies, 0.90),
+        "p99": percentile(latencies, 0.99),
+        "mean": statistics.fmean(latencies),
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def run_route(send, request, count: int, warmup: int, concurrency: int) -> dict:
+    """
+    Sends request count times after warmup untimed requests, from concurrency threads
+    """
+    _, method, path, body = request
+    for _ in range(warmup):
+        send(method, path, body)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        start = time.perf_counter()
+        status = send(method, path, body)
+        latency = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(latency)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(one, range(count)))
+    else:
+        for i in range(count):
+            one(i)
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float):
+    """
+    Returns a line for each route and statistic slower than in the baseline
+    """
+    regressions = []
+    for route, stats in results["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            continue
+        for stat in COMPARED_STATS:
+            delta = stats[stat] - before[stat]
+            if delta > min_delta and stats[stat] > before[stat] * (1 + tolerance):
+                regressions.append(
+                    f"{route} {stat}: {before[stat]:.2f} ms -> {stats[stat]:.2f} ms"
+                )
+    return regressions
+
+
+def print_results(results: dict):
+    print(
+        f"{'route':<32} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+        f"{'req/s':>8} {'errors':>7}"
+    )
+    for route, stats in results["routes"].items():
+        print(
+            f"{route:<32} {stats['p50']:>8.2f} {stats['p90']:>8.2f} "
+            f"{stats['p99']:>8.2f} {stats['requests_per_second']:>8.1f} "
+            f"{stats['errors']:>7}"
+        )
+
+
+def run(args, db_path: Path) -> dict:
+    setup_django(db_path, profile=args.profile, page_cache=args.page_cache)
+
+    from remesh_app.models import Message
+    from remesh_app.seeding import Seeder
+
+    if not Message.objects.exists():
+        print("Seeding", db_path, file=sys.stderr)
+        Seeder(
+            args.conversations,
+            args.messages,
+            args.thoughts,
+            skew=args.skew,
+            random_seed=args.seed,
+        ).run()
+    if args.seed_only:
+        return None
+
+    conversation_id, message_id = benchmark_targets()
+    if args.server:
+        send = server_requester(args.server)
+    else:
+        send = client_requester()
+
+    routes = {}
+    for request in route_requests(conversation_id, message_id):
+        if args.route and not any(name in request[0] for name in args.route):
+            continue
+        routes[request[0]] = run_route(
+            send, request, args.requests, args.warmup, args.concurrency
+        )
+    return {
+        "meta": {
+            "target": args.server or "test client",
+            "profile": args.profile,
+            "page_cache": args.page_cache,
+            "data": {
+                "conversations": args.conversations,
+                "messages": args.messages,
+                "thoughts": args.thoughts,
+                "skew": args.skew,
+                "seed": args.seed,
+            },
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "routes": routes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    data = parser.add_argument_group("data")
+    data.add_argument("--conversations", type=int, default=200)
+    data.add_argument(
+        "--messages", type=float, default=50, help="mean per conversation"
+    )
+    data.add_argument("--thoughts", type=float, default=3, help="mean per message")
+    data.add_argument("--skew", type=float, default=1.5, help="0 for equal sizes")
+    data.add_argument("--seed", type=int, default=0, help="random seed")
+    data.add_argument(
+        "--database",
+        type=Path,
+        help="database file to use, seeded if empty (default: a temporary file)",
+    )
+    data.add_argument("--seed-only", action="store_true", help="seed and exit")
+
+    load = parser.add_argument_group("load")
+    load.add_argument("--requests", type=int, default=100, help="per route")
+    load.add_argument("--warmup", type=int, default=5, help="untimed, per route")
+    load.add_argument("--concurrency", type=int, default=1)
+    load.add_argument("--server", help="base URL of a running server")
+    load.add_argument(
+        "--route", action="append", help="only routes containing this, repeatable"
+    )
+    load.add_argument(
+        "--profile",
+        default="development",
+        choices=["development", "production", "replica"],
+    )
+    load.add_argument("--page-cache", action="store_true")
+
+    report = parser.add_argument_group("results")
+    report.add_argument("--output", type=Path, help="save the results as JSON")
+    report.add_argument("--baseline", type=Path, help="saved results to compare with")
+    report.add_argument("--tolerance", type=float, default=0.2)
+    report.add_argument("--min-delta", type=float, default=1.0, help="milliseconds")
+    args = parser.parse_args()
+
+    if args.concurrency > 1 and not args.server:
+        parser.error("--concurrency needs --server")
+
+    if args.database:
+        results = run(args, args.database)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(args, Path(directory) / "bench.sqlite3")
+    if results is None:
+        return
+
+    print_results(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print("Regressions against", args.baseline)
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
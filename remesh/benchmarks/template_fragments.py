@@ -0,0 +1,153 @@
+"""
+Measures rendering the conversation page of a conversation with 5,000 messages, with
+and without the cached template loader and the per-message fragment cache
+
+Every page of the conversation is requested (500 messages per page) with the page
+cache off, so each request renders the template. Each mode runs in its own process:
+    python -m benchmarks.template_fragments --rounds 5
+
+Modes:
+    uncached   - templates loaded and compiled on every request, no fragment cache
+    loader     - cached template loader, no fragment cache
+    fragments  - cached template loader and fragment cache, after one warm-up round
+"""
+
+import argparse
+import html
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .common import REMESH_DIR, setup_django
+
+MODES = ["uncached", "loader", "fragments"]
+NEXT_LINK = re.compile(r'<a href="\?([^"]*)">Older')
+
+
+def configure(mode: str):
+    """
+    Sets up the template loaders and fragment cache for mode, before first use
+    """
+    from django.conf import settings
+
+    options = settings.TEMPLATES[0]["OPTIONS"]
+    settings.TEMPLATES[0]["APP_DIRS"] = False
+    loaders = [
+        "django.template.loaders.filesystem.Loader",
+        "django.template.loaders.app_directories.Loader",
+    ]
+    if mode == "uncached":
+        options["loaders"] = loaders
+    else:
+        options["loaders"] = [("django.template.loaders.cached.Loader", loaders)]
+    if mode != "fragments":
+        settings.CACHES["template_fragments"] = {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache"
+        }
+
+
+def render_pages(client, url: str) -> int:
+    """
+    Requests every page of a conversation, returns the number of pages
+    """
+    pages = 0
+    query = "page_size=500"
+    while query is not None:
+        response = client.get(f"{url}?{query}")
+        assert response.status_code == 200
+        pages += 1
+        match = NEXT_LINK.search(response.content.decode())
+        query = html.unescape(match.group(1)) if match else None
+    return pages
+
+
+def run_mode(mode: str, messages: int, rounds: int) -> dict:
+    from django.test import Client
+    from django.urls import reverse
+
+    from remesh_app.metrics import registry
+    from remesh_app.models import Conversation
+    from remesh_app.seeding import Seeder
+
+    Seeder(1, messages, 3, skew=0).run()
+    url = reverse("remesh_app:conversation", args=[Conversation.objects.get().id])
+    client = Client()
+    # Warms up the template loader, and the fragment cache in the fragments mode
+    render_pages(client, url)
+    registry.clear()
+
+    pages = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pages += render_pages(client, url)
+    elapsed = time.perf_counter() - start
+    template_time = registry.histograms["remesh_template_duration_seconds"][
+        "remesh_app:conversation"
+    ].sum
+    return {
+        "ms_per_page": elapsed / pages * 1000,
+        "template_ms_per_page": template_time / pages * 1000,
+        "pages": pages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Worker process for one mode, prints its result as JSON
+        # The metrics middleware measures the template render time
+        os.environ["REMESH_METRICS"] = "1"
+        with tempfile.TemporaryDirectory() as directory:
+            setup_django(Path(directory) / "bench.sqlite3")
+            configure(args.mode)
+            result = run_mode(args.mode, args.messages, args.rounds)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.template_fragments",
+                "--mode",
+                mode,
+                "--messages",
+                str(args.messages),
+                "--rounds",
+                str(args.rounds),
+            ],
+            cwd=REMESH_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<10} {'ms/page':>9} {'template ms/page':>17}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<10} {result['ms_per_page']:>9.2f} "
+            f"{result['template_ms_per_page']:>17.2f}"
+        )
+    before = results["uncached"]["template_ms_per_page"]
+    after = results["fragments"]["template_ms_per_page"]
+    if after:
+        print(f"template rendering: {before / after:.1f}x faster with fragments")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +47,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'remesh_app.routers.ReadYourWritesMiddleware',
+    'remesh_app.routers.ShardMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -72,19 +75,214 @@ TEMPLATES = [
     },
 ]
 
+# Request metrics (see remesh_app/metrics.py), served at /metrics/
+# Enabled with REMESH_METRICS=1, REMESH_SERVER_TIMING=1 also adds a Server-Timing header
+
+REMESH_METRICS = os.environ.get('REMESH_METRICS') == '1'
+REMESH_SERVER_TIMING = os.environ.get('REMESH_SERVER_TIMING') == '1'
+
+if REMESH_METRICS:
+    MIDDLEWARE.insert(0, 'remesh_app.metrics.MetricsMiddleware')
+    TEMPLATES[0]['BACKEND'] = 'remesh_app.metrics.DjangoTemplates'
+
 WSGI_APPLICATION = 'remesh.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# REMESH_DB_PATH points the app at another database file, e.g. one seeded for
+# benchmarks (see benchmarks/suite.py)
+REMESH_DB_PATH = os.environ.get('REMESH_DB_PATH', BASE_DIR / 'db.sqlite3')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': REMESH_DB_PATH,
+    }
+}
+
+DATABASE_ROUTERS = []
+
+# Group commit for new messages and thoughts (see remesh_app/writes.py), enabled with
+# REMESH_GROUP_COMMIT=1. Rows submitted within REMESH_GROUP_COMMIT_DELAY seconds, up
+# to REMESH_GROUP_COMMIT_MAX_BATCH of them, are saved in one transaction.
+# The production profiles then sync every commit to disk (synchronous=FULL), so a
+# request returns only once its row is durable. The batch shares the cost of the sync.
+
+REMESH_GROUP_COMMIT = os.environ.get('REMESH_GROUP_COMMIT') == '1'
+REMESH_GROUP_COMMIT_DELAY = float(os.environ.get('REMESH_GROUP_COMMIT_DELAY', 0.005))
+REMESH_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('REMESH_GROUP_COMMIT_MAX_BATCH', 500))
+# Seconds a request waits for its row before failing
+REMESH_GROUP_COMMIT_TIMEOUT = float(os.environ.get('REMESH_GROUP_COMMIT_TIMEOUT', 30))
+
+# Production database profile, enabled with REMESH_DB_PROFILE=production
+# - WAL journal, so readers don't block the writer and vice versa
+# - a busy timeout and immediate transactions, so concurrent writers wait for the lock
+#   instead of failing with "database is locked"
+# - persistent connections with health checks, instead of a new connection per request
+# - a separate query only connection for reads (see remesh_app/routers.py)
+# PRAGMAS and TRANSACTION_MODE are handled by remesh_app/sqlite_backend
+
+REMESH_DB_PROFILE = os.environ.get('REMESH_DB_PROFILE', 'development')
+
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # NORMAL can lose the last commits on power loss (not on a crash of the app)
+    'synchronous': 'FULL' if REMESH_GROUP_COMMIT else 'NORMAL',
+    'busy_timeout': 5000,  # milliseconds
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'cache_size': -64 * 1024,  # negative values are in KiB
+    'temp_store': 'MEMORY',
+}
+
+if REMESH_DB_PROFILE in ('production', 'replica'):
+    SQLITE_PRODUCTION = {
+        'ENGINE': 'remesh_app.sqlite_backend',
+        'NAME': REMESH_DB_PATH,
+        'OPTIONS': {'timeout': 5},  # seconds
+        'CONN_MAX_AGE': int(os.environ.get('REMESH_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'PRAGMAS': SQLITE_PRODUCTION_PRAGMAS,
+        'TRANSACTION_MODE': 'IMMEDIATE',
     }
+    DATABASES = {
+        'default': SQLITE_PRODUCTION,
+        'read': {
+            **SQLITE_PRODUCTION,
+            'PRAGMAS': {**SQLITE_PRODUCTION_PRAGMAS, 'query_only': 'ON'},
+            'TRANSACTION_MODE': 'DEFERRED',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+    DATABASE_ROUTERS = ['remesh_app.routers.ReadWriteRouter']
+
+# Replica profile, enabled with REMESH_DB_PROFILE=replica
+# Like production, but reads go to a separate SQLite file standing in for a read
+# replica (REMESH_REPLICA_PATH). Copy the primary to it with `manage.py sync_replica`.
+
+if REMESH_DB_PROFILE == 'replica':
+    DATABASES = {
+        'default': SQLITE_PRODUCTION,
+        'replica': {
+            **SQLITE_PRODUCTION,
+            'NAME': os.environ.get('REMESH_REPLICA_PATH', BASE_DIR / 'replica.sqlite3'),
+            'PRAGMAS': {**SQLITE_PRODUCTION_PRAGMAS, 'query_only': 'ON'},
+            'TRANSACTION_MODE': 'DEFERRED',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+    DATABASE_ROUTERS = ['remesh_app.routers.ReadWriteRouter']
+    REMESH_READ_DATABASES = ['replica']
+
+# Sharding, enabled with REMESH_SHARDS=<number of shards> (see remesh_app/shards.py)
+# Each conversation is stored with its messages and thoughts in one of the databases
+# shard0 ... shardN-1, files in REMESH_SHARD_DIR set up like the "default" database.
+# "default" keeps the shard directory and everything else. Create the shards with
+# `manage.py migrate --database shard0` and so on.
+
+REMESH_SHARDS = int(os.environ.get('REMESH_SHARDS', 0))
+REMESH_SHARD_DIR = Path(os.environ.get('REMESH_SHARD_DIR', BASE_DIR))
+REMESH_SHARD_DATABASES = [f'shard{i}' for i in range(REMESH_SHARDS)]
+
+for alias in REMESH_SHARD_DATABASES:
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': REMESH_SHARD_DIR / f'{alias}.sqlite3',
+    }
+if REMESH_SHARDS:
+    DATABASE_ROUTERS = ['remesh_app.routers.ShardRouter', *DATABASE_ROUTERS]
+
+# The production profiles list the cached template loader explicitly, so templates
+# are always compiled once per process. (Django also uses it when no loaders are
+# given, but APP_DIRS can't be combined with a loaders list.)
+
+if REMESH_DB_PROFILE in ('production', 'replica'):
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        (
+            'django.template.loaders.cached.Loader',
+            [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ],
+        ),
+    ]
+
+# Seconds a client keeps reading from the primary after writing, so it always sees its
+# own new messages and thoughts
+REMESH_READ_YOUR_WRITES_WINDOW = int(os.environ.get('REMESH_READ_YOUR_WRITES_WINDOW', 10))
+
+# Archival (see remesh_app/archive.py): `manage.py archive_conversations` archives the
+# conversations inactive for REMESH_ARCHIVE_AFTER_DAYS days. Up to
+# REMESH_ARCHIVE_CACHE_SIZE decoded archives are kept in memory for their pages.
+
+REMESH_ARCHIVE_AFTER_DAYS = int(os.environ.get('REMESH_ARCHIVE_AFTER_DAYS', 90))
+REMESH_ARCHIVE_CACHE_SIZE = int(os.environ.get('REMESH_ARCHIVE_CACHE_SIZE', 32))
+
+# Message and thought texts of at least this many bytes are stored compressed (see
+# remesh_app/compression.py)
+REMESH_COMPRESS_MIN_BYTES = int(os.environ.get('REMESH_COMPRESS_MIN_BYTES', 1024))
+
+# Conversation snapshots (see remesh_app/snapshots.py), enabled with REMESH_SNAPSHOTS=1.
+# Run `manage.py check_snapshots` after enabling them to build the existing ones.
+
+REMESH_SNAPSHOTS = os.environ.get('REMESH_SNAPSHOTS') == '1'
+
+# JSON API (see remesh_app/api.py). Anyone can write through it unless
+# REMESH_API_TOKEN is set, which POST requests must then send as
+# "Authorization: Bearer <token>".
+
+REMESH_API_TOKEN = os.environ.get('REMESH_API_TOKEN')
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Rendered conversation, message and conversations pages are stored in the "pages"
+# cache. Pick the backend with the REMESH_CACHE environment variable:
+#   locmem - in process memory (default, not shared between worker processes)
+#   file   - files in /tmp, shared by all processes on one machine
+#   shared - the database cache table, a local stand-in for a shared cache such as
+#            memcached or redis (run `python manage.py createcachetable` first)
+
+PAGE_CACHE_BACKENDS = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "remesh-pages",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": "/tmp/remesh_page_cache",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "remesh_page_cache",
+    },
 }
 
+REMESH_CACHE = os.environ.get("REMESH_CACHE", "locmem")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "pages": PAGE_CACHE_BACKENDS[REMESH_CACHE],
+    # Rendered messages of the conversation page ({% cache %} in conversation.html),
+    # with the same backend as the pages. A page shows up to REMESH_MAX_PAGE_SIZE
+    # of them, so this holds more entries.
+    "template_fragments": {
+        **PAGE_CACHE_BACKENDS[REMESH_CACHE],
+        "KEY_PREFIX": "fragments",
+        "OPTIONS": {"MAX_ENTRIES": 50000},
+    },
+}
+if REMESH_CACHE == "locmem":
+    CACHES["template_fragments"]["LOCATION"] = "remesh-fragments"
+
+REMESH_PAGE_CACHE = "pages"
+REMESH_PAGE_CACHE_TIMEOUT = 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -136,3 +334,8 @@ NOSE_ARGS = [
     '--cover-package=remesh_app',
     '--cover-html'
 ]
+
+# Number of rows shown per page on the conversation, message and conversations pages
+# Can be overridden per request with ?page_size=, up to REMESH_MAX_PAGE_SIZE
+REMESH_PAGE_SIZE = 50
+REMESH_MAX_PAGE_SIZE = 500
@@ -1,8 +1,41 @@
 from django.contrib import admin
 
 from .models import Conversation, Message, Thought
+from .shards import shard_aliases
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """
+    Picks the shard listed, with sharding
+    The queries are sent to it by routers.ShardMiddleware, which reads ?shard= too.
+    """
+
+    title = "shard"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def value(self):
+        return super().value() or shard_aliases()[0]
+
+    def choices(self, changelist):
+        # A list can only show one shard, so there is no "All" choice
+        return list(super().choices(changelist))[1:]
+
+    def queryset(self, request, queryset):
+        return queryset
+
+
+class ShardedAdmin(admin.ModelAdmin):
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if shard_aliases():
+            return [ShardFilter, *list_filter]
+        return list_filter
+
 
 # Register your models here.
-admin.site.register(Conversation)
-admin.site.register(Message)
-admin.site.register(Thought)
\ No newline at end of file
+admin.site.register(Conversation, ShardedAdmin)
+admin.site.register(Message, ShardedAdmin)
+admin.site.register(Thought, ShardedAdmin)
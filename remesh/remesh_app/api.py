@@ -0,0 +1,343 @@
+import json
+from functools import wraps
+from hmac import compare_digest
+
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from .forms import ConversationForm, MessageForm, ThoughtForm
+from .models import Conversation, Message
+from .pagination import keyset_paginate
+from .shards import conversation_db, keyset_paginate_shards
+from .snapshots import as_snapshot_messages, conversation_messages
+from .writes import create_conversations, create_messages, create_thoughts
+
+# JSON API for conversations, messages and thoughts
+# Every list endpoint is keyset paginated like the html pages (?before=, ?after=,
+# ?page_size=). The bulk endpoints validate every item with the same forms as the
+# html views, then insert all of them with bulk_create in one transaction (one per
+# shard for conversations, with sharding). If any item is invalid, nothing is
+# inserted.
+# The API has no users, like the html forms: anyone who can reach it can write,
+# unless REMESH_API_TOKEN is set. POST requests must then send it as
+# "Authorization: Bearer <token>". They are exempt from CSRF checks either way, as
+# they come from other programs, not from the pages.
+
+# Maximum number of items accepted by one bulk request
+MAX_BULK_ITEMS = getattr(settings, "REMESH_API_MAX_BULK_ITEMS", 10000)
+
+# Maximum size of a request body in bytes. Bodies are read here instead of through
+# request.body, so bulk requests aren't limited by DATA_UPLOAD_MAX_MEMORY_SIZE.
+# The bulk limit allows about 5 KB of JSON for each of MAX_BULK_ITEMS items.
+MAX_BODY_BYTES = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+MAX_BULK_BYTES = getattr(settings, "REMESH_API_MAX_BULK_BYTES", 50 * 1024 * 1024)
+
+API_TOKEN = getattr(settings, "REMESH_API_TOKEN", None)
+
+
+def conversation_json(conversation) -> dict:
+    return {
+        "id": conversation.id,
+        "title": conversation.title,
+        "start_date": conversation.start_date,
+        "message_count": conversation.message_count,
+        "thought_count": conversation.thought_count,
+        "last_activity": conversation.last_activity,
+    }
+
+
+def message_json(message) -> dict:
+    return {
+        "id": message.id,
+        "conversation": message.conversation_id,
+        "text": message.text,
+        "sent_datetime": message.sent_datetime,
+        "thought_count": message.thought_count,
+    }
+
+
+def thought_json(thought) -> dict:
+    return {
+        "id": thought.id,
+        "message": thought.message_id,
+        "text": thought.text,
+        "sent_datetime": thought.sent_datetime,
+    }
+
+
+def snapshot_message_json(entry) -> dict:
+    return {
+        "id": entry.id,
+        "text": entry.text,
+        "sent_datetime": entry.sent_datetime,
+        "thought_count": entry.thought_count,
+        "thoughts": entry.thoughts,
+    }
+
+
+def page_json(page, serializer) -> dict:
+    return {
+        "results": [serializer(item) for item in page],
+        "next": page.next_cursor if page.has_next else None,
+        "previous": page.previous_cursor if page.has_previous else None,
+    }
+
+
+def error(message: str, status: int = 400, **extra) -> JsonResponse:
+    return JsonResponse({"error": message, **extra}, status=status)
+
+
+def api_write(view):
+    """
+    Exempts a view from CSRF checks, and checks the API token of its POST requests
+    if REMESH_API_TOKEN is set
+    """
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method == "POST" and API_TOKEN:
+            scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+            if scheme != "Bearer" or not compare_digest(
+                token.encode(), API_TOKEN.encode()
+            ):
+                return error("Invalid API token", status=401)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def read_body(request, max_bytes):
+    """
+    Reads a request body of at most max_bytes bytes (no limit if None)
+    Returns (body, error response)
+    """
+    if max_bytes is None:
+        return request.read(), None
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    # The length can be missing, so at most max_bytes + 1 bytes are read
+    if length > max_bytes or len(body := request.read(max_bytes + 1)) > max_bytes:
+        return None, error(f"Request bodies are limited to {max_bytes} bytes", 413)
+    return body, None
+
+
+def parse_body(request, bulk=False):
+    """
+    Reads the JSON object of a request body, of up to MAX_BULK_BYTES for bulk
+    requests and MAX_BODY_BYTES for the others
+    Returns (body, error response)
+    """
+    data, response = read_body(request, MAX_BULK_BYTES if bulk else MAX_BODY_BYTES)
+    if response:
+        return None, response
+    try:
+        body = json.loads(data)
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        return None, error("Expected a JSON object")
+    return body, None
+
+
+def validate_items(items, form_class):
+    """
+    Validates each item with form_class
+    Returns (unsaved model instances, errors by item index)
+    """
+    objects = []
+    errors = {}
+    for i, item in enumerate(items):
+        form = form_class(data=item if isinstance(item, dict) else {})
+        if form.is_valid():
+            objects.append(form.save(commit=False))
+        else:
+            errors[i] = form.errors
+    return objects, errors
+
+
+def bulk_items(request, key: str):
+    """
+    Reads the list of items under key from a bulk request body
+    Returns (items, error response)
+    """
+    body, response = parse_body(request, bulk=True)
+    if response:
+        return None, response
+    items = body.get(key)
+    if not isinstance(items, list):
+        return None, error(f"Expected a JSON object with a list of {key}")
+    if len(items) > MAX_BULK_ITEMS:
+        return None, error(f"At most {MAX_BULK_ITEMS} {key} can be sent at once")
+    return items, None
+
+
+@api_write
+@require_http_methods(["GET", "POST"])
+def conversations(request):
+    """
+    GET lists conversations (newest first), POST creates one from {"title": ...}
+    """
+    if request.method == "POST":
+        body, response = parse_body(request)
+        if response:
+            return response
+        form = ConversationForm(data=body)
+        if not form.is_valid():
+            return error("Invalid conversation", errors=form.errors)
+        return JsonResponse(conversation_json(form.save()), status=201)
+
+    page = keyset_paginate_shards(
+        Conversation.objects.all(), ("-start_date", "id"), request
+    )
+    return JsonResponse(page_json(page, conversation_json))
+
+
+@require_http_methods(["GET"])
+def conversation(request, conversation_id):
+    convo = get_object_or_404(Conversation, id=conversation_id)
+    return JsonResponse(conversation_json(convo))
+
+
+@require_http_methods(["GET"])
+def conversation_snapshot(request, conversation_id):
+    """
+    Returns a conversation with a page of its messages (newest first), each with the
+    previews of its thoughts in the order they were added
+    The page is read from the conversation's snapshot, or built from the tables in
+    the same format if it has none (see snapshots.py).
+    """
+    convo = get_object_or_404(Conversation, id=conversation_id)
+    ordering = ("-sent_datetime", "-id")
+    page = keyset_paginate(conversation_messages(convo), ordering, request)
+    page.items = as_snapshot_messages(page.items)
+    return JsonResponse(
+        {
+            "conversation": conversation_json(convo),
+            **page_json(page, snapshot_message_json),
+        }
+    )
+
+
+@api_write
+@require_http_methods(["POST"])
+def bulk_conversations(request):
+    """
+    Creates conversations from {"conversations": [{"title": ...}, ...]}
+    Returns the ids of the new conversations, in the order they were sent
+    """
+    items, response = bulk_items(request, "conversations")
+    if response:
+        return response
+    objects, errors = validate_items(items, ConversationForm)
+    if errors:
+        return error("Invalid conversations", errors=errors)
+
+    created = create_conversations(objects)
+    return JsonResponse({"ids": [convo.id for convo in created]}, status=201)
+
+
+@api_write
+@require_http_methods(["GET", "POST"])
+def messages(request, conversation_id):
+    """
+    GET lists the messages in a conversation (newest first),
+    POST creates one from {"text": ...}
+    """
+    convo = get_object_or_404(Conversation, id=conversation_id)
+    if request.method == "POST":
+        body, response = parse_body(request)
+        if response:
+            return response
+        form = MessageForm(data=body)
+        if not form.is_valid():
+            return error("Invalid message", errors=form.errors)
+        message = form.save(commit=False)
+        message.conversation = convo
+        with transaction.atomic(using=conversation_db()):
+            message.save()
+        return JsonResponse(message_json(message), status=201)
+
+    page = keyset_paginate(convo.message_set.all(), ("-sent_datetime", "-id"), request)
+    return JsonResponse(page_json(page, message_json))
+
+
+@api_write
+@require_http_methods(["POST"])
+def bulk_messages(request, conversation_id):
+    """
+    Creates messages in a conversation from {"messages": [{"text": ...}, ...]}
+    Returns the ids of the new messages, in the order they were sent
+    """
+    convo = get_object_or_404(Conversation, id=conversation_id)
+    items, response = bulk_items(request, "messages")
+    if response:
+        return response
+    objects, errors = validate_items(items, MessageForm)
+    if errors:
+        return error("Invalid messages", errors=errors)
+
+    for message in objects:
+        message.conversation = convo
+    with transaction.atomic(using=conversation_db()):
+        created = create_messages(convo.id, objects)
+    return JsonResponse({"ids": [message.id for message in created]}, status=201)
+
+
+@require_http_methods(["GET"])
+def message(request, message_id):
+    message = get_object_or_404(Message, id=message_id)
+    return JsonResponse(message_json(message))
+
+
+@api_write
+@require_http_methods(["GET", "POST"])
+def thoughts(request, message_id):
+    """
+    GET lists the thoughts for a message (newest first),
+    POST creates one from {"text": ...}
+    """
+    msg = get_object_or_404(Message, id=message_id)
+    if request.method == "POST":
+        body, response = parse_body(request)
+        if response:
+            return response
+        form = ThoughtForm(data=body)
+        if not form.is_valid():
+            return error("Invalid thought", errors=form.errors)
+        thought = form.save(commit=False)
+        thought.message = msg
+        with transaction.atomic(using=conversation_db()):
+            thought.save()
+        return JsonResponse(thought_json(thought), status=201)
+
+    page = keyset_paginate(msg.thought_set.all(), ("-sent_datetime", "-id"), request)
+    return JsonResponse(page_json(page, thought_json))
+
+
+@api_write
+@require_http_methods(["POST"])
+def bulk_thoughts(request, message_id):
+    """
+    Creates thoughts for a message from {"thoughts": [{"text": ...}, ...]}
+    Returns the ids of the new thoughts, in the order they were sent
+    """
+    msg = get_object_or_404(Message, id=message_id)
+    items, response = bulk_items(request, "thoughts")
+    if response:
+        return response
+    objects, errors = validate_items(items, ThoughtForm)
+    if errors:
+        return error("Invalid thoughts", errors=errors)
+
+    for thought in objects:
+        thought.message = msg
+    with transaction.atomic(using=conversation_db()):
+        created = create_thoughts(msg, objects)
+    return JsonResponse({"ids": [thought.id for thought in created]}, status=201)
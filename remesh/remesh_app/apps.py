@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class RemeshAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "remesh_app"
+
+    def ready(self):
+        # Connect the signal handlers that keep the denormalized counters up to date,
+        # invalidate cached pages, publish live updates, number the rows of shards and
+        # update the conversation snapshots
+        from . import cache, counters, events, shards, snapshots  # noqa: F401
@@ -0,0 +1,261 @@
+import json
+import zlib
+from datetime import date, timedelta
+from functools import lru_cache
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import DateField
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import (
+    ArchivedConversation,
+    ArchivedMessage,
+    Conversation,
+    Message,
+    Thought,
+)
+from .shards import conversation_db, delete_conversation_rows
+from .snapshots import rebuild_snapshot
+
+# Archival of inactive conversations
+# `manage.py archive_conversations` moves the conversations without activity for
+# ARCHIVE_AFTER_DAYS days, with their messages and thoughts, out of the conversation,
+# message and thought tables (and the search index) into one ArchivedConversation
+# row each, holding all their rows as zlib compressed JSON. The hot tables and their
+# indexes then only hold the conversations still in use.
+# The conversation and message pages read archived conversations back, read-only,
+# through an LRU cache of ARCHIVE_CACHE_SIZE decoded archives. Archived
+# conversations are listed on their own page, and title searches match them by
+# substring after the indexed results, but their messages and thoughts aren't
+# searched and the API doesn't return them. `manage.py restore_conversation` puts one
+# back in the hot tables with the same ids (and rebuilds its snapshot, see
+# snapshots.py).
+
+ARCHIVE_AFTER_DAYS = getattr(settings, "REMESH_ARCHIVE_AFTER_DAYS", 90)
+ARCHIVE_CACHE_SIZE = getattr(settings, "REMESH_ARCHIVE_CACHE_SIZE", 32)
+
+# Models stored in an archive, under these keys
+ARCHIVED_MODELS = {
+    "conversation": Conversation,
+    "messages": Message,
+    "thoughts": Thought,
+}
+
+
+class ConversationArchive:
+    """
+    A decoded archive, as model instances that aren't in the database
+    messages are newest first, like on the conversation page, and thoughts maps the
+    id of each message to its thoughts, newest first.
+    """
+
+    def __init__(self, payload: dict, using: str):
+        rows = {
+            key: [
+                model.from_db(using, payload[key]["fields"], values)
+                for values in decode_rows(model, payload[key])
+            ]
+            for key, model in ARCHIVED_MODELS.items()
+        }
+        (self.conversation,) = rows["conversation"]
+        newest_first = attrgetter("sent_datetime", "id")
+        self.messages = sorted(rows["messages"], key=newest_first, reverse=True)
+        self.message_ids = {}
+        for message in self.messages:
+            message.conversation = self.conversation
+            self.message_ids[message.id] = message
+        self.thoughts = {}
+        for thought in sorted(rows["thoughts"], key=newest_first, reverse=True):
+            thought.message = self.message_ids[thought.message_id]
+            self.thoughts.setdefault(thought.message_id, []).append(thought)
+
+
+def encode_rows(queryset) -> dict:
+    """
+    Returns the values of every concrete field of the rows of queryset, JSON
+    serializable
+    """
+    fields = [field.attname for field in queryset.model._meta.concrete_fields]
+    rows = [
+        [value.isoformat() if isinstance(value, date) else value for value in values]
+        for values in queryset.order_by("id").values_list(*fields)
+    ]
+    return {"fields": fields, "rows": rows}
+
+
+def decode_rows(model, encoded: dict) -> list:
+    """
+    Turns rows from encode_rows() back into lists of field values
+    """
+    fields = [model._meta.get_field(name) for name in encoded["fields"]]
+    # Only dates and datetimes need converting from their JSON representation
+    dates = [i for i, field in enumerate(fields) if isinstance(field, DateField)]
+    rows = []
+    for values in encoded["rows"]:
+        for i in dates:
+            values[i] = fields[i].to_python(values[i])
+        rows.append(values)
+    return rows
+
+
+def archive_conversation(conversation_id, inactive_since=None) -> bool:
+    """
+    Moves a conversation with its messages and thoughts into an archive, in one
+    transaction
+    With inactive_since, only archives it if it has had no activity since then.
+    Returns whether it was archived
+    """
+    using = conversation_db()
+    table = Conversation._meta.db_table
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # Any write takes the lock in SQLite, so nothing can be added meanwhile
+        cursor.execute(f"UPDATE {table} SET id = id WHERE id = %s", [conversation_id])
+        convo = Conversation.objects.filter(id=conversation_id).first()
+        if convo is None:
+            return False
+        if inactive_since is not None and convo.last_activity >= inactive_since:
+            return False
+        payload = {
+            "conversation": encode_rows(Conversation.objects.filter(id=convo.id)),
+            "messages": encode_rows(Message.objects.filter(conversation=convo)),
+            "thoughts": encode_rows(
+                Thought.objects.filter(message__conversation=convo)
+            ),
+        }
+        data = zlib.compress(json.dumps(payload, separators=(",", ":")).encode())
+        ArchivedConversation.objects.create(
+            id=convo.id,
+            title=convo.title,
+            message_count=convo.message_count,
+            thought_count=convo.thought_count,
+            last_activity=convo.last_activity,
+            data=data,
+        )
+        message_ids = [values[0] for values in payload["messages"]["rows"]]
+        ArchivedMessage.objects.bulk_create(
+            [ArchivedMessage(id=i, conversation_id=convo.id) for i in message_ids]
+        )
+        # The delete triggers remove the rows from the search index
+        delete_conversation_rows(cursor, convo.id)
+        bump_archived_pages(convo.id, message_ids)
+    return True
+
+
+def archive_inactive(days=ARCHIVE_AFTER_DAYS, limit=None) -> int:
+    """
+    Archives the conversations without activity for days days, oldest first, each
+    in its own transaction
+    Returns the number of conversations archived
+    """
+    inactive_since = timezone.now() - timedelta(days=days)
+    conversation_ids = list(
+        Conversation.objects.filter(last_activity__lt=inactive_since)
+        .order_by("last_activity")
+        .values_list("id", flat=True)[:limit]
+    )
+    return sum(
+        archive_conversation(conversation_id, inactive_since)
+        for conversation_id in conversation_ids
+    )
+
+
+def restore_conversation(conversation_id):
+    """
+    Puts an archived conversation back in the hot tables, with the same ids
+    Returns the number of (messages, thoughts) restored, or None if the conversation
+    isn't archived
+    """
+    using = conversation_db()
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        entry = ArchivedConversation.objects.filter(id=conversation_id).first()
+        if entry is None:
+            return None
+        payload = json.loads(zlib.decompress(entry.data))
+        for key, model in ARCHIVED_MODELS.items():
+            # Inserted as stored, since saving through the ORM would set new dates
+            # (auto_now_add). The insert triggers add the rows to the search index.
+            fields = [model._meta.get_field(name) for name in payload[key]["fields"]]
+            columns = ", ".join(field.column for field in fields)
+            placeholders = ", ".join(["%s"] * len(fields))
+            cursor.executemany(
+                f"INSERT INTO {model._meta.db_table} ({columns}) "
+                f"VALUES ({placeholders})",
+                [
+                    [
+                        field.get_db_prep_save(value, connection)
+                        for field, value in zip(fields, values)
+                    ]
+                    for values in decode_rows(model, payload[key])
+                ],
+            )
+        # Deletes its ArchivedMessage rows too
+        entry.delete()
+        # Its snapshot was deleted when it was archived
+        rebuild_snapshot(conversation_id)
+        message_ids = [values[0] for values in payload["messages"]["rows"]]
+        bump_archived_pages(conversation_id, message_ids)
+    return len(message_ids), len(payload["thoughts"]["rows"])
+
+
+def bump_archived_pages(conversation_id, message_ids):
+    # The pages look the same, but archived ones have no links to add anything
+    for message_id in message_ids:
+        bump_version("message", message_id)
+    bump_version("conversation", conversation_id)
+    bump_version("conversations")
+
+
+def get_archive(conversation_id) -> ConversationArchive:
+    """
+    Returns the decoded archive of a conversation
+    Raises Conversation.DoesNotExist if it isn't archived
+    """
+    archived = (
+        ArchivedConversation.objects.filter(id=conversation_id)
+        .values_list("archived", flat=True)
+        .first()
+    )
+    if archived is None:
+        raise Conversation.DoesNotExist("Conversation matching query does not exist.")
+    return load_archive(conversation_id, archived)
+
+
+def find_archived_message(message_id):
+    """
+    Returns the decoded archive holding a message, and the message
+    Raises Message.DoesNotExist if it isn't archived
+    """
+    row = (
+        ArchivedMessage.objects.filter(id=message_id)
+        .values_list("conversation_id", "conversation__archived")
+        .first()
+    )
+    if row is None:
+        raise Message.DoesNotExist("Message matching query does not exist.")
+    archive = load_archive(*row)
+    return archive, archive.message_ids[message_id]
+
+
+@lru_cache(maxsize=ARCHIVE_CACHE_SIZE)
+def load_archive(conversation_id, archived) -> ConversationArchive:
+    """
+    Reads and decodes an archive, cached by conversation id and archival time
+    An archive never changes, and a conversation archived again after being restored
+    has a new archival time, so cached archives are never stale.
+    """
+    using = conversation_db()
+    data = (
+        ArchivedConversation.objects.filter(id=conversation_id)
+        .values_list("data", flat=True)
+        .get()
+    )
+    return ConversationArchive(json.loads(zlib.decompress(data)), using)
+
+
+aget_archive = sync_to_async(get_archive)
+afind_archived_message = sync_to_async(find_archived_message)
@@ -0,0 +1,203 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.shortcuts import render
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+
+from .archive import afind_archived_message, aget_archive
+from .cache import CACHE_TIMEOUT, cached_page
+from .conditional import (
+    aconversation_validators,
+    aconversations_validators,
+    amessage_validators,
+    conditional_page,
+)
+from .events import conversation_channel, format_event, get_broker, live_events
+from .models import Conversation, Message, Thought
+from .pagination import akeyset_paginate, keyset_paginate_list
+from .search import aranked_search, asearch_conversations
+from .shards import akeyset_paginate_shards
+from .snapshots import aconversation_messages
+
+# Async versions of the read views, for serving under ASGI (remesh/asgi.py).
+# They return the same pages as the views in views.py, but use the async ORM, so
+# the view itself never runs in a worker thread. All the queries are done before
+# rendering, since templates can't run queries from async code.
+# Note that Django 4.2 still runs each query of the async ORM in a thread, since
+# its database backends are synchronous.
+
+# Seconds between keep-alive comments on idle event streams
+EVENTS_HEARTBEAT = getattr(settings, "REMESH_EVENTS_HEARTBEAT", 15)
+# Seconds after which an event stream is closed, the browser then reconnects.
+# This bounds how long the stream of a client that went away stays open.
+EVENTS_MAX_AGE = getattr(settings, "REMESH_EVENTS_MAX_AGE", 300)
+
+
+@conditional_page(aconversations_validators)
+@cached_page("conversations")
+async def conversations(request):
+    """
+    Returns a page showing all the conversations
+    Sorted by start date, or by most recent activity with ?sort=activity
+    """
+    sort = request.GET.get("sort")
+    if sort == "activity":
+        ordering = ("-last_activity", "-id")
+    else:
+        ordering = ("-start_date", "id")
+    page = await akeyset_paginate_shards(Conversation.objects.all(), ordering, request)
+    return render(
+        request,
+        "remesh_app/conversations.html",
+        {"conversations": page.items, "page": page, "sort": sort},
+    )
+
+
+@conditional_page(aconversation_validators)
+@cached_page("conversation", "conversation_id")
+async def conversation(request, conversation_id):
+    """
+    Returns a page for a conversation, showing the messages and their thought counts
+    """
+    ordering = ("-sent_datetime", "-id")
+    archived = False
+    try:
+        convo = await Conversation.objects.aget(id=conversation_id)
+    except Conversation.DoesNotExist:
+        # Shown read-only from its archive, if it was archived
+        archive = await aget_archive(conversation_id)
+        convo = archive.conversation
+        page = keyset_paginate_list(archive.messages, Message, ordering, request)
+        archived = True
+    else:
+        messages = await aconversation_messages(convo)
+        page = await akeyset_paginate(messages, ordering, request)
+    message_dict = {}
+    for message in page:
+        message_dict[str(message.id)] = message
+    # The template reads the message fragments from the cache, which may be a
+    # synchronous backend (e.g. the database cache)
+    return await sync_to_async(render)(
+        request,
+        "remesh_app/conversation.html",
+        {
+            "conversation": convo,
+            "message_dict": message_dict,
+            "page": page,
+            "fragment_timeout": CACHE_TIMEOUT,
+            "archived": archived,
+            "live_events": live_events(request),
+        },
+    )
+
+
+@conditional_page(amessage_validators)
+@cached_page("message", "message_id")
+async def message(request, message_id):
+    """
+    Returns a page for a message, showing the thoughts
+    """
+    ordering = ("-sent_datetime", "-id")
+    archived = False
+    try:
+        message = await Message.objects.aget(id=message_id)
+    except Message.DoesNotExist:
+        # Shown read-only from the archive of its conversation, if it was archived
+        archive, message = await afind_archived_message(message_id)
+        thoughts = archive.thoughts.get(message.id, [])
+        page = keyset_paginate_list(thoughts, Thought, ordering, request)
+        archived = True
+    else:
+        page = await akeyset_paginate(message.thought_set.all(), ordering, request)
+    return render(
+        request,
+        "remesh_app/message.html",
+        {
+            "message": message,
+            "thoughts": page.items,
+            "page": page,
+            "archived": archived,
+        },
+    )
+
+
+async def search(request, search_type, conversation_id=None):
+    """
+    Searches for objects based on their type
+    conversation_id limits message and thought searches to one conversation
+    Results come from the full-text index, ranked best match first
+    Returns a search result page
+    """
+    query = request.GET.get("q", "")
+    context = {}
+    if search_type in ("messages", "thoughts"):
+        convo = await Conversation.objects.aget(id=conversation_id)
+        results = await aranked_search(search_type, query, conversation_id)
+        if results is None:
+            # Terms shorter than 3 characters can't use the search index
+            if search_type == "messages":
+                results = convo.message_set.filter(text__contains=query)
+            else:
+                results = Thought.objects.filter(
+                    message__conversation=convo, text__contains=query
+                )
+            results = [result async for result in results]
+        context = {
+            "results": results,
+            "search_type": search_type,
+            "conversation_id": conversation_id,
+        }
+    elif search_type == "conversations":
+        results = await asearch_conversations(query)
+        context = {
+            "results": results,
+            "search_type": search_type,
+        }
+    else:
+        return HttpResponse(
+            "Invalid search type. Please contact the developer and tell them to fix their app."
+        )
+
+    return render(request, "remesh_app/search_results.html", context)
+
+
+async def conversation_events(request, conversation_id):
+    """
+    Streams the new messages and thoughts in a conversation as Server-Sent Events
+    Each event is only the new row, rendered into the page by conversation.html.
+    An idle stream costs a queue and a suspended coroutine, without a thread or a
+    database connection.
+    Answers 204 No Content outside of ASGI, which tells the browser not to reconnect.
+    """
+    if not live_events(request):
+        return HttpResponse(status=204)
+    if not await Conversation.objects.filter(id=conversation_id).aexists():
+        raise Http404("Conversation does not exist")
+    subscription = get_broker().subscribe(conversation_channel(conversation_id))
+
+    async def stream():
+        deadline = time.monotonic() + EVENTS_MAX_AGE
+        try:
+            # Tells the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.__anext__(), EVENTS_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                except StopAsyncIteration:
+                    break
+                yield format_event(event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stops proxies like nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from .models import Conversation, Message, Thought
+from .routers import request_state
+from .shards import conversation_db
+
+# Rendered pages are stored in the cache alias given by REMESH_PAGE_CACHE (see the
+# CACHES setting for the available backends). Each cached page is keyed on the id of
+# the object it shows plus a version number. Saving or deleting an object bumps the
+# versions of every page that shows it, so stale pages are never served and simply
+# expire from the cache.
+CACHE_ALIAS = getattr(settings, "REMESH_PAGE_CACHE", "pages")
+CACHE_TIMEOUT = getattr(settings, "REMESH_PAGE_CACHE_TIMEOUT", 60 * 60)
+
+HITS_KEY = "remesh:stats:hits"
+MISSES_KEY = "remesh:stats:misses"
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def version_key(kind: str, object_id=None) -> str:
+    return f"remesh:version:{kind}:{object_id}"
+
+
+def get_version(kind: str, object_id=None) -> int:
+    """
+    Returns the current version of the pages for an object (or for a list page,
+    when object_id is None)
+    """
+    key = version_key(kind, object_id)
+    version = get_cache().get(key)
+    if version is None:
+        # Start from a unique value, so a version that was evicted from the cache can
+        # never line up with a page that was cached under the old version
+        get_cache().add(key, time.time_ns(), timeout=None)
+        version = get_cache().get(key)
+    return version
+
+
+def bump_version(kind: str, object_id=None):
+    """
+    Invalidates all cached pages for an object
+    The version is bumped right away, and again once the current transaction commits,
+    so a page rendered from the old data in between is never served
+    """
+
+    def bump():
+        try:
+            get_cache().incr(version_key(kind, object_id))
+        except ValueError:
+            # No version stored yet, so there can't be any cached pages either
+            pass
+
+    bump()
+    transaction.on_commit(bump, using=conversation_db())
+
+
+def bump_versions(kind: str, object_ids):
+    """
+    bump_version() for many objects, with one cache call
+    Their versions are deleted instead of incremented, so like evicted versions they
+    start again from a new unique value.
+    """
+    keys = [version_key(kind, object_id) for object_id in object_ids]
+    if not keys:
+        return
+
+    def bump():
+        get_cache().delete_many(keys)
+
+    bump()
+    transaction.on_commit(bump, using=conversation_db())
+
+
+def cached_page(kind: str, id_kwarg=None):
+    """
+    Decorator for read views that caches the rendered page
+    kind is the version namespace (e.g. "conversation"), and id_kwarg is the name of
+    the view argument holding the object id. Only successful GET responses are cached.
+    Works with both sync and async views.
+    """
+
+    def lookup(request, object_id):
+        """
+        Returns (cache key, cached response or None) and counts the hit or miss
+        """
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        version = get_version(kind, object_id)
+        key = f"remesh:response:{kind}:{object_id}:{version}:{path}"
+        cached = get_cache().get(key)
+        record(MISSES_KEY if cached is None else HITS_KEY)
+        if cached is None:
+            return key, None
+        content, headers = cached
+        return key, HttpResponse(content, headers=headers)
+
+    def store(key, response):
+        # A page read from a replica that is behind may be older than the version it
+        # would be stored under, so it isn't cached
+        state = request_state.get()
+        if state and state.read_lagging:
+            return
+        # The headers are kept with the content, so a cached page has the same
+        # Content-Type, Vary etc. as the page the view returned
+        if response.status_code == 200:
+            cached = (response.content, dict(response.items()))
+            get_cache().set(key, cached, timeout=CACHE_TIMEOUT)
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method != "GET":
+                    return await view(request, *args, **kwargs)
+
+                object_id = kwargs.get(id_kwarg) if id_kwarg else None
+                key, cached = await sync_to_async(lookup)(request, object_id)
+                if cached is not None:
+                    return cached
+                response = await view(request, *args, **kwargs)
+                await sync_to_async(store)(key, response)
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+
+            object_id = kwargs.get(id_kwarg) if id_kwarg else None
+            key, cached = lookup(request, object_id)
+            if cached is not None:
+                return cached
+            response = view(request, *args, **kwargs)
+            store(key, response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def record(key: str):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_stats() -> dict:
+    """
+    Returns the page cache hit and miss counters and the hit ratio
+    """
+    hits = get_cache().get(HITS_KEY, 0)
+    misses = get_cache().get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else 0.0,
+    }
+
+
+# The message and thought counts on the conversations page change with every write,
+# so it is invalidated by all of them
+
+
+@receiver(post_save, sender=Conversation)
+@receiver(post_delete, sender=Conversation)
+def conversation_changed(sender, instance, **kwargs):
+    bump_version("conversation", instance.id)
+    bump_version("conversations")
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_changed(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Conversation):
+        return
+    bump_version("message", instance.id)
+    bump_version("conversation", instance.conversation_id)
+    bump_version("conversations")
+
+
+@receiver(post_save, sender=Thought)
+@receiver(post_delete, sender=Thought)
+def thought_changed(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, (Conversation, Message)):
+        return
+    if Thought.message.is_cached(instance):
+        conversation_id = instance.message.conversation_id
+    else:
+        conversation_id = (
+            Message.objects.filter(id=instance.message_id)
+            .values_list("conversation_id", flat=True)
+            .first()
+        )
+    bump_version("message", instance.message_id)
+    bump_version("conversation", conversation_id)
+    bump_version("conversations")
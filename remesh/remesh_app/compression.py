@@ -0,0 +1,92 @@
+import zlib
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Compression of long message and thought texts (see models.CompressedTextField)
+# Texts of COMPRESS_MIN_BYTES or more (in UTF-8) are stored zlib compressed, as a
+# BLOB, and shorter ones as plain text, so the column holds both. SQLite code reads
+# the text with the remesh_decompress() SQL function, registered here on every
+# connection; the search index triggers use it, so the database can't be written to
+# by tools that don't define it (like the sqlite3 shell).
+
+COMPRESS_MIN_BYTES = getattr(settings, "REMESH_COMPRESS_MIN_BYTES", 1024)
+
+# zlib's default level, higher levels are much slower for a few percent less
+COMPRESS_LEVEL = 6
+
+DECOMPRESS_FUNCTION = "remesh_decompress"
+
+# Rows converted per query by compress_existing()
+CONVERT_BATCH_SIZE = 1000
+
+
+def compress_text(text):
+    """
+    Returns text compressed as bytes if it is long enough and gets smaller, else text
+    """
+    if not isinstance(text, str):
+        return text
+    data = text.encode()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return text
+    compressed = zlib.compress(data, COMPRESS_LEVEL)
+    return compressed if len(compressed) < len(data) else text
+
+
+def decompress_text(value):
+    """
+    Returns the text stored as value by compress_text()
+    """
+    if isinstance(value, (bytes, memoryview)):
+        return zlib.decompress(value).decode()
+    return value
+
+
+@receiver(connection_created)
+def register_functions(sender, connection, **kwargs):
+    if connection.vendor == "sqlite":
+        connection.connection.create_function(
+            DECOMPRESS_FUNCTION, 1, decompress_text, deterministic=True
+        )
+
+
+def compress_existing(cursor, table: str, column: str) -> int:
+    """
+    Compresses the plain texts of column long enough to be compressed, in batches
+    Returns the number of rows compressed
+    """
+    compressed = 0
+    last_id = 0
+    while True:
+        cursor.execute(
+            f"SELECT id, {column} FROM {table} WHERE id > %s "
+            f"AND typeof({column}) = 'text' "
+            f"AND length(CAST({column} AS BLOB)) >= %s "
+            "ORDER BY id LIMIT %s",
+            [last_id, COMPRESS_MIN_BYTES, CONVERT_BATCH_SIZE],
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return compressed
+        last_id = rows[-1][0]
+        updates = []
+        for row_id, text in rows:
+            value = compress_text(text)
+            if isinstance(value, bytes):
+                updates.append((value, row_id))
+        cursor.executemany(f"UPDATE {table} SET {column} = %s WHERE id = %s", updates)
+        compressed += len(updates)
+
+
+def decompress_existing(cursor, table: str, column: str) -> int:
+    """
+    Stores every compressed text of column as plain text again
+    Returns the number of rows changed
+    """
+    cursor.execute(
+        f"UPDATE {table} SET {column} = {DECOMPRESS_FUNCTION}({column}) "
+        f"WHERE typeof({column}) = 'blob'"
+    )
+    return cursor.rowcount
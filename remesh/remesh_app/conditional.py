@@ -0,0 +1,165 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .cache import get_version
+from .models import (
+    ArchivedConversation,
+    ArchivedMessage,
+    Conversation,
+    Message,
+    Thought,
+)
+from .shards import fan_out
+
+# Validators for conditional GET (ETag / Last-Modified) on the read views.
+# Each validator function loads everything it needs in one indexed query, without
+# rendering the page, so answering 304 Not Modified costs a single row lookup.
+# The page cache version is part of every ETag, since edits (e.g. a renamed
+# conversation) don't change any counts or timestamps.
+
+
+def conditional_page(validators):
+    """
+    Decorator adding ETag and Last-Modified headers to a view, answering 304 when the
+    client's copy is current
+    validators(request, *args, **kwargs) returns (etag, last_modified), or None if the
+    object doesn't exist. It is only called once per request.
+    Async validators must be used with async views.
+    """
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                etag, last_modified = validate(
+                    await validators(request, *args, **kwargs)
+                )
+                response = conditional_response(request, etag, last_modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return add_validators(request, response, etag, last_modified)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag, last_modified = validate(validators(request, *args, **kwargs))
+            response = conditional_response(request, etag, last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return add_validators(request, response, etag, last_modified)
+
+        return wrapper
+
+    return decorator
+
+
+def validate(result) -> tuple:
+    """
+    Returns the quoted ETag and the Last-Modified timestamp for the result of a
+    validators function
+    """
+    etag, last_modified = result if result else (None, None)
+    etag = quote_etag(etag) if etag is not None else None
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    return etag, last_modified
+
+
+def conditional_response(request, etag, last_modified):
+    """
+    Returns the 304 (or 412) response for a request, or None if the view should run
+    Last-Modified only has a resolution of one second, so a page can change without
+    changing it (a second thought in the same second, or an edit). If-Modified-Since
+    is only checked for pages without an ETag, whose version covers every change.
+    """
+    return get_conditional_response(
+        request, etag=etag, last_modified=None if etag else last_modified
+    )
+
+
+def add_validators(request, response, etag, last_modified):
+    if request.method in ("GET", "HEAD"):
+        if last_modified and not response.has_header("Last-Modified"):
+            response.headers["Last-Modified"] = http_date(last_modified)
+        if etag:
+            response.headers.setdefault("ETag", etag)
+    return response
+
+
+def conversations_validators(request):
+    # The most recently active conversation comes from the last_activity index (of
+    # each shard, with sharding)
+    latest = fan_out(
+        lambda: Conversation.objects.order_by("-last_activity")
+        .values_list("last_activity", flat=True)
+        .first()
+    )
+    latest = max(filter(None, latest), default=None)
+    if latest is None:
+        return None
+    return f"{latest.timestamp()}-{get_version('conversations')}", latest
+
+
+def conversation_validators(request, conversation_id):
+    fields = ("message_count", "thought_count", "last_activity")
+    row = Conversation.objects.filter(id=conversation_id).values_list(*fields).first()
+    if row is None:
+        row = (
+            ArchivedConversation.objects.filter(id=conversation_id)
+            .values_list(*fields)
+            .first()
+        )
+    if row is None:
+        return None
+    message_count, thought_count, last_activity = row
+    version = get_version("conversation", conversation_id)
+    etag = f"{message_count}-{thought_count}-{last_activity.timestamp()}-{version}"
+    return etag, last_activity
+
+
+def message_validators(request, message_id):
+    last_thought = (
+        Thought.objects.filter(message=OuterRef("pk"))
+        .order_by("-sent_datetime")
+        .values("sent_datetime")[:1]
+    )
+    row = (
+        Message.objects.filter(id=message_id)
+        .annotate(last_thought=Subquery(last_thought))
+        .values_list("thought_count", "sent_datetime", "last_thought")
+        .first()
+    )
+    if row is None:
+        return archived_message_validators(message_id)
+    thought_count, sent_datetime, last_thought = row
+    last_modified = last_thought or sent_datetime
+    version = get_version("message", message_id)
+    etag = f"{thought_count}-{last_modified.timestamp()}-{version}"
+    return etag, last_modified
+
+
+def archived_message_validators(message_id):
+    # An archived conversation doesn't change, so its last activity is the last time
+    # any of its messages changed
+    last_activity = (
+        ArchivedMessage.objects.filter(id=message_id)
+        .values_list("conversation__last_activity", flat=True)
+        .first()
+    )
+    if last_activity is None:
+        return None
+    version = get_version("message", message_id)
+    return f"archived-{last_activity.timestamp()}-{version}", last_activity
+
+
+# Async versions for the async views. Each one runs its sync version in a single
+# thread hop, which is cheaper than separate hops for the query and the cache.
+aconversations_validators = sync_to_async(conversations_validators)
+aconversation_validators = sync_to_async(conversation_validators)
+amessage_validators = sync_to_async(message_validators)
@@ -0,0 +1,190 @@
+from django.db import connections, router
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Conversation, Message, Thought
+
+# The message and thought counts and last activity timestamps on Conversation and
+# Message are updated here whenever a row is created or deleted. Updates use F()
+# expressions, so concurrent writers never overwrite each other's increments.
+# Writers that bypass signals (bulk_create) should call messages_added() or
+# thoughts_added() (or counts_added() for many rows at once), or reconcile_counters()
+# afterwards.
+
+# Rows changed per UPDATE by counts_added(), with 3 parameters each (SQLite allows
+# 32766 per statement)
+COUNTS_BATCH_SIZE = 5000
+
+
+def latest(timestamp):
+    """
+    Expression for last_activity that never moves backwards in time
+    """
+    return Greatest(Coalesce(F("last_activity"), Value(timestamp)), Value(timestamp))
+
+
+def messages_added(conversation_id, count: int, last_sent):
+    """
+    Counts count new messages in a conversation, the newest sent at last_sent
+    """
+    Conversation.objects.filter(id=conversation_id).update(
+        message_count=F("message_count") + count,
+        last_activity=latest(last_sent),
+    )
+
+
+def thoughts_added(message_id, count: int, last_sent):
+    """
+    Counts count new thoughts for a message, the newest sent at last_sent
+    """
+    Message.objects.filter(id=message_id).update(
+        thought_count=F("thought_count") + count
+    )
+    Conversation.objects.filter(message__id=message_id).update(
+        thought_count=F("thought_count") + count,
+        last_activity=latest(last_sent),
+    )
+
+
+def counts_added(model, field: str, counts: dict):
+    """
+    Adds to the field counter of many rows of model in one UPDATE per
+    COUNTS_BATCH_SIZE rows
+    counts maps row ids to (count, newest sent). The last_activity of conversations
+    is moved forward to the newest sent, like messages_added() does.
+    """
+    table = model._meta.db_table
+    sql = f"UPDATE {table} SET {field} = {field} + delta.column2"
+    if model is Conversation:
+        sql += (
+            ", last_activity = MAX(COALESCE(last_activity, delta.column3), "
+            "delta.column3)"
+        )
+    items = list(counts.items())
+    connection = connections[router.db_for_write(model)]
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), COUNTS_BATCH_SIZE):
+            batch = items[start : start + COUNTS_BATCH_SIZE]
+            params = []
+            for row_id, (count, last_sent) in batch:
+                last_sent = connection.ops.adapt_datetimefield_value(last_sent)
+                params += [row_id, count, last_sent]
+            values = ", ".join(["(%s, %s, %s)"] * len(batch))
+            cursor.execute(
+                f"{sql} FROM (VALUES {values}) AS delta "
+                f"WHERE {table}.id = delta.column1",
+                params,
+            )
+
+
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    messages_added(instance.conversation_id, 1, instance.sent_datetime)
+
+
+@receiver(post_save, sender=Thought)
+def thought_created(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    thoughts_added(instance.message_id, 1, instance.sent_datetime)
+
+
+@receiver(pre_delete, sender=Message)
+def message_deleting(sender, instance, origin=None, **kwargs):
+    # Counted before the cascade deletes the thoughts, as the instance's thought_count
+    # may be older than the row
+    if isinstance(origin, Message):
+        instance.removed_thoughts = Thought.objects.filter(message=instance).count()
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    # Skip the update when the conversation itself is being deleted
+    if isinstance(origin, Conversation):
+        return
+    # When a single message is deleted, its thoughts are subtracted here in one update
+    # (see thought_deleted). Otherwise each thought subtracts itself.
+    removed_thoughts = getattr(instance, "removed_thoughts", 0)
+    Conversation.objects.filter(id=instance.conversation_id).update(
+        message_count=F("message_count") - 1,
+        thought_count=F("thought_count") - removed_thoughts,
+    )
+
+
+@receiver(post_delete, sender=Thought)
+def thought_deleted(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, (Conversation, Message)):
+        return
+    Message.objects.filter(id=instance.message_id).update(
+        thought_count=F("thought_count") - 1
+    )
+    Conversation.objects.filter(message__id=instance.message_id).update(
+        thought_count=F("thought_count") - 1
+    )
+
+
+def reconcile_counters() -> int:
+    """
+    Recomputes every counter and last activity timestamp from the source tables,
+    and fixes any that have drifted
+    Returns the number of messages and conversations that were changed
+    """
+    thought_count = Coalesce(
+        aggregate(
+            Thought.objects.filter(message=OuterRef("pk")), "message", Count("id")
+        ),
+        0,
+    )
+    fixed = (
+        Message.objects.annotate(expected=thought_count)
+        .exclude(thought_count=F("expected"))
+        .update(thought_count=thought_count)
+    )
+
+    # Message thought counts are correct now, so they can be summed directly
+    messages = Message.objects.filter(conversation=OuterRef("pk"))
+    thoughts = Thought.objects.filter(message__conversation=OuterRef("pk"))
+    message_count = Coalesce(aggregate(messages, "conversation", Count("id")), 0)
+    conversation_thought_count = Coalesce(
+        aggregate(messages, "conversation", Sum("thought_count")), 0
+    )
+    last_message = aggregate(messages, "conversation", Max("sent_datetime"))
+    last_thought = aggregate(thoughts, "message__conversation", Max("sent_datetime"))
+    # Conversations without any messages keep their creation time
+    last_activity = Coalesce(
+        Greatest(
+            Coalesce(last_message, last_thought), Coalesce(last_thought, last_message)
+        ),
+        F("last_activity"),
+    )
+    fixed += (
+        Conversation.objects.annotate(
+            expected_messages=message_count,
+            expected_thoughts=conversation_thought_count,
+            expected_activity=last_activity,
+        )
+        .exclude(
+            message_count=F("expected_messages"),
+            thought_count=F("expected_thoughts"),
+            last_activity=F("expected_activity"),
+        )
+        .update(
+            message_count=message_count,
+            thought_count=conversation_thought_count,
+            last_activity=last_activity,
+        )
+    )
+    return fixed
+
+
+def aggregate(queryset, group_by: str, expression) -> Subquery:
+    """
+    Wraps an aggregate over queryset (filtered with OuterRef) as a correlated subquery
+    """
+    return Subquery(
+        queryset.order_by().values(group_by).annotate(value=expression).values("value")
+    )
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Message, Thought
+from .shards import conversation_db
+
+# Live updates for the conversation page. New messages and thoughts are published to
+# the channel of their conversation once their transaction commits, and the
+# conversation_events view streams them to the browser as Server-Sent Events.
+# The broker class is set with REMESH_EVENT_BROKER. The default LocalBroker only
+# reaches subscribers in the same process. With several worker processes, a broker
+# class backed by a shared message bus (e.g. Redis pub/sub) with the same publish()
+# and subscribe() methods can be dropped in.
+
+BROKER_CLASS = getattr(settings, "REMESH_EVENT_BROKER", "remesh_app.events.LocalBroker")
+
+# Events waiting for a subscriber before it is dropped as too slow. The browser
+# reconnects and reloads the page, so nothing is lost.
+MAX_PENDING_EVENTS = getattr(settings, "REMESH_EVENTS_MAX_PENDING", 100)
+
+
+class Subscription:
+    """
+    Events for one subscriber, read with `async for`
+    Ends when the subscriber falls more than MAX_PENDING_EVENTS behind.
+    """
+
+    def __init__(self, broker, channel: str):
+        self.broker = broker
+        self.channel = channel
+        # Events are put in the queue from the subscriber's event loop, since
+        # asyncio queues aren't thread safe
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.close()
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+class LocalBroker:
+    """
+    In-process publish/subscribe
+    Subscribing costs one queue, so thousands of idle subscribers only use memory.
+    publish() can be called from any thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.channel]
+
+    def publish(self, channel: str, event: dict):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(subscription)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(BROKER_CLASS)()
+    return _broker
+
+
+def live_events(request) -> bool:
+    """
+    Returns whether a request is served through ASGI, which live events need
+    Under WSGI, Django reads the whole stream before sending any of it, so a stream
+    would hold a worker thread until it ends and never deliver an event.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def conversation_channel(conversation_id) -> str:
+    return f"conversation:{conversation_id}"
+
+
+def message_event(message) -> dict:
+    return {
+        "type": "message",
+        "id": message.id,
+        "conversation": message.conversation_id,
+        "summary": str(message),
+        "sent_datetime": message.sent_datetime,
+    }
+
+
+def thought_event(thought) -> dict:
+    return {
+        "type": "thought",
+        "id": thought.id,
+        "message": thought.message_id,
+        "summary": str(thought),
+        "sent_datetime": thought.sent_datetime,
+    }
+
+
+def publish_on_commit(conversation_id, events):
+    """
+    Publishes events to a conversation's subscribers once the current transaction
+    commits, so subscribers never see rows that were rolled back
+    """
+    if not events:
+        return
+    channel = conversation_channel(conversation_id)
+
+    def publish():
+        broker = get_broker()
+        for event in events:
+            broker.publish(channel, event)
+
+    transaction.on_commit(publish, using=conversation_db())
+
+
+def format_event(event: dict) -> str:
+    """
+    Formats an event as a Server-Sent Events message
+    """
+    data = json.dumps(event, cls=DjangoJSONEncoder)
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+@receiver(post_save, sender=Message)
+def message_published(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        publish_on_commit(instance.conversation_id, [message_event(instance)])
+
+
+@receiver(post_save, sender=Thought)
+def thought_published(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    if Thought.message.is_cached(instance):
+        conversation_id = instance.message.conversation_id
+    else:
+        conversation_id = (
+            Message.objects.filter(id=instance.message_id)
+            .values_list("conversation_id", flat=True)
+            .first()
+        )
+    publish_on_commit(conversation_id, [thought_event(instance)])
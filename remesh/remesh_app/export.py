@@ -0,0 +1,113 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Message, Thought
+
+# Streaming export of a conversation with all its messages and thoughts.
+# Rows are read with .iterator(), so memory use stays flat no matter how large the
+# conversation is. The output is one record per line: the conversation first, then
+# its messages and then its thoughts, each in the order they were sent.
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Number of rows fetched from the database at a time
+CHUNK_SIZE = getattr(settings, "REMESH_EXPORT_CHUNK_SIZE", 2000)
+
+# CSV columns, a record only fills in the ones that apply to its type
+CSV_FIELDS = [
+    "type",
+    "id",
+    "conversation",
+    "message",
+    "title",
+    "start_date",
+    "text",
+    "sent_datetime",
+]
+
+
+def export_records(conversation):
+    """
+    Yields a dict for the conversation, each of its messages and each of their thoughts
+    """
+    yield {
+        "type": "conversation",
+        "id": conversation.id,
+        "title": conversation.title,
+        "start_date": conversation.start_date.isoformat(),
+    }
+
+    # The lines are streamed after the view returned, so the database is given
+    # explicitly: it is the one the conversation was read from (its shard)
+    using = conversation._state.db
+    messages = (
+        Message.objects.using(using)
+        .filter(conversation=conversation)
+        .order_by("sent_datetime", "id")
+        .values_list("id", "text", "sent_datetime")
+    )
+    for message_id, text, sent_datetime in messages.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            "type": "message",
+            "id": message_id,
+            "conversation": conversation.id,
+            "text": text,
+            "sent_datetime": sent_datetime.isoformat(),
+        }
+
+    thoughts = (
+        Thought.objects.using(using)
+        .filter(message__conversation=conversation)
+        # Following the message order lets SQLite walk both indexes in step, only
+        # sorting the thoughts of one message at a time
+        .order_by("message__sent_datetime", "message_id", "sent_datetime", "id")
+        .values_list("id", "message_id", "text", "sent_datetime")
+    )
+    for thought_id, message_id, text, sent_datetime in thoughts.iterator(
+        chunk_size=CHUNK_SIZE
+    ):
+        yield {
+            "type": "thought",
+            "id": thought_id,
+            "message": message_id,
+            "text": text,
+            "sent_datetime": sent_datetime.isoformat(),
+        }
+
+
+class Echo:
+    """
+    File-like object that returns what is written to it, so csv.writer can be used
+    to produce lines for a generator
+    """
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + "\n"
+
+
+def csv_lines(records):
+    writer = csv.DictWriter(Echo(), fieldnames=CSV_FIELDS)
+    yield writer.writeheader()
+    for record in records:
+        yield writer.writerow(record)
+
+
+def export_lines(conversation, export_format: str):
+    """
+    Yields the lines of the export of a conversation in export_format ("ndjson" or "csv")
+    """
+    records = export_records(conversation)
+    if export_format == "csv":
+        return csv_lines(records)
+    return ndjson_lines(records)
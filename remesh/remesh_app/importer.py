@@ -0,0 +1,264 @@
+import csv
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .cache import bump_version, bump_versions
+from .counters import counts_added
+from .models import Conversation, ImportBatch, Message, Thought
+
+# Bulk import of conversations, messages and thoughts from NDJSON or CSV files in the
+# format written by export.py. Records are read as a stream and inserted with
+# bulk_create, one transaction per batch. Parent ids in the file are mapped to the ids
+# of the new rows with in-memory maps, so there is no lookup per row, and the counters
+# and cached pages of a batch's parents are updated with one statement each. Each
+# batch also saves an ImportBatch checkpoint, so an interrupted import resumes after
+# the last committed batch. The checkpoints are deleted once the import is complete.
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Fields auto_now_add fills in with the current time on insert
+AUTO_TIMESTAMP_FIELDS = {
+    Conversation: "start_date",
+    Message: "sent_datetime",
+    Thought: "sent_datetime",
+}
+
+
+@contextmanager
+def keep_timestamps(model):
+    """
+    Lets bulk_create() insert the timestamps set on the objects, instead of the current
+    time auto_now_add fills in
+    The field is changed for the whole process, which only the import_remesh command
+    runs in.
+    """
+    field = model._meta.get_field(AUTO_TIMESTAMP_FIELDS[model])
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def read_records(file, input_format: str):
+    """
+    Yields a dict for each record in an NDJSON or CSV file
+    """
+    if input_format == "csv":
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Importer:
+    """
+    Imports records into the database in batches
+    name identifies the import for checkpointing, usually the input file path
+    """
+
+    def __init__(self, name, batch_size=DEFAULT_BATCH_SIZE, preserve_timestamps=False):
+        self.name = name
+        self.batch_size = batch_size
+        self.preserve_timestamps = preserve_timestamps
+        self.records_done = 0
+        self.skipped = 0
+        # ids in the import file -> ids of the imported rows
+        self.conversation_ids = {}
+        # message ids in the import file -> [message id, conversation id]
+        self.message_ids = {}
+
+    def load_checkpoint(self):
+        """
+        Restores the progress and id maps of an earlier, interrupted run
+        """
+        for batch in ImportBatch.objects.filter(name=self.name).order_by("id"):
+            self.records_done = max(self.records_done, batch.records_done)
+            self.conversation_ids.update(batch.conversation_ids)
+            self.message_ids.update(batch.message_ids)
+
+    def clear_checkpoint(self):
+        ImportBatch.objects.filter(name=self.name).delete()
+
+    def run(self, records, progress=None):
+        """
+        Imports records, skipping the ones an earlier, interrupted run already
+        imported
+        progress(records_done, rows_per_second) is called after every batch
+        """
+        records = islice(records, self.records_done, None)
+        start = time.monotonic()
+        imported = 0
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                break
+            self.import_batch(batch)
+            imported += len(batch)
+            if progress:
+                elapsed = time.monotonic() - start
+                progress(self.records_done, imported / elapsed if elapsed else 0.0)
+        # The import is complete, so running it again imports the file again
+        self.clear_checkpoint()
+
+    def import_batch(self, batch):
+        conversations = []
+        messages = []
+        thoughts = []
+        for record in batch:
+            record_type = record.get("type")
+            if record_type == "conversation":
+                conversations.append(record)
+            elif record_type == "message":
+                messages.append(record)
+            elif record_type == "thought":
+                thoughts.append(record)
+            else:
+                self.skipped += 1
+
+        new_conversation_ids = {}
+        new_message_ids = {}
+        with transaction.atomic():
+            # Parents go first, so that children later in the same batch can find them
+            if conversations:
+                new_conversation_ids = self.import_conversations(conversations)
+            if messages:
+                new_message_ids = self.import_messages(messages)
+            if thoughts:
+                self.import_thoughts(thoughts)
+            self.records_done += len(batch)
+            ImportBatch.objects.create(
+                name=self.name,
+                records_done=self.records_done,
+                conversation_ids=new_conversation_ids,
+                message_ids=new_message_ids,
+            )
+
+    def timestamp(self, value, parse):
+        """
+        Parses a timestamp from the import file
+        Returns None (auto_now_add fills in the current time) unless timestamps
+        are preserved
+        """
+        if not self.preserve_timestamps:
+            return None
+        parsed = parse(value) if value else None
+        if parsed is None:
+            now = timezone.now()
+            return now.date() if parse is parse_date else now
+        if parse is parse_datetime and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+    def import_conversations(self, records) -> dict:
+        objects = []
+        for record in records:
+            convo = Conversation(
+                title=record.get("title") or "",
+                start_date=self.timestamp(record.get("start_date"), parse_date),
+            )
+            if self.preserve_timestamps:
+                # Historical conversations were last active when they started,
+                # until their messages are imported
+                convo.last_activity = datetime.combine(
+                    convo.start_date, datetime.min.time(), dt_timezone.utc
+                )
+            objects.append(convo)
+        created = self.bulk_create(Conversation, objects)
+        new_ids = {}
+        for record, convo in zip(records, created):
+            new_ids[str(record["id"])] = convo.id
+        self.conversation_ids.update(new_ids)
+        bump_version("conversations")
+        return new_ids
+
+    def import_messages(self, records) -> dict:
+        kept = []
+        objects = []
+        for record in records:
+            conversation_id = self.conversation_ids.get(str(record.get("conversation")))
+            if conversation_id is None:
+                self.skipped += 1
+                continue
+            kept.append(record)
+            objects.append(
+                Message(
+                    conversation_id=conversation_id,
+                    text=record.get("text") or "",
+                    sent_datetime=self.timestamp(
+                        record.get("sent_datetime"), parse_datetime
+                    ),
+                )
+            )
+        created = self.bulk_create(Message, objects)
+
+        new_ids = {}
+        added = {}
+        for record, message in zip(kept, created):
+            new_ids[str(record["id"])] = [message.id, message.conversation_id]
+            add_count(added, message.conversation_id, message.sent_datetime)
+        self.message_ids.update(new_ids)
+
+        # bulk_create doesn't send signals, so the counters and cache are updated here
+        counts_added(Conversation, "message_count", added)
+        bump_versions("conversation", added)
+        bump_version("conversations")
+        return new_ids
+
+    def import_thoughts(self, records):
+        objects = []
+        conversation_ids = {}
+        for record in records:
+            ids = self.message_ids.get(str(record.get("message")))
+            if ids is None:
+                self.skipped += 1
+                continue
+            message_id, conversation_id = ids
+            conversation_ids[message_id] = conversation_id
+            objects.append(
+                Thought(
+                    message_id=message_id,
+                    text=record.get("text") or "",
+                    sent_datetime=self.timestamp(
+                        record.get("sent_datetime"), parse_datetime
+                    ),
+                )
+            )
+        created = self.bulk_create(Thought, objects)
+
+        added = {}
+        conversations_added = {}
+        for thought in created:
+            add_count(added, thought.message_id, thought.sent_datetime)
+            conversation_id = conversation_ids[thought.message_id]
+            add_count(conversations_added, conversation_id, thought.sent_datetime)
+        counts_added(Message, "thought_count", added)
+        counts_added(Conversation, "thought_count", conversations_added)
+        bump_versions("message", added)
+        bump_versions("conversation", conversations_added)
+        bump_version("conversations")
+
+    def bulk_create(self, model, objects):
+        if not objects:
+            return []
+        if not self.preserve_timestamps:
+            return model.objects.bulk_create(objects)
+        with keep_timestamps(model):
+            return model.objects.bulk_create(objects)
+
+
+def add_count(counts: dict, row_id, sent):
+    """
+    Counts one new row for row_id in counts, which maps ids to (count, newest sent)
+    like counts_added() takes
+    """
+    count, last_sent = counts.get(row_id, (0, sent))
+    counts[row_id] = (count + 1, max(last_sent, sent))
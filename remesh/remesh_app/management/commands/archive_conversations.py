@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from remesh_app.archive import ARCHIVE_AFTER_DAYS, archive_inactive
+from remesh_app.shards import fan_out
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the conversations without recent activity, with their messages and "
+        "thoughts, into compressed archives. Their pages stay readable."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=ARCHIVE_AFTER_DAYS,
+            help="Archive conversations inactive for this many days "
+            f"(default: {ARCHIVE_AFTER_DAYS})",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            help="Archive at most this many conversations (per shard, with sharding)",
+        )
+
+    def handle(self, *args, **options):
+        # Each shard is archived separately, with sharding
+        archived = sum(
+            fan_out(lambda: archive_inactive(options["days"], options["limit"]))
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} conversations"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from remesh_app import snapshots
+from remesh_app.shards import fan_out
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the snapshot of every conversation with its messages and thoughts, "
+        "and rebuilds the snapshots that differ or are missing"
+    )
+
+    def handle(self, *args, **options):
+        if not snapshots.SNAPSHOTS:
+            raise CommandError("Snapshots are not enabled (see REMESH_SNAPSHOTS)")
+        # Each shard is checked separately, with sharding
+        results = fan_out(snapshots.check_snapshots)
+        checked = sum(result[0] for result in results)
+        rebuilt = sum(result[1] for result in results)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {checked} conversations, rebuilt {rebuilt} snapshots"
+            )
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from remesh_app.export import EXPORT_FORMATS, export_lines
+from remesh_app.models import Conversation
+from remesh_app.shards import shard_aliases, shard_for_conversation, use_shard
+
+
+class Command(BaseCommand):
+    help = "Exports a conversation with all its messages and thoughts as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("conversation_id", type=int)
+        parser.add_argument(
+            "--format", choices=list(EXPORT_FORMATS), default="ndjson", dest="format"
+        )
+        parser.add_argument(
+            "--output", help="File to write to (defaults to standard output)"
+        )
+
+    def handle(self, *args, **options):
+        shard = None
+        if shard_aliases():
+            shard = shard_for_conversation(options["conversation_id"])
+        try:
+            with use_shard(shard):
+                convo = Conversation.objects.get(id=options["conversation_id"])
+        except Conversation.DoesNotExist:
+            raise CommandError(
+                f"Conversation {options['conversation_id']} does not exist"
+            )
+
+        lines = export_lines(convo, options["format"])
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,72 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from remesh_app.importer import DEFAULT_BATCH_SIZE, Importer, read_records
+from remesh_app.shards import shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports conversations, messages and thoughts from an NDJSON or CSV file "
+        "(in the format written by export_conversation). "
+        "An interrupted import resumes where it stopped when run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="NDJSON or CSV file to import")
+        parser.add_argument(
+            "--format",
+            choices=["ndjson", "csv"],
+            dest="format",
+            help="Input format (defaults to the file extension)",
+        )
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            "--preserve-timestamps",
+            action="store_true",
+            help="Keep the start_date and sent_datetime values from the file",
+        )
+        parser.add_argument(
+            "--name",
+            help="Name of the import for checkpointing (defaults to the input path)",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint of an earlier run and import from the start",
+        )
+
+    def handle(self, *args, **options):
+        if shard_aliases():
+            # The checkpoints are in "default", so they can't be committed together
+            # with the rows on the shards
+            raise CommandError("Importing is not supported with sharding")
+        path = options["input"]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        input_format = options["format"] or (
+            "csv" if path.lower().endswith(".csv") else "ndjson"
+        )
+
+        importer = Importer(
+            options["name"] or os.path.abspath(path),
+            batch_size=options["batch_size"],
+            preserve_timestamps=options["preserve_timestamps"],
+        )
+        if options["restart"]:
+            importer.clear_checkpoint()
+        importer.load_checkpoint()
+        if importer.records_done:
+            self.stdout.write(f"Resuming after {importer.records_done} records")
+
+        def progress(records_done, rate):
+            self.stdout.write(f"{records_done} records imported ({rate:.0f} rows/s)")
+
+        with open(path, newline="") as file:
+            importer.run(read_records(file, input_format), progress)
+
+        message = f"Imported {importer.records_done} records"
+        if importer.skipped:
+            message += f", skipped {importer.skipped} without a known type or parent"
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from remesh_app.cache import bump_version
+from remesh_app.models import Conversation
+from remesh_app.shards import (
+    move_conversation,
+    shard_aliases,
+    shard_for_conversation,
+    use_shard,
+)
+from remesh_app.snapshots import rebuild_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves a conversation with its messages and thoughts to another shard, to "
+        "rebalance the shards. Its messages and thoughts get new ids on that shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("conversation_id", type=int)
+        parser.add_argument("shard", help="Database alias of the shard to move it to")
+
+    def handle(self, *args, **options):
+        if not shard_aliases():
+            raise CommandError("Sharding is not enabled (see REMESH_SHARDS)")
+        if options["shard"] not in shard_aliases():
+            raise CommandError(
+                f"Unknown shard {options['shard']}, the shards are "
+                + ", ".join(shard_aliases())
+            )
+        conversation_id = options["conversation_id"]
+        if shard_for_conversation(conversation_id) == options["shard"]:
+            self.stdout.write(
+                f"Conversation {conversation_id} is already on {options['shard']}"
+            )
+            return
+        try:
+            message_ids, thought_ids = move_conversation(
+                conversation_id, options["shard"]
+            )
+        except Conversation.DoesNotExist:
+            raise CommandError(
+                f"Conversation {conversation_id} does not exist or is archived"
+            )
+        # Its snapshot wasn't moved, as the messages have new ids
+        with use_shard(options["shard"]):
+            rebuild_snapshot(conversation_id)
+        # The old message pages are gone, and the conversation page links to new ones
+        for message_id in message_ids:
+            bump_version("message", message_id)
+        bump_version("conversation", conversation_id)
+        bump_version("conversations")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Moved conversation {conversation_id} with {len(message_ids)} messages "
+                f"and {len(thought_ids)} thoughts to {options['shard']}"
+            )
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from remesh_app.search import rebuild_index
+from remesh_app.shards import fan_out
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the full-text search index for conversations, messages and thoughts"
+    )
+
+    def handle(self, *args, **options):
+        # Each shard has its own index, with sharding
+        fan_out(rebuild_index)
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from remesh_app.cache import bump_version
+from remesh_app.counters import reconcile_counters
+from remesh_app.shards import fan_out
+
+
+class Command(BaseCommand):
+    help = "Recomputes the message and thought counters and last activity timestamps"
+
+    def handle(self, *args, **options):
+        # Each shard is reconciled separately, with sharding
+        fixed = sum(fan_out(reconcile_counters))
+        if fixed:
+            # The counters are shown on the conversations page
+            bump_version("conversations")
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} rows"))
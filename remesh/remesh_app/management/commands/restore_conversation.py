@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from remesh_app.archive import restore_conversation
+from remesh_app.shards import shard_aliases, shard_for_conversation, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Puts an archived conversation with its messages and thoughts back in the "
+        "conversation, message and thought tables, so it can be changed again"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("conversation_id", type=int)
+
+    def handle(self, *args, **options):
+        conversation_id = options["conversation_id"]
+        shard = None
+        if shard_aliases():
+            shard = shard_for_conversation(conversation_id)
+        with use_shard(shard):
+            restored = restore_conversation(conversation_id)
+        if restored is None:
+            raise CommandError(f"Conversation {conversation_id} is not archived")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Restored conversation {conversation_id} with {restored[0]} messages "
+                f"and {restored[1]} thoughts"
+            )
+        )
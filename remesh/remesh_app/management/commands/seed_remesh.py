@@ -0,0 +1,126 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from remesh_app.seeding import DEFAULT_BATCH_SIZE, Seeder
+from remesh_app.shards import shard_aliases
+
+
+def length_range(value: str) -> tuple:
+    """
+    Parses a text length range like "20-300", or a single length
+    """
+    low, _, high = value.partition("-")
+    try:
+        low = int(low)
+        high = int(high) if high else low
+    except ValueError:
+        raise CommandError(f"Invalid length range: {value}")
+    if low < 0 or high < low:
+        raise CommandError(f"Invalid length range: {value}")
+    return low, high
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with synthetic conversations, messages and thoughts, "
+        "for load testing. The same options and --seed give the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversations", type=int, default=1000)
+        parser.add_argument(
+            "--messages", type=float, default=50, help="Mean messages per conversation"
+        )
+        parser.add_argument(
+            "--thoughts", type=float, default=3, help="Mean thoughts per message"
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.5,
+            help="Pareto shape of the sizes, smaller is more skewed, 0 for equal sizes",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="Spread conversations over this many days",
+        )
+        parser.add_argument(
+            "--message-gap",
+            type=float,
+            default=600,
+            help="Maximum seconds between messages",
+        )
+        parser.add_argument(
+            "--thought-gap",
+            type=float,
+            default=3600,
+            help="Maximum seconds between thoughts",
+        )
+        parser.add_argument("--title-length", type=length_range, default=(10, 80))
+        parser.add_argument("--message-length", type=length_range, default=(20, 300))
+        parser.add_argument("--thought-length", type=length_range, default=(10, 150))
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            "--skip-search-index",
+            action="store_true",
+            help="Leave the new rows out of the search index, to be indexed later "
+            "with rebuild_search_index",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be at least 1")
+        # With sharding the conversations are split evenly between the shards, each
+        # filled with a different random seed
+        databases = shard_aliases() or [DEFAULT_DB_ALIAS]
+        seeders = []
+        for i, alias in enumerate(databases):
+            conversations = options["conversations"] // len(databases)
+            if i < options["conversations"] % len(databases):
+                conversations += 1
+            seeders.append(
+                Seeder(
+                    conversations,
+                    options["messages"],
+                    options["thoughts"],
+                    skew=options["skew"],
+                    random_seed=options["seed"] + i,
+                    days=options["days"],
+                    message_gap=options["message_gap"],
+                    thought_gap=options["thought_gap"],
+                    title_length=options["title_length"],
+                    message_length=options["message_length"],
+                    thought_length=options["thought_length"],
+                    batch_size=options["batch_size"],
+                    search_index=not options["skip_search_index"],
+                    using=alias,
+                )
+            )
+
+        def progress(rows_done, rate):
+            self.stdout.write(f"{rows_done} rows created ({rate:.0f} rows/s)")
+
+        created = [0, 0, 0]
+        for seeder in seeders:
+            if len(seeders) > 1:
+                self.stdout.write(f"Filling {seeder.using}")
+            for i, count in enumerate(seeder.run(progress)):
+                created[i] += count
+        conversations, messages, thoughts = created
+        rows_done = sum(seeder.rows_done for seeder in seeders)
+        insert_time = sum(seeder.insert_time for seeder in seeders)
+        rate = rows_done / insert_time if insert_time else 0.0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {conversations} conversations, {messages} messages and "
+                f"{thoughts} thoughts ({rate:.0f} rows/s)"
+            )
+        )
+        if options["skip_search_index"]:
+            self.stdout.write("Run rebuild_search_index before searching")
+        else:
+            index_time = sum(seeder.index_time for seeder in seeders)
+            self.stdout.write(f"Indexed for search in {index_time:.1f}s")
@@ -0,0 +1,36 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the primary SQLite database to the replica databases in "
+        "REMESH_READ_DATABASES, standing in for replication when testing locally"
+    )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError("sync_replica only works with SQLite databases")
+        primary.ensure_connection()
+
+        synced = 0
+        for alias in getattr(settings, "REMESH_READ_DATABASES", []):
+            name = settings.DATABASES[alias]["NAME"]
+            if str(name) == str(primary.settings_dict["NAME"]):
+                # Another connection to the primary file, nothing to copy
+                continue
+            # The replica connection itself is query only, so a plain connection is
+            # used to write to it. The backup API copies a consistent snapshot.
+            connections[alias].close()
+            replica = sqlite3.connect(name)
+            try:
+                primary.connection.backup(replica)
+            finally:
+                replica.close()
+            synced += 1
+            self.stdout.write(f"Copied the primary database to {alias} ({name})")
+        self.stdout.write(self.style.SUCCESS(f"Synced {synced} replicas"))
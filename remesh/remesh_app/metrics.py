@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends import django as django_backend
+from django.utils.decorators import sync_and_async_middleware
+
+# Per view request metrics, enabled with REMESH_METRICS=1 (see settings.py).
+# MetricsMiddleware records the number of SQL queries, database time, template render
+# time and wall time of every request, labelled with the URL name of its view, and
+# /metrics/ serves them as Prometheus histograms. The numbers are kept in memory,
+# per process.
+# Queries are counted by a wrapper on every database connection, and render time by
+# the DjangoTemplates backend below. Both find the current request's RequestMetrics
+# through a context variable, which also follows async views into the threads that
+# run their queries.
+
+logger = logging.getLogger(__name__)
+
+# Add a Server-Timing header with the numbers for the request
+SERVER_TIMING = getattr(settings, "REMESH_SERVER_TIMING", False)
+
+# A query run this many times in one request is reported as a likely N+1 pattern
+DUPLICATE_THRESHOLD = getattr(settings, "REMESH_METRICS_DUPLICATE_THRESHOLD", 5)
+
+# Histogram buckets
+SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200]
+
+HISTOGRAMS = {
+    "remesh_request_duration_seconds": ("Wall time of requests", SECONDS_BUCKETS),
+    "remesh_db_duration_seconds": ("Time spent in SQL queries", SECONDS_BUCKETS),
+    "remesh_template_duration_seconds": (
+        "Time spent rendering templates",
+        SECONDS_BUCKETS,
+    ),
+    "remesh_db_queries": ("Number of SQL queries per request", QUERY_BUCKETS),
+}
+DUPLICATES = "remesh_duplicate_queries_total"
+DUPLICATES_HELP = "SQL queries that repeated a query already run by the same request"
+
+
+class RequestMetrics:
+    """
+    Numbers for the request being handled
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+
+    @property
+    def duplicates(self) -> int:
+        return self.queries - len(self.statements)
+
+
+current = ContextVar("remesh_request_metrics", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Histograms and counters by metric name and view
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(dict)
+        self.duplicates = defaultdict(int)
+
+    def record(self, view: str, wall_time: float, metrics: RequestMetrics):
+        values = {
+            "remesh_request_duration_seconds": wall_time,
+            "remesh_db_duration_seconds": metrics.db_time,
+            "remesh_template_duration_seconds": metrics.template_time,
+            "remesh_db_queries": metrics.queries,
+        }
+        with self.lock:
+            for name, value in values.items():
+                histogram = self.histograms[name].get(view)
+                if histogram is None:
+                    histogram = self.histograms[name][view] = Histogram(
+                        HISTOGRAMS[name][1]
+                    )
+                histogram.observe(value)
+            self.duplicates[view] += metrics.duplicates
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.duplicates.clear()
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text format
+        """
+        lines = []
+        with self.lock:
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for view, histogram in sorted(self.histograms[name].items()):
+                    label = f'view="{escape_label(view)}"'
+                    cumulative = 0
+                    for bound, count in zip(buckets + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            f'{name}_bucket{{{label},le="{bound}"}} {cumulative}'
+                        )
+                    lines.append(f"{name}_sum{{{label}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{label}}} {histogram.count}")
+            lines.append(f"# HELP {DUPLICATES} {DUPLICATES_HELP}")
+            lines.append(f"# TYPE {DUPLICATES} counter")
+            for view, count in sorted(self.duplicates.items()):
+                lines.append(f'{DUPLICATES}{{view="{escape_label(view)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper that counts and times the queries of the current request
+    """
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - start
+        metrics.queries += 1
+        metrics.statements[sql] += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_on_open_connections(sender, **kwargs):
+    """
+    Adds the query recorder to the connections that were opened before
+    MetricsMiddleware was loaded
+    Sent with request_started, which runs in the thread that runs the queries (for
+    ASGI, the thread the async ORM uses)
+    """
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(sender, connection)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        metrics = current.get()
+        if metrics is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """
+    The Django template backend, timing how long templates take to render
+    """
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return Template(template.template, self)
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """
+    Records the metrics of each request
+    """
+    connection_created.connect(install_query_recorder)
+    request_started.connect(install_on_open_connections)
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def async_middleware(request):
+            metrics = RequestMetrics()
+            token = current.set(metrics)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                current.reset(token)
+            return finish(request, response, time.perf_counter() - start, metrics)
+
+        return async_middleware
+
+    def middleware(request):
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = get_response(request)
+        finally:
+            current.reset(token)
+        return finish(request, response, time.perf_counter() - start, metrics)
+
+    return middleware
+
+
+def finish(request, response, wall_time: float, metrics: RequestMetrics):
+    match = request.resolver_match
+    view = match.view_name if match else "<unresolved>"
+    registry.record(view, wall_time, metrics)
+
+    if metrics.statements:
+        sql, count = metrics.statements.most_common(1)[0]
+        if count >= DUPLICATE_THRESHOLD:
+            logger.warning(
+                "Possible N+1 queries in %s: query run %d times: %s", view, count, sql
+            )
+
+    if SERVER_TIMING:
+        response["Server-Timing"] = (
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries, '
+            f'{metrics.duplicates} duplicate", '
+            f"tpl;dur={metrics.template_time * 1000:.1f}, "
+            f"total;dur={wall_time * 1000:.1f}"
+        )
+    return response
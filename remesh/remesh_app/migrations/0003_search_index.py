@@ -0,0 +1,19 @@
+# Full-text search index for messages, thoughts and conversation titles
+
+from django.db import migrations
+
+from ._search_index import INDEXED_TABLES, create_sql, drop_sql
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("remesh_app", "0002_rename_sent_date_message_sent_datetime_and_more"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=create_sql(table, column),
+            reverse_sql=drop_sql(table, column),
+        )
+        for table, column in INDEXED_TABLES
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-17 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("remesh_app", "0003_search_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="conversation",
+            index=models.Index(
+                fields=["-start_date", "id"], name="conversation_start_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "sent_datetime"],
+                name="message_conversation_sent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="thought",
+            index=models.Index(
+                fields=["message", "sent_datetime"], name="thought_message_sent_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 4.2 on 2026-10-17 21:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from ._search_index import recreate_triggers_sql
+
+# Fill in the counters for the rows that already exist
+POPULATE_COUNTERS = [
+    """
+    UPDATE remesh_app_message SET thought_count = (
+        SELECT COUNT(*) FROM remesh_app_thought
+        WHERE remesh_app_thought.message_id = remesh_app_message.id
+    )
+    """,
+    """
+    UPDATE remesh_app_conversation SET
+        message_count = (
+            SELECT COUNT(*) FROM remesh_app_message
+            WHERE remesh_app_message.conversation_id = remesh_app_conversation.id
+        ),
+        thought_count = (
+            SELECT COALESCE(SUM(thought_count), 0) FROM remesh_app_message
+            WHERE remesh_app_message.conversation_id = remesh_app_conversation.id
+        ),
+        last_activity = COALESCE(
+            (
+                SELECT MAX(sent_datetime) FROM (
+                    SELECT remesh_app_message.sent_datetime FROM remesh_app_message
+                    WHERE remesh_app_message.conversation_id = remesh_app_conversation.id
+                    UNION ALL
+                    SELECT remesh_app_thought.sent_datetime FROM remesh_app_thought
+                    JOIN remesh_app_message
+                        ON remesh_app_message.id = remesh_app_thought.message_id
+                    WHERE remesh_app_message.conversation_id = remesh_app_conversation.id
+                )
+            ),
+            remesh_app_conversation.start_date || ' 00:00:00'
+        )
+    """,
+]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("remesh_app", "0004_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_activity",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="thought_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="thought_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="conversation",
+            index=models.Index(
+                fields=["last_activity"], name="conversation_activity_idx"
+            ),
+        ),
+        migrations.RunSQL(POPULATE_COUNTERS, reverse_sql=migrations.RunSQL.noop),
+        # Adding the fields rebuilt these tables, which dropped the search triggers
+        migrations.RunSQL(
+            recreate_triggers_sql("remesh_app_conversation", "title"),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            recreate_triggers_sql("remesh_app_message", "text"),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-17 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("remesh_app", "0005_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(db_index=True, max_length=500)),
+                ("records_done", models.PositiveBigIntegerField()),
+                ("conversation_ids", models.JSONField(default=dict)),
+                ("message_ids", models.JSONField(default=dict)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
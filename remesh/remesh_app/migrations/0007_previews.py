@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-17 21:52
+
+from django.db import migrations
+import remesh_app.models
+
+from ._search_index import recreate_triggers_sql
+
+# Fill in the previews of the rows that already exist, the same way as
+# models.limit_len()
+POPULATE_PREVIEWS = [f"""
+    UPDATE {table} SET preview = CASE
+        WHEN length(text) > 100 THEN substr(text, 1, 100) || '...'
+        ELSE text
+    END
+    """ for table in ("remesh_app_message", "remesh_app_thought")]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("remesh_app", "0006_import_batch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="preview",
+            field=remesh_app.models.PreviewField(default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="thought",
+            name="preview",
+            field=remesh_app.models.PreviewField(default="", editable=False),
+        ),
+        migrations.RunSQL(POPULATE_PREVIEWS, reverse_sql=migrations.RunSQL.noop),
+        # Adding the fields rebuilt these tables, which dropped the search triggers
+        migrations.RunSQL(
+            recreate_triggers_sql("remesh_app_message", "text"),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            recreate_triggers_sql("remesh_app_thought", "text"),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-17 22:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("remesh_app", "0007_previews"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard", models.CharField(max_length=100)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-17 22:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("remesh_app", "0008_conversation_shard"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedConversation",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("title", models.CharField(max_length=200)),
+                ("message_count", models.PositiveIntegerField()),
+                ("thought_count", models.PositiveIntegerField()),
+                ("last_activity", models.DateTimeField()),
+                ("archived", models.DateTimeField(auto_now_add=True)),
+                ("data", models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ArchivedMessage",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="remesh_app.archivedconversation",
+                    ),
+                ),
+            ],
+        ),
+    ]
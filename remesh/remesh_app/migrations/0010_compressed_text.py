@@ -0,0 +1,53 @@
+# Generated by Django 4.2 on 2026-10-17 22:16
+
+from django.db import migrations
+import remesh_app.models
+from remesh_app.compression import compress_existing, decompress_existing
+
+from ._search_index import recreate_triggers_sql
+
+TABLES = ("remesh_app_message", "remesh_app_thought")
+
+
+def compress_texts(apps, schema_editor):
+    # The search triggers were dropped by the table rebuilds, so this doesn't touch
+    # the index
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            compress_existing(cursor, table, "text")
+
+
+def decompress_texts(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            decompress_existing(cursor, table, "text")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("remesh_app", "0009_archive"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="text",
+            field=remesh_app.models.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name="thought",
+            name="text",
+            field=remesh_app.models.CompressedTextField(),
+        ),
+        migrations.RunPython(compress_texts, decompress_texts),
+        # Altering the fields rebuilt these tables, which dropped the search triggers
+        migrations.RunSQL(
+            recreate_triggers_sql("remesh_app_message", "text"),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            recreate_triggers_sql("remesh_app_thought", "text"),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
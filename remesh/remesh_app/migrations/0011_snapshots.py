@@ -0,0 +1,62 @@
+# Generated by Django 4.2 on 2026-10-17 22:23
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import remesh_app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("remesh_app", "0010_compressed_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationSnapshot",
+            fields=[
+                (
+                    "conversation",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="remesh_app.conversation",
+                    ),
+                ),
+                ("built", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SnapshotMessage",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("text", remesh_app.models.CompressedTextField()),
+                ("sent_datetime", models.DateTimeField()),
+                ("thought_count", models.PositiveIntegerField(default=0)),
+                (
+                    "thoughts",
+                    models.JSONField(
+                        default=list,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                    ),
+                ),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="remesh_app.conversation",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="snapshotmessage",
+            index=models.Index(
+                fields=["conversation", "sent_datetime", "id"],
+                name="snapshot_conversation_sent_idx",
+            ),
+        ),
+    ]
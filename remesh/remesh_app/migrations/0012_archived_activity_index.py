@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-17 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("remesh_app", "0011_snapshots"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="archivedconversation",
+            index=models.Index(
+                fields=["-last_activity", "-id"], name="archived_activity_idx"
+            ),
+        ),
+    ]
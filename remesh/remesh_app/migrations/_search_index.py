@@ -0,0 +1,111 @@
+# SQL for the full-text search index, shared by the migrations that need it.
+# (Modules starting with an underscore are not loaded as migrations.)
+#
+# Each indexed table gets an external content FTS5 table (the text is not stored twice)
+# and triggers that keep the index in sync with inserts, edits and deletes.
+# The trigram tokenizer allows matching any substring of 3 or more characters,
+# which keeps the behavior of the old `__contains` searches and covers prefix queries.
+#
+# NOTE: SQLite migrations that add or alter fields rebuild the table, which drops its
+# triggers. Any migration that changes an indexed table must end with
+# `migrations.RunSQL(recreate_triggers_sql(table, column))` for that table.
+
+from remesh_app.compression import DECOMPRESS_FUNCTION
+
+INDEXED_TABLES = [
+    ("remesh_app_conversation", "title"),
+    ("remesh_app_message", "text"),
+    ("remesh_app_thought", "text"),
+]
+
+# Indexed columns that may hold compressed text (models.CompressedTextField, since
+# migration 0010). They are indexed through the remesh_decompress() SQL function, and
+# FTS5 would read them from the table compressed, so their index is filled with
+# reindex_sql() rather than 'rebuild', and search.py makes their snippets itself.
+COMPRESSED_COLUMNS = {("remesh_app_message", "text"), ("remesh_app_thought", "text")}
+
+
+def indexed_value(table: str, column: str, row=None) -> str:
+    """
+    Returns the SQL for the text indexed for column, of the row named row if given
+    (new or old in triggers)
+    """
+    value = f"{row}.{column}" if row else column
+    if (table, column) in COMPRESSED_COLUMNS:
+        return f"{DECOMPRESS_FUNCTION}({value})"
+    return value
+
+
+def create_sql(table: str, column: str) -> list:
+    fts = f"{table}_fts"
+    return [
+        f"""
+        CREATE VIRTUAL TABLE {fts} USING fts5(
+            {column}, content='{table}', content_rowid='id', tokenize='trigram'
+        )
+        """,
+        *trigger_sql(table, column),
+        # Index the rows that already exist
+        *reindex_sql(table, column),
+    ]
+
+
+def trigger_sql(table: str, column: str) -> list:
+    fts = f"{table}_fts"
+    new = indexed_value(table, column, "new")
+    old = indexed_value(table, column, "old")
+    return [
+        f"""
+        CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {column}) VALUES (new.id, {new});
+        END
+        """,
+        f"""
+        CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, {old});
+        END
+        """,
+        f"""
+        CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, {old});
+            INSERT INTO {fts}(rowid, {column}) VALUES (new.id, {new});
+        END
+        """,
+    ]
+
+
+def drop_trigger_sql(table: str) -> list:
+    fts = f"{table}_fts"
+    return [
+        f"DROP TRIGGER IF EXISTS {fts}_insert",
+        f"DROP TRIGGER IF EXISTS {fts}_delete",
+        f"DROP TRIGGER IF EXISTS {fts}_update",
+    ]
+
+
+def drop_sql(table: str, column: str) -> list:
+    return [*drop_trigger_sql(table), f"DROP TABLE IF EXISTS {table}_fts"]
+
+
+def reindex_sql(table: str, column: str) -> list:
+    """
+    Rebuilds the index of a table from its rows, like FTS5's 'rebuild' but with the
+    texts decompressed
+    """
+    fts = f"{table}_fts"
+    return [
+        f"INSERT INTO {fts}({fts}) VALUES ('delete-all')",
+        f"INSERT INTO {fts}(rowid, {column}) "
+        f"SELECT id, {indexed_value(table, column)} FROM {table}",
+    ]
+
+
+def recreate_triggers_sql(table: str, column: str) -> list:
+    """
+    Puts back the triggers after a table rebuild and reindexes the table
+    """
+    return [
+        *drop_trigger_sql(table),
+        *trigger_sql(table, column),
+        *reindex_sql(table, column),
+    ]
@@ -1,4 +1,78 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import lookups
+from django.utils import timezone
+
+from .compression import DECOMPRESS_FUNCTION, compress_text, decompress_text
+
+# Length of the shortened text shown in lists and page titles
+PREVIEW_LENGTH = 100
+
+
+class PreviewField(models.CharField):
+    """
+    Stores the text of another field shortened to length characters, filled in on
+    every save (and bulk_create), so lists can show it without loading the whole text
+    Like auto_now, it isn't updated by QuerySet.update(), or by save(update_fields=...)
+    unless listed there.
+    """
+
+    def __init__(self, source="text", length=PREVIEW_LENGTH, **kwargs):
+        self.source = source
+        self.length = length
+        kwargs["max_length"] = length + len("...")
+        kwargs.setdefault("editable", False)
+        kwargs.setdefault("default", "")
+        super().__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs["max_length"]
+        if self.source != "text":
+            kwargs["source"] = self.source
+        if self.length != PREVIEW_LENGTH:
+            kwargs["length"] = self.length
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = limit_len(getattr(model_instance, self.source), self.length)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField storing long texts compressed (see compression.py)
+    The value is always a str in Python, so forms, templates and the admin see a
+    plain TextField. Lookups like __contains compare the decompressed text.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_text(value)
+
+    def get_db_prep_save(self, value, connection):
+        return compress_text(super().get_db_prep_save(value, connection))
+
+
+class DecompressedLookup:
+    def process_lhs(self, compiler, connection, lhs=None):
+        sql, params = super().process_lhs(compiler, connection, lhs)
+        return f"{DECOMPRESS_FUNCTION}({sql})", params
+
+
+for lookup in (
+    lookups.Exact,
+    lookups.IExact,
+    lookups.Contains,
+    lookups.IContains,
+    lookups.StartsWith,
+    lookups.IStartsWith,
+    lookups.EndsWith,
+    lookups.IEndsWith,
+):
+    CompressedTextField.register_lookup(
+        type(lookup.__name__, (DecompressedLookup, lookup), {})
+    )
 
 
 class Conversation(models.Model):
@@ -6,6 +80,21 @@ class Conversation(models.Model):
     # I think it would be better to have a DateTimeField here,
     # but the directions said "Start Date", so I followed them exactly
     start_date = models.DateField(auto_now_add=True)
+    # Denormalized counters, kept up to date in counters.py
+    # They can be repaired with `manage.py reconcile_counters`
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    thought_count = models.PositiveIntegerField(default=0, editable=False)
+    last_activity = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Matches the ("-start_date", "id") ordering of the conversations page
+            models.Index(
+                fields=["-start_date", "id"], name="conversation_start_date_idx"
+            ),
+            # Used when the conversations page is sorted by activity
+            models.Index(fields=["last_activity"], name="conversation_activity_idx"),
+        ]
 
     def get_messages(self):
         return self.message_set.order_by("-sent_datetime")
@@ -17,26 +106,134 @@ class Conversation(models.Model):
 class Message(models.Model):
     # It makes sense to cascade conversation deletion
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
-    text = models.TextField()
+    text = CompressedTextField()
+    preview = PreviewField()
     sent_datetime = models.DateTimeField(auto_now_add=True)
+    thought_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Messages are always read per conversation, newest first
+            models.Index(
+                fields=["conversation", "sent_datetime"],
+                name="message_conversation_sent_idx",
+            ),
+        ]
 
     def get_thoughts(self):
         return self.thought_set.order_by("-sent_datetime")
 
     def __str__(self) -> str:
-        return limit_len(self.text, 100)
+        return self.preview
 
 
 class Thought(models.Model):
     # Thoughts and Messages are essentially identical
-    # But it is important to keep functions related to them separate in case 
+    # But it is important to keep functions related to them separate in case
     # their models are updated in the future. They are different things after all.
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
-    text = models.TextField()
+    text = CompressedTextField()
+    preview = PreviewField()
     sent_datetime = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Thoughts are always read per message, newest first
+            models.Index(
+                fields=["message", "sent_datetime"], name="thought_message_sent_idx"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return self.preview
+
+
+class ConversationShard(models.Model):
+    # Shard directory, in the "default" database when sharding is enabled (see
+    # shards.py). The ids of its rows are the conversation ids, so new conversations
+    # take their id from here and ids are unique across all the shards.
+    shard = models.CharField(max_length=100)
+
+    def __str__(self) -> str:
+        return f"Conversation {self.id} on {self.shard}"
+
+
+class ArchivedConversation(models.Model):
+    # Conversation moved out of the conversation, message and thought tables by
+    # `manage.py archive_conversations` (see archive.py). Its rows are kept in data, as
+    # zlib compressed JSON. The id is the conversation's id, so its pages keep their
+    # URLs, and the other fields are copied for the admin and conditional requests.
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=200)
+    message_count = models.PositiveIntegerField()
+    thought_count = models.PositiveIntegerField()
+    last_activity = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            # The archived conversations page lists them by activity, like the
+            # conversations page
+            models.Index(
+                fields=["-last_activity", "-id"], name="archived_activity_idx"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return self.title
+
+
+class ArchivedMessage(models.Model):
+    # Finds the archived conversation holding a message, for the message pages
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(ArchivedConversation, on_delete=models.CASCADE)
+
+
+class ConversationSnapshot(models.Model):
+    # Marks a conversation whose snapshot (its SnapshotMessage rows) is complete, so
+    # the snapshot API can read from it (see snapshots.py)
+    conversation = models.OneToOneField(
+        Conversation, primary_key=True, on_delete=models.CASCADE
+    )
+    built = models.DateTimeField(auto_now=True)
+
+
+class SnapshotMessage(models.Model):
+    # A message of a conversation snapshot, as the conversation page and the snapshot
+    # API show it. The id is the message's id, and thoughts holds the previews of its
+    # thoughts in the order they were added (see snapshots.py).
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, db_index=False
+    )
+    text = CompressedTextField()
+    sent_datetime = models.DateTimeField()
+    thought_count = models.PositiveIntegerField(default=0)
+    thoughts = models.JSONField(encoder=DjangoJSONEncoder, default=list)
+
+    class Meta:
+        indexes = [
+            # Pages of a snapshot are read like the messages, newest first
+            models.Index(
+                fields=["conversation", "sent_datetime", "id"],
+                name="snapshot_conversation_sent_idx",
+            ),
+        ]
+
+
+class ImportBatch(models.Model):
+    # Checkpoint written by `manage.py import_remesh` in the same transaction as each
+    # batch of imported rows, so an interrupted import can resume where it stopped.
+    # The id maps link ids in the import file to the ids of the rows created for them.
+    name = models.CharField(max_length=500, db_index=True)
+    records_done = models.PositiveBigIntegerField()
+    conversation_ids = models.JSONField(default=dict)
+    message_ids = models.JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True)
+
     def __str__(self) -> str:
-        return limit_len(self.text, 100)
+        return f"{self.name} ({self.records_done} records)"
 
 
 def limit_len(string: str, length: int) -> str:
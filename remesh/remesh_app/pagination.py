@@ -0,0 +1,200 @@
+import base64
+import json
+from itertools import dropwhile, islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Page sizes can be overridden in settings.py
+DEFAULT_PAGE_SIZE = getattr(settings, "REMESH_PAGE_SIZE", 50)
+MAX_PAGE_SIZE = getattr(settings, "REMESH_MAX_PAGE_SIZE", 500)
+
+
+class KeysetPage:
+    """
+    One page of results from keyset_paginate()
+    Holds the items for the page and the query strings for the neighbouring pages
+    """
+
+    def __init__(self, items, ordering, has_next, has_previous, request):
+        self.items = items
+        self.has_next = has_next
+        self.has_previous = has_previous
+        # Other query parameters (page_size, sort, ...) are kept in the page links
+        self.params = request.GET.copy()
+        self.params.pop("before", None)
+        self.params.pop("after", None)
+        self.next_cursor = None
+        self.previous_cursor = None
+        if items:
+            self.next_cursor = encode_cursor(items[-1], ordering)
+            self.previous_cursor = encode_cursor(items[0], ordering)
+
+    @property
+    def next_query(self) -> str:
+        return self._query("before", self.next_cursor)
+
+    @property
+    def previous_query(self) -> str:
+        return self._query("after", self.previous_cursor)
+
+    def _query(self, direction: str, cursor: str) -> str:
+        params = self.params.copy()
+        params[direction] = cursor
+        return params.urlencode()
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+def keyset_paginate(queryset, ordering, request):
+    """
+    Paginates queryset using the (value, id) keyset given by ordering,
+    e.g. ("-sent_datetime", "-id"). The last field must be unique.
+    ?before=<cursor> returns the page after the cursor in the display order,
+    ?after=<cursor> returns the page before it. Unlike OFFSET paging, every page
+    is a single range scan, so deep pages cost the same as the first page.
+    Malformed cursors are ignored and the first page is returned.
+    Returns a KeysetPage
+    """
+    queryset, page_size, before, after = keyset_query(queryset, ordering, request)
+    return keyset_page(list(queryset), ordering, request, page_size, before, after)
+
+
+async def akeyset_paginate(queryset, ordering, request):
+    """
+    Async version of keyset_paginate()
+    """
+    queryset, page_size, before, after = keyset_query(queryset, ordering, request)
+    rows = [row async for row in queryset]
+    return keyset_page(rows, ordering, request, page_size, before, after)
+
+
+def keyset_paginate_list(items, model, ordering, request):
+    """
+    keyset_paginate() for a list of model instances already sorted by ordering, e.g.
+    the messages of an archived conversation
+    Returns a KeysetPage with the same cursors as keyset_paginate()
+    """
+    page_size = get_page_size(request)
+    before = decode_cursor(request.GET.get("before"), model, ordering)
+    after = None
+    if before is None:
+        after = decode_cursor(request.GET.get("after"), model, ordering)
+
+    if after is not None:
+        reverse_ordering = [flip(field) for field in ordering]
+        rows = dropwhile(
+            lambda item: not follows(item, reverse_ordering, after), reversed(items)
+        )
+    elif before is not None:
+        rows = dropwhile(lambda item: not follows(item, ordering, before), items)
+    else:
+        rows = items
+    rows = list(islice(rows, page_size + 1))
+    return keyset_page(
+        rows, ordering, request, page_size, before is not None, after is not None
+    )
+
+
+def keyset_query(queryset, ordering, request):
+    """
+    Builds the query for one page (plus one row, to tell if there is another page)
+    Returns (queryset, page size, whether ?before= was given, whether ?after= was given)
+    """
+    page_size = get_page_size(request)
+    before = decode_cursor(request.GET.get("before"), queryset.model, ordering)
+    after = None
+    if before is None:
+        after = decode_cursor(request.GET.get("after"), queryset.model, ordering)
+
+    if after is not None:
+        # Walk backwards from the cursor, the results are flipped by keyset_page()
+        reverse_ordering = [flip(field) for field in ordering]
+        queryset = queryset.filter(keyset_filter(reverse_ordering, after)).order_by(
+            *reverse_ordering
+        )
+    else:
+        if before is not None:
+            queryset = queryset.filter(keyset_filter(ordering, before))
+        queryset = queryset.order_by(*ordering)
+    return queryset[: page_size + 1], page_size, before is not None, after is not None
+
+
+def keyset_page(rows, ordering, request, page_size, before, after):
+    """
+    Turns the rows fetched for the query from keyset_query() into a KeysetPage
+    """
+    more = len(rows) > page_size
+    items = rows[:page_size]
+    if after:
+        return KeysetPage(items[::-1], ordering, True, more, request)
+    return KeysetPage(items, ordering, more, before, request)
+
+
+def get_page_size(request) -> int:
+    """
+    Reads ?page_size= from the request, clamped between 1 and MAX_PAGE_SIZE
+    """
+    try:
+        page_size = int(request.GET.get("page_size", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def keyset_filter(ordering, values) -> Q:
+    """
+    Builds the filter for rows that come after values in the given ordering
+    For ("-a", "-b") this is: a < va OR (a = va AND b < vb)
+    """
+    condition = Q()
+    for i in reversed(range(len(ordering))):
+        name = ordering[i].lstrip("-")
+        lookup = "lt" if ordering[i].startswith("-") else "gt"
+        equal = {ordering[j].lstrip("-"): values[j] for j in range(i)}
+        condition = condition | Q(**equal, **{f"{name}__{lookup}": values[i]})
+    return condition
+
+
+def follows(item, ordering, values) -> bool:
+    """
+    Tells if item comes after values in the given ordering, like keyset_filter()
+    """
+    for field, value in zip(ordering, values):
+        own = getattr(item, field.lstrip("-"))
+        if own != value:
+            return own < value if field.startswith("-") else own > value
+    return False
+
+
+def flip(field: str) -> str:
+    return field[1:] if field.startswith("-") else f"-{field}"
+
+
+def encode_cursor(obj, ordering) -> str:
+    values = [str(getattr(obj, field.lstrip("-"))) for field in ordering]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, model, ordering):
+    """
+    Turns a cursor string back into a list of field values
+    Returns None if there is no cursor or it can't be decoded
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(ordering):
+            return None
+        return [
+            model._meta.get_field(field.lstrip("-")).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except (ValueError, TypeError, ValidationError):
+        return None
@@ -0,0 +1,283 @@
+import asyncio
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import QueryDict
+from django.urls import Resolver404, resolve
+from django.utils.decorators import sync_and_async_middleware
+
+from .shards import (
+    allocate_conversations,
+    current_shard,
+    shard_aliases,
+    shard_for_conversation,
+    shard_for_row,
+    use_shard,
+)
+
+# Database routers, enabled with the DATABASE_ROUTERS setting
+
+# Name of the cookie holding the time until which a client reads from the primary
+PRIMARY_COOKIE = "remesh_primary_until"
+
+# Seconds a client keeps reading from the primary after it wrote something, so it
+# sees its own writes even while the replicas are behind
+READ_YOUR_WRITES_WINDOW = getattr(settings, "REMESH_READ_YOUR_WRITES_WINDOW", 10)
+
+
+class RequestState:
+    """
+    Routing state of the request being handled
+    """
+
+    def __init__(self, pinned=False):
+        # Reads go to the primary
+        self.pinned = pinned
+        # Something was written to the primary
+        self.wrote = False
+        # Something was read from a replica that may be behind the primary, so the
+        # response may not show the latest writes (see cache.cached_page)
+        self.read_lagging = False
+
+
+request_state = ContextVar("remesh_request_state", default=None)
+
+# Models stored in the shards, the rest of the app stays in "default"
+SHARDED_MODELS = {
+    "conversation",
+    "message",
+    "thought",
+    "archivedconversation",
+    "archivedmessage",
+    "conversationsnapshot",
+    "snapshotmessage",
+}
+
+
+class ReadWriteRouter:
+    """
+    Sends reads to one of the replica databases and writes to "default" (the primary)
+    The replicas are the aliases in the REMESH_READ_DATABASES setting, one picked at
+    random for each query. In the production profile this is a query only connection
+    to the same SQLite file, so readers never hold up the connection used for writing.
+    Reads stay on "default":
+    - inside a transaction on "default", so they see the transaction's own writes
+    - for a while after the client wrote something (see ReadYourWritesMiddleware)
+    Replicas on another file than "default" may be behind it, unlike a connection to
+    the same file.
+    """
+
+    def __init__(self):
+        self.read_aliases = list(getattr(settings, "REMESH_READ_DATABASES", ["read"]))
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]["NAME"]
+        self.lagging_aliases = {
+            alias
+            for alias in self.read_aliases
+            if settings.DATABASES.get(alias, {}).get("NAME") != primary
+        }
+
+    def db_for_read(self, model, **hints):
+        state = request_state.get()
+        if (
+            not self.read_aliases
+            or (state and state.pinned)
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        alias = random.choice(self.read_aliases)
+        if state and alias in self.lagging_aliases:
+            state.read_lagging = True
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        # Writes of other apps (sessions, the database cache's counters) don't change
+        # what the app's pages show
+        if state and model._meta.app_label == "remesh_app":
+            # The rest of the request reads what it just wrote
+            state.wrote = True
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@sync_and_async_middleware
+def ReadYourWritesMiddleware(get_response):
+    """
+    Keeps a client reading from the primary for READ_YOUR_WRITES_WINDOW seconds after
+    a request of theirs wrote to it, e.g. the page a new message redirects to
+    The deadline is kept in a cookie, so it works without server side state.
+    Supports both sync and async requests, so async views aren't moved to a thread.
+    """
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def async_middleware(request):
+            state = start_request(request)
+            token = request_state.set(state)
+            try:
+                response = await get_response(request)
+            finally:
+                request_state.reset(token)
+            return finish_request(state, response)
+
+        return async_middleware
+
+    def middleware(request):
+        state = start_request(request)
+        token = request_state.set(state)
+        try:
+            response = get_response(request)
+        finally:
+            request_state.reset(token)
+        return finish_request(state, response)
+
+    return middleware
+
+
+def start_request(request) -> RequestState:
+    try:
+        pinned_until = float(request.COOKIES.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        pinned_until = 0
+    return RequestState(pinned=time.time() < pinned_until)
+
+
+def finish_request(state, response):
+    if state.wrote:
+        response.set_cookie(
+            PRIMARY_COOKIE,
+            str(time.time() + READ_YOUR_WRITES_WINDOW),
+            max_age=READ_YOUR_WRITES_WINDOW,
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+class ShardRouter:
+    """
+    Sends conversations, messages and thoughts to their shard (see shards.py)
+    An object that was loaded from a shard is saved back to it. Other queries go to
+    the current shard, set by ShardMiddleware or use_shard(), or to the first shard
+    outside of any. A new conversation saved outside of any shard is added to the
+    shard directory here, which gives it its id and places it on a shard (inside one,
+    shards.add_to_directory() adds it to that shard).
+    Other models are left to the next router, and are only migrated on "default".
+    """
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded(model._meta.app_label, model._meta.model_name):
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db in shard_aliases():
+            return instance._state.db
+        return current_shard.get() or shard_aliases()[0]
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get("instance")
+        if (
+            model._meta.model_name == "conversation"
+            and isinstance(instance, model)
+            and instance.pk is None
+            and current_shard.get() is None
+        ):
+            (entry,) = allocate_conversations(1)
+            instance.pk = entry.id
+            # Later calls for the instance (e.g. from save() after full_clean()) return
+            # the same shard
+            instance._state.db = entry.shard
+            return entry.shard
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db in shard_aliases() or obj2._state.db in shard_aliases():
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in shard_aliases():
+            return is_sharded(app_label, model_name)
+        if app_label == "remesh_app":
+            return not is_sharded(app_label, model_name)
+        return None
+
+
+def is_sharded(app_label, model_name) -> bool:
+    # Migration operations without a model (RunSQL) are for the search index and
+    # counters of the sharded tables
+    return app_label == "remesh_app" and (
+        model_name is None or model_name in SHARDED_MODELS
+    )
+
+
+@sync_and_async_middleware
+def ShardMiddleware(get_response):
+    """
+    Routes the queries of each request to the shard of the conversation, message or
+    thought in its URL
+    In the admin, the lists and add pages use the shard picked with ?shard= (see
+    admin.py), the first one by default.
+    Not used without sharding.
+    """
+    if not shard_aliases():
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def async_middleware(request):
+            with use_shard(request_shard(request)):
+                return await get_response(request)
+
+        return async_middleware
+
+    def middleware(request):
+        with use_shard(request_shard(request)):
+            return get_response(request)
+
+    return middleware
+
+
+def request_shard(request):
+    """
+    Returns the shard a request is about, or None if it isn't about one object
+    """
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    kwargs = match.kwargs
+    if "conversation_id" in kwargs:
+        return shard_for_conversation(kwargs["conversation_id"])
+    if "message_id" in kwargs:
+        return shard_for_row(kwargs["message_id"])
+
+    prefix = "remesh_app_"
+    if match.app_name != "admin" or not match.url_name.startswith(prefix):
+        return None
+    model_name = match.url_name[len(prefix) :].rpartition("_")[0]
+    if model_name not in SHARDED_MODELS:
+        return None
+    object_id = kwargs.get("object_id")
+    if object_id is not None:
+        try:
+            object_id = int(object_id)
+        except ValueError:
+            return None
+        if model_name in ("conversation", "archivedconversation"):
+            return shard_for_conversation(object_id)
+        return shard_for_row(object_id)
+    # Kept in _changelist_filters on the pages linked from the list
+    shard = request.GET.get("shard") or QueryDict(
+        request.GET.get("_changelist_filters", "")
+    ).get("shard")
+    return shard if shard in shard_aliases() else None
@@ -0,0 +1,238 @@
+import re
+from itertools import chain
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .compression import decompress_text
+from .migrations._search_index import COMPRESSED_COLUMNS, reindex_sql
+from .models import ArchivedConversation, Conversation, Message, Thought
+from .shards import conversation_db, fan_out, shard_aliases
+
+# Maximum number of ranked results returned by a search
+MAX_RESULTS = getattr(settings, "REMESH_SEARCH_RESULTS", 50)
+
+# The trigram tokenizer can't match terms shorter than this
+MIN_TERM_LENGTH = 3
+
+# Words in the snippets of compressed texts, like the 32 tokens of snippet() below
+SNIPPET_WORDS = 32
+
+# Placeholders used by snippet() for highlighting. They are swapped for <mark> tags
+# after the snippet text has been html escaped.
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+# (model, indexed column) for each full-text index created in migration 0003
+INDEXES = {
+    "conversations": (Conversation, "title"),
+    "messages": (Message, "text"),
+    "thoughts": (Thought, "text"),
+}
+
+
+def build_match_query(query: str):
+    """
+    Turns the user's search text into an FTS5 MATCH expression.
+    Every term must appear (as a substring) in the result. A trailing * on a term
+    is accepted for prefix queries, but is not needed since terms already match
+    anywhere in the text.
+    Returns None if any term is too short for the index
+    """
+    terms = [term.rstrip("*") for term in query.split()]
+    if not terms or any(len(term) < MIN_TERM_LENGTH for term in terms):
+        return None
+    # Quote each term so that FTS5 operators in user input are treated as text
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def ranked_search(search_type: str, query: str, conversation_id=None):
+    """
+    Searches the full-text index for search_type, ordered by bm25 rank (best first)
+    Messages and thoughts are limited to those in the conversation given by conversation_id
+    Each result has a highlighted `snippet` attribute.
+    Returns a list of model instances, or None if the query can't use the index
+    """
+    raw = ranked_search_query(search_type, query, conversation_id)
+    if raw is None:
+        return None
+    return highlight_results(list(raw), query)
+
+
+async def aranked_search(search_type: str, query: str, conversation_id=None):
+    """
+    Async version of ranked_search()
+    """
+    raw = ranked_search_query(search_type, query, conversation_id)
+    if raw is None:
+        return None
+    return highlight_results([result async for result in raw], query)
+
+
+def search_conversations(query: str) -> list:
+    """
+    Searches conversation titles in every shard, in parallel with sharding
+    Results are ranked like ranked_search(), though bm25 scores each shard's matches
+    against that shard's own index. Queries that can't use the index return the
+    titles containing query, most recently active first. Archived conversations
+    follow the others.
+    """
+    results = fan_out(lambda: ranked_search("conversations", query))
+    if results[0] is None:
+        results = fan_out(lambda: list(title_query(query)))
+        results = sorted_by_activity(chain.from_iterable(results))
+    elif len(results) == 1:
+        results = results[0]
+    else:
+        results = sorted(chain.from_iterable(results), key=attrgetter("rank"))
+        results = results[:MAX_RESULTS]
+    archived = fan_out(lambda: list(archived_title_query(query)))
+    return results + sorted_by_activity(chain.from_iterable(archived))
+
+
+async def asearch_conversations(query: str) -> list:
+    """
+    Async version of search_conversations()
+    """
+    if shard_aliases():
+        return await sync_to_async(search_conversations)(query)
+    results = await aranked_search("conversations", query)
+    if results is None:
+        results = [result async for result in title_query(query)]
+    archived = [result async for result in archived_title_query(query)]
+    return results + archived
+
+
+def title_query(query: str):
+    """
+    Returns the conversations whose titles contain query, most recently active first
+    Used for terms too short for the search index. Reading them in the order of the
+    activity index stops after MAX_RESULTS matches, instead of comparing every title.
+    """
+    return Conversation.objects.filter(title__contains=query).order_by(
+        "-last_activity", "-id"
+    )[:MAX_RESULTS]
+
+
+def archived_title_query(query: str):
+    """
+    Returns the archived conversations whose titles contain every term of query,
+    most recently active first
+    They aren't in the search index, so every archived title is compared.
+    """
+    queryset = ArchivedConversation.objects.defer("data")
+    for term in query.split():
+        queryset = queryset.filter(title__contains=term.rstrip("*"))
+    return queryset.order_by("-last_activity", "-id")[:MAX_RESULTS]
+
+
+def sorted_by_activity(results) -> list:
+    """
+    Merges the conversations found in each shard, most recently active first
+    """
+    key = attrgetter("last_activity", "id")
+    return sorted(results, key=key, reverse=True)[:MAX_RESULTS]
+
+
+def ranked_search_query(search_type: str, query: str, conversation_id=None):
+    """
+    Builds the raw query for ranked_search()
+    Returns a RawQuerySet, or None if the query can't use the index
+    """
+    match = build_match_query(query)
+    if match is None:
+        return None
+
+    model, column = INDEXES[search_type]
+    table = model._meta.db_table
+    fts = f"{table}_fts"
+    # Messages and thoughts are listed by their previews, so their full text is left
+    # out (it is loaded only if accessed)
+    deferred = set() if search_type == "conversations" else {column}
+    columns = ", ".join(
+        f"{table}.{field.column}"
+        for field in model._meta.concrete_fields
+        if field.column not in deferred
+    )
+    snippet = f"snippet({fts}, 0, %s, %s, '...', 32)"
+    if (table, column) in COMPRESSED_COLUMNS:
+        # FTS5 reads the text from the table, so it can't make snippets of compressed
+        # texts. They are loaded instead, and highlight_results() makes them.
+        compressed = f"typeof({table}.{column}) = 'blob'"
+        columns += f", CASE WHEN {compressed} THEN {table}.{column} END AS compressed"
+        snippet = f"CASE WHEN {compressed} THEN NULL ELSE {snippet} END"
+    sql = f"""
+        SELECT {columns},
+            {snippet} AS snippet,
+            bm25({fts}) AS rank
+        FROM {fts}
+        JOIN {table} ON {table}.id = {fts}.rowid
+    """
+    params = [HIGHLIGHT_START, HIGHLIGHT_END]
+    if search_type == "thoughts":
+        sql += " JOIN remesh_app_message ON remesh_app_message.id = remesh_app_thought.message_id"
+    sql += f" WHERE {fts} MATCH %s"
+    params.append(match)
+    if search_type in ("messages", "thoughts"):
+        sql += " AND remesh_app_message.conversation_id = %s"
+        params.append(conversation_id)
+    sql += " ORDER BY rank LIMIT %s"
+    params.append(MAX_RESULTS)
+    return model.objects.raw(sql, params)
+
+
+def highlight_results(results, query: str):
+    for result in results:
+        if result.snippet is None:
+            text = decompress_text(result.compressed)
+            result.snippet = text_snippet(text, query)
+        result.snippet = highlight(result.snippet)
+    return results
+
+
+def text_snippet(text: str, query: str) -> str:
+    """
+    Makes a snippet of text like FTS5's snippet(): SNIPPET_WORDS words around the
+    first match of a term of query, with the matches between the placeholders
+    """
+    terms = [term.rstrip("*") for term in query.split()]
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    words = text.split()
+    first = next((i for i, word in enumerate(words) if pattern.search(word)), 0)
+    start = max(0, first - SNIPPET_WORDS // 4)
+    end = start + SNIPPET_WORDS
+    snippet = pattern.sub(
+        lambda match: f"{HIGHLIGHT_START}{match.group()}{HIGHLIGHT_END}",
+        " ".join(words[start:end]),
+    )
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(words):
+        snippet += "..."
+    return snippet
+
+
+def highlight(snippet: str) -> str:
+    """
+    Escapes the snippet text and wraps the matched terms in <mark> tags
+    """
+    return mark_safe(
+        escape(snippet)
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_END, "</mark>")
+    )
+
+
+def rebuild_index():
+    """
+    Rebuilds every full-text index from its content table, in the current shard
+    with sharding
+    """
+    with connections[conversation_db()].cursor() as cursor:
+        for model, column in INDEXES.values():
+            for sql in reindex_sql(model._meta.db_table, column):
+                cursor.execute(sql)
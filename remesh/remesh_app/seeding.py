@@ -0,0 +1,359 @@
+import random
+import time
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .cache import bump_version
+from .compression import compress_text
+from .migrations._search_index import (
+    INDEXED_TABLES,
+    drop_trigger_sql,
+    indexed_value,
+    trigger_sql,
+)
+from .models import (
+    PREVIEW_LENGTH,
+    Conversation,
+    ConversationShard,
+    Message,
+    Thought,
+    limit_len,
+)
+from .shards import first_row_id, shard_aliases
+
+# Synthetic data for load testing, written by `manage.py seed_remesh` and the
+# benchmarks. Rows are generated with their ids, timestamps and counters already
+# filled in and inserted with executemany, so there is no ORM overhead, no signal and
+# no round trip per row. The search index triggers are dropped while inserting and
+# the new rows are indexed in one statement at the end, all in one transaction.
+# Conversation and message sizes follow a Pareto distribution, so like real data most
+# conversations are small and a few are very large. The same arguments and random
+# seed always produce the same data.
+# With sharding, a Seeder fills one shard (using) and adds its conversations to the
+# shard directory.
+
+DEFAULT_BATCH_SIZE = 50000
+
+# Words the generated text is made of
+WORDS = (
+    "about after again answer because before between change could different "
+    "every example feedback first follow great group idea important improve "
+    "information issue language little market meeting member message model "
+    "money never number opinion other people place point policy problem program "
+    "question really reason remote report research result right service should "
+    "something start system team their there thing think thought through time "
+    "together topic under until value voice water where which while without "
+    "work world would write young"
+).split()
+
+# Length of the text the generated texts are cut from
+CORPUS_LENGTH = 1_000_000
+
+
+def skewed_sizes(rng, count: int, mean: float, skew: float) -> list:
+    """
+    Returns count sizes averaging about mean
+    skew is the Pareto shape: smaller values give a longer tail, 0 gives every item
+    exactly mean
+    """
+    if skew <= 0 or mean <= 0:
+        return [round(mean)] * count
+    # A Pareto variate has a mean of skew / (skew - 1), for skew > 1
+    scale = mean * (skew - 1) / skew if skew > 1 else mean / 2
+    cap = max(1, round(mean * 50))
+    return [min(cap, round(rng.paretovariate(skew) * scale)) for _ in range(count)]
+
+
+class TextGenerator:
+    """
+    Cuts texts of random length from a long random text, starting at word boundaries
+    """
+
+    def __init__(self, rng, max_length: int):
+        self.random = rng.random
+        words = []
+        length = 0
+        while length < CORPUS_LENGTH + max_length:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        self.corpus = " ".join(words)
+        self.starts = []
+        position = 0
+        for word in words:
+            if position >= CORPUS_LENGTH:
+                break
+            self.starts.append(position)
+            position += len(word) + 1
+
+    def text(self, min_length: int, max_length: int) -> str:
+        # random() is several times faster than randrange()
+        start = self.starts[int(self.random() * len(self.starts))]
+        length = min_length + int(self.random() * (max_length - min_length + 1))
+        return self.corpus[start : start + length].rstrip()
+
+    def texts(self, count: int, min_length: int, max_length: int) -> list:
+        """
+        Returns count texts like text(), without a call per text
+        """
+        corpus = self.corpus
+        starts = self.starts
+        random = self.random
+        start_count = len(starts)
+        span = max_length - min_length + 1
+        return [
+            corpus[start : start + min_length + int(random() * span)].rstrip()
+            for start in [starts[int(random() * start_count)] for _ in range(count)]
+        ]
+
+
+class Seeder:
+    """
+    Generates conversations with about messages messages each and about thoughts
+    thoughts per message
+    Start dates are spread over the days before now. Messages follow each other
+    within message_gap seconds from the start of their conversation, and thoughts
+    follow their message within thought_gap seconds.
+    Text lengths are (min, max) character ranges.
+    Without search_index the new rows are left out of the search index, which then
+    has to be rebuilt with `manage.py rebuild_search_index`.
+    using is the database alias to fill, a shard with sharding.
+    """
+
+    def __init__(
+        self,
+        conversations: int,
+        messages: float,
+        thoughts: float,
+        skew=1.5,
+        random_seed=0,
+        days=365,
+        message_gap=600,
+        thought_gap=3600,
+        title_length=(10, 80),
+        message_length=(20, 300),
+        thought_length=(10, 150),
+        batch_size=DEFAULT_BATCH_SIZE,
+        search_index=True,
+        using=DEFAULT_DB_ALIAS,
+    ):
+        self.conversations = conversations
+        self.messages = messages
+        self.thoughts = thoughts
+        self.skew = skew
+        self.days = days
+        self.message_gap = message_gap
+        self.thought_gap = thought_gap
+        self.title_length = title_length
+        self.message_length = message_length
+        self.thought_length = thought_length
+        self.batch_size = batch_size
+        self.search_index = search_index
+        self.using = using
+        self.rng = random.Random(random_seed)
+        # Seconds spent inserting and indexing the rows
+        self.insert_time = 0.0
+        self.index_time = 0.0
+        # (conversations, messages, thoughts) created
+        self.created = [0, 0, 0]
+        # Ids reserved in the shard directory, with sharding
+        self.reserved_ids = None
+
+    def run(self, progress=None):
+        """
+        Creates the rows in one transaction
+        progress(rows_done, rows_per_second) is called after every batch
+        """
+        rng = self.rng
+        uniform = rng.random
+        texts = TextGenerator(
+            rng,
+            max(self.title_length[1], self.message_length[1], self.thought_length[1]),
+        )
+        text = texts.text
+        many_texts = texts.texts
+        # Long texts are stored compressed, as CompressedTextField saves them
+        compress = compress_text
+        title_length = self.title_length
+        message_length = self.message_length
+        thought_length = self.thought_length
+        # Timestamps are whole seconds since the epoch, converted by SQLite
+        # The newest conversation starts on the day before today
+        first_day = int(time.time() // 86400) - self.days
+
+        start = time.monotonic()
+        connection = connections[self.using]
+        atomic = transaction.atomic(using=self.using)
+        with self.release_ids_on_failure(), atomic, connection.cursor() as cursor:
+            conversation_id, message_id, thought_id = self.first_ids(cursor)
+            self.drop_search_triggers(cursor)
+
+            conversations, messages, thoughts = rows = ([], [], [])
+            sizes = skewed_sizes(rng, self.conversations, self.messages, self.skew)
+            for size in sizes:
+                conversation_id += 1
+                started = (first_day + int(uniform() * self.days)) * 86400
+                sent = last_activity = started
+                conversation_thoughts = 0
+                thought_counts = skewed_sizes(rng, size, self.thoughts, self.skew)
+                # The texts of a conversation are cut at once, which is faster
+                message_texts = many_texts(size, *message_length)
+                thought_texts = many_texts(sum(thought_counts), *thought_length)
+                next_thought = 0
+                for thought_count, message_text in zip(thought_counts, message_texts):
+                    message_id += 1
+                    sent += 1 + int(uniform() * self.message_gap)
+                    messages.append(
+                        (
+                            message_id,
+                            conversation_id,
+                            compress(message_text),
+                            limit_len(message_text, PREVIEW_LENGTH),
+                            sent,
+                            thought_count,
+                        )
+                    )
+                    thought_sent = sent
+                    first_thought = next_thought
+                    next_thought += thought_count
+                    for thought_text in thought_texts[first_thought:next_thought]:
+                        thought_id += 1
+                        thought_sent += 1 + int(uniform() * self.thought_gap)
+                        thoughts.append(
+                            (
+                                thought_id,
+                                message_id,
+                                compress(thought_text),
+                                limit_len(thought_text, PREVIEW_LENGTH),
+                                thought_sent,
+                            )
+                        )
+                    if thought_sent > last_activity:
+                        last_activity = thought_sent
+                    conversation_thoughts += thought_count
+                conversations.append(
+                    (
+                        conversation_id,
+                        text(*title_length),
+                        started,
+                        size,
+                        conversation_thoughts,
+                        last_activity,
+                    )
+                )
+                if len(messages) + len(thoughts) >= self.batch_size:
+                    self.insert(cursor, rows)
+                    conversations, messages, thoughts = rows = ([], [], [])
+                    if progress:
+                        elapsed = time.monotonic() - start
+                        progress(self.rows_done, self.rows_done / elapsed)
+            self.insert(cursor, rows)
+            self.insert_time = time.monotonic() - start
+
+            self.index_new_rows(cursor)
+            self.index_time = time.monotonic() - start - self.insert_time
+        # The new conversations are shown on the conversations page
+        bump_version("conversations")
+        return tuple(self.created)
+
+    @property
+    def rows_done(self) -> int:
+        return sum(self.created)
+
+    def first_ids(self, cursor) -> list:
+        """
+        Returns the largest id of each table, the generated rows are numbered after
+        """
+        ids = []
+        for model in (Conversation, Message, Thought):
+            cursor.execute(f"SELECT MAX(id) FROM {model._meta.db_table}")
+            ids.append(cursor.fetchone()[0] or 0)
+        if self.using in shard_aliases():
+            # Conversation ids come from the shard directory, and message and thought
+            # ids from the range of the shard
+            ids[0] = self.reserve_conversation_ids()
+            ids[1] = max(ids[1], first_row_id(self.using))
+            ids[2] = max(ids[2], first_row_id(self.using))
+        self.first_new_ids = [i + 1 for i in ids]
+        return ids
+
+    def reserve_conversation_ids(self) -> int:
+        """
+        Adds the conversations to be generated to the shard directory
+        Returns the id before the first one
+        """
+        table = ConversationShard._meta.db_table
+        directory = connections[DEFAULT_DB_ALIAS]
+        with transaction.atomic(using=DEFAULT_DB_ALIAS), directory.cursor() as cursor:
+            cursor.execute(f"SELECT MAX(id) FROM {table}")
+            last_id = cursor.fetchone()[0] or 0
+            cursor.executemany(
+                f"INSERT INTO {table} (id, shard) VALUES (%s, %s)",
+                [(last_id + i, self.using) for i in range(1, self.conversations + 1)],
+            )
+        self.reserved_ids = (last_id + 1, last_id + self.conversations)
+        return last_id
+
+    @contextmanager
+    def release_ids_on_failure(self):
+        """
+        Removes the conversations reserved by reserve_conversation_ids() from the
+        shard directory if the seed fails, as they were rolled back
+        """
+        try:
+            yield
+        except BaseException:
+            if self.reserved_ids:
+                first_id, last_id = self.reserved_ids
+                table = ConversationShard._meta.db_table
+                with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE id BETWEEN %s AND %s",
+                        [first_id, last_id],
+                    )
+            raise
+
+    def drop_search_triggers(self, cursor):
+        for table, _ in INDEXED_TABLES:
+            for sql in drop_trigger_sql(table):
+                cursor.execute(sql)
+
+    def index_new_rows(self, cursor):
+        """
+        Adds the new rows to the search index and puts back its triggers
+        """
+        for (table, column), first_id in zip(INDEXED_TABLES, self.first_new_ids):
+            if self.search_index:
+                cursor.execute(
+                    f"INSERT INTO {table}_fts(rowid, {column}) "
+                    f"SELECT id, {indexed_value(table, column)} FROM {table} "
+                    "WHERE id >= %s",
+                    [first_id],
+                )
+            for sql in trigger_sql(table, column):
+                cursor.execute(sql)
+
+    def insert(self, cursor, rows):
+        conversations, messages, thoughts = rows
+        cursor.executemany(
+            f"INSERT INTO {Conversation._meta.db_table} "
+            "(id, title, start_date, message_count, thought_count, last_activity) "
+            "VALUES (%s, %s, date(%s, 'unixepoch'), %s, %s, "
+            "datetime(%s, 'unixepoch'))",
+            conversations,
+        )
+        cursor.executemany(
+            f"INSERT INTO {Message._meta.db_table} "
+            "(id, conversation_id, text, preview, sent_datetime, thought_count) "
+            "VALUES (%s, %s, %s, %s, datetime(%s, 'unixepoch'), %s)",
+            messages,
+        )
+        cursor.executemany(
+            f"INSERT INTO {Thought._meta.db_table} "
+            "(id, message_id, text, preview, sent_datetime) "
+            "VALUES (%s, %s, %s, %s, datetime(%s, 'unixepoch'))",
+            thoughts,
+        )
+        for i, created in enumerate(rows):
+            self.created[i] += len(created)
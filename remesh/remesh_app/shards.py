@@ -0,0 +1,358 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import chain
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+from django.db.models.signals import post_migrate, pre_save
+from django.dispatch import receiver
+
+from .models import (
+    Conversation,
+    ConversationShard,
+    ConversationSnapshot,
+    Message,
+    SnapshotMessage,
+    Thought,
+)
+from .pagination import akeyset_paginate, keyset_page, keyset_paginate, keyset_query
+
+# Sharding, enabled with REMESH_SHARDS (see settings.py)
+# Each conversation is stored with its messages and thoughts in one of the shard
+# databases listed in REMESH_SHARD_DATABASES. The shard directory (ConversationShard,
+# in the "default" database) maps conversation ids to shards. New conversations get
+# their id from the directory, so conversation ids are unique across shards, and are
+# placed on a shard by a hash of the id. Messages and thoughts are numbered in a
+# separate range of SHARD_ID_SPAN ids on each shard, so their shard follows from
+# their id without a lookup. Moving a conversation to another shard renumbers them.
+# Queries are sent to the current shard by routers.ShardRouter. ShardMiddleware picks
+# it from the conversation or message id in the URL, other code uses use_shard().
+
+SHARD_ID_SPAN = 10**12
+
+# Rows copied per query when moving a conversation
+MOVE_BATCH_SIZE = 5000
+
+current_shard = ContextVar("remesh_current_shard", default=None)
+
+_executor = None
+
+
+def shard_aliases() -> list:
+    """
+    Returns the database aliases of the shards, empty without sharding
+    """
+    return getattr(settings, "REMESH_SHARD_DATABASES", [])
+
+
+@contextmanager
+def use_shard(alias):
+    """
+    Sends the queries on conversations, messages and thoughts made inside the block
+    to the shard alias
+    """
+    token = current_shard.set(alias)
+    try:
+        yield
+    finally:
+        current_shard.reset(token)
+
+
+def conversation_db() -> str:
+    """
+    Returns the alias of the database holding the conversations currently worked on,
+    for transactions: the current shard (the first one outside of any shard), or
+    "default" without sharding
+    """
+    shards = shard_aliases()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    return current_shard.get() or shards[0]
+
+
+def place_conversation(conversation_id) -> str:
+    """
+    Picks the shard of a new conversation from a stable hash of its id
+    """
+    shards = shard_aliases()
+    return shards[zlib.crc32(str(conversation_id).encode()) % len(shards)]
+
+
+def allocate_conversations(count: int, shard=None) -> list:
+    """
+    Adds count new conversations to the shard directory, on the given shard or placed
+    by place_conversation()
+    Returns the new ConversationShard entries, whose ids are the conversation ids
+    """
+    directory = ConversationShard.objects.using(DEFAULT_DB_ALIAS)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        entries = directory.bulk_create(
+            [ConversationShard(shard=shard or "") for _ in range(count)]
+        )
+        if shard is None:
+            for entry in entries:
+                entry.shard = place_conversation(entry.id)
+            directory.bulk_update(entries, ["shard"])
+    return entries
+
+
+@receiver(pre_save, sender=Conversation)
+def add_to_directory(sender, instance, raw=False, using=None, **kwargs):
+    """
+    Adds a new conversation saved on a shard to the shard directory, which gives it
+    its id
+    """
+    if instance.pk is None and using in shard_aliases():
+        (entry,) = allocate_conversations(1, using)
+        instance.pk = entry.id
+
+
+def shard_for_conversation(conversation_id):
+    """
+    Returns the shard holding a conversation, or None if it isn't in the directory
+    """
+    return (
+        ConversationShard.objects.using(DEFAULT_DB_ALIAS)
+        .filter(id=conversation_id)
+        .values_list("shard", flat=True)
+        .first()
+    )
+
+
+def shard_for_row(row_id):
+    """
+    Returns the shard holding a message or thought, from the id range it is in
+    """
+    shards = shard_aliases()
+    index = (int(row_id) - 1) // SHARD_ID_SPAN
+    if 0 <= index < len(shards):
+        return shards[index]
+    return None
+
+
+def first_row_id(alias) -> int:
+    """
+    Returns the id before the first message or thought id of a shard
+    """
+    return shard_aliases().index(alias) * SHARD_ID_SPAN
+
+
+@receiver(post_migrate)
+def start_id_ranges(sender, using, **kwargs):
+    """
+    Makes the new messages and thoughts of each shard start at its id range
+    The tables use AUTOINCREMENT, so SQLite numbers new rows after sqlite_sequence.
+    """
+    if sender.name != "remesh_app" or using not in shard_aliases():
+        return
+    start = first_row_id(using)
+    with connections[using].cursor() as cursor:
+        for model in (Message, Thought):
+            table = model._meta.db_table
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, table],
+            )
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s",
+                [start, table, start],
+            )
+
+
+def fan_out(function) -> list:
+    """
+    Calls function() in each shard, in parallel threads
+    Returns the results in shard order. Without sharding function() is called once,
+    in this thread.
+    """
+    global _executor
+    shards = shard_aliases()
+    if not shards:
+        return [function()]
+    if _executor is None:
+        _executor = ThreadPoolExecutor(thread_name_prefix="remesh-shard")
+
+    def call(alias):
+        with use_shard(alias):
+            try:
+                return function()
+            finally:
+                # Like at the end of a request, closes the connection unless it is
+                # persistent (CONN_MAX_AGE)
+                close_old_connections()
+
+    return list(_executor.map(call, shards))
+
+
+def keyset_paginate_shards(queryset, ordering, request):
+    """
+    keyset_paginate() over every shard
+    Each shard returns its own page and the pages are merged, so this relies on the
+    last field of ordering being unique across shards (like conversation ids).
+    """
+    if not shard_aliases():
+        return keyset_paginate(queryset, ordering, request)
+    query, page_size, before, after = keyset_query(queryset, ordering, request)
+    # Each call evaluates its own copy of the queryset
+    rows = list(chain.from_iterable(fan_out(lambda: list(query.all()))))
+    # Without ?after= the rows are in the display order, with it in reverse
+    for field in reversed(query.query.order_by):
+        rows.sort(key=attrgetter(field.lstrip("-")), reverse=field.startswith("-"))
+    return keyset_page(
+        rows[: page_size + 1], ordering, request, page_size, before, after
+    )
+
+
+async def akeyset_paginate_shards(queryset, ordering, request):
+    """
+    Async version of keyset_paginate_shards()
+    """
+    if not shard_aliases():
+        return await akeyset_paginate(queryset, ordering, request)
+    return await sync_to_async(keyset_paginate_shards)(queryset, ordering, request)
+
+
+def move_conversation(conversation_id, target) -> tuple:
+    """
+    Moves a conversation with its messages and thoughts to the shard target
+    The messages and thoughts get new ids in the range of the target shard, so links
+    to their old pages stop working. The rows are copied as stored, so the
+    timestamps, counters and search index stay the same. The source shard is write
+    locked while the conversation is copied, so nothing can be added to it meanwhile.
+    Returns dicts of the old to the new ids of the messages and of the thoughts moved
+    """
+    source = shard_for_conversation(conversation_id)
+    if source is None:
+        raise Conversation.DoesNotExist(
+            f"Conversation {conversation_id} is not in the shard directory"
+        )
+    if source == target:
+        return {}, {}
+
+    with transaction.atomic(using=source), connections[source].cursor() as reader:
+        # Any write takes the lock in SQLite
+        reader.execute(
+            f"UPDATE {Conversation._meta.db_table} SET id = id WHERE id = %s",
+            [conversation_id],
+        )
+        if reader.rowcount == 0:
+            # Archived conversations have to be restored first (see archive.py)
+            raise Conversation.DoesNotExist(
+                f"Conversation {conversation_id} is not in the {source} tables"
+            )
+        with transaction.atomic(using=target), connections[target].cursor() as writer:
+            # Left over from an earlier move that didn't finish
+            delete_conversation_rows(writer, conversation_id)
+            copy_rows(reader, writer, Conversation, "id", conversation_id)
+            message_ids = copy_rows(
+                reader,
+                writer,
+                Message,
+                "conversation_id",
+                conversation_id,
+                next_row_id(writer, Message, target),
+            )
+            thought_ids = copy_rows(
+                reader,
+                writer,
+                Thought,
+                "message_id",
+                message_ids,
+                next_row_id(writer, Thought, target),
+            )
+        ConversationShard.objects.using(DEFAULT_DB_ALIAS).filter(
+            id=conversation_id
+        ).update(shard=target)
+        delete_conversation_rows(reader, conversation_id)
+    return message_ids, thought_ids
+
+
+def next_row_id(cursor, model, alias) -> int:
+    """
+    Returns the largest id used so far by model's table in a shard
+    """
+    table = model._meta.db_table
+    cursor.execute(
+        f"SELECT MAX(id) FROM {table} "
+        "UNION ALL SELECT MAX(seq) FROM sqlite_sequence WHERE name = %s",
+        [table],
+    )
+    return max([row[0] or 0 for row in cursor.fetchall()] + [first_row_id(alias)])
+
+
+def copy_rows(reader, writer, model, column, key, last_id=None) -> dict:
+    """
+    Copies the rows of model whose column matches key from reader to writer
+    key is an id, or a dict of old to new ids whose old ids are matched and replaced
+    by the new ones. Rows are renumbered after last_id unless it is None.
+    Returns a dict of the old to the new id of each row copied
+    """
+    table = model._meta.db_table
+    columns = [field.column for field in model._meta.concrete_fields]
+    id_index = columns.index("id")
+    key_index = columns.index(column)
+    names = ", ".join(columns)
+    insert = (
+        f"INSERT INTO {table} ({names}) VALUES ({', '.join(['%s'] * len(columns))})"
+    )
+    if isinstance(key, dict):
+        # Copied in batches of parent ids, which SQLite takes as query parameters
+        parent_ids = list(key)
+        batches = [
+            parent_ids[i : i + MOVE_BATCH_SIZE]
+            for i in range(0, len(parent_ids), MOVE_BATCH_SIZE)
+        ]
+    else:
+        batches = [[key]]
+
+    new_ids = {}
+    for batch in batches:
+        reader.execute(
+            f"SELECT {names} FROM {table} "
+            f"WHERE {column} IN ({', '.join(['%s'] * len(batch))}) ORDER BY id",
+            batch,
+        )
+        while rows := reader.fetchmany(MOVE_BATCH_SIZE):
+            copies = []
+            for row in rows:
+                row = list(row)
+                if isinstance(key, dict):
+                    row[key_index] = key[row[key_index]]
+                if last_id is not None:
+                    last_id += 1
+                    new_ids[row[id_index]] = last_id
+                    row[id_index] = last_id
+                else:
+                    new_ids[row[id_index]] = row[id_index]
+                copies.append(row)
+            writer.executemany(insert, copies)
+    return new_ids
+
+
+def delete_conversation_rows(cursor, conversation_id):
+    """
+    Deletes a conversation with its messages, thoughts and snapshot, without signals
+    """
+    for model in (SnapshotMessage, ConversationSnapshot):
+        cursor.execute(
+            f"DELETE FROM {model._meta.db_table} WHERE conversation_id = %s",
+            [conversation_id],
+        )
+    messages = f"SELECT id FROM {Message._meta.db_table} WHERE conversation_id = %s"
+    cursor.execute(
+        f"DELETE FROM {Thought._meta.db_table} WHERE message_id IN ({messages})",
+        [conversation_id],
+    )
+    cursor.execute(
+        f"DELETE FROM {Message._meta.db_table} WHERE conversation_id = %s",
+        [conversation_id],
+    )
+    cursor.execute(
+        f"DELETE FROM {Conversation._meta.db_table} WHERE id = %s",
+        [conversation_id],
+    )
@@ -0,0 +1,330 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import F, Func, JSONField, Value
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .models import (
+    Conversation,
+    ConversationSnapshot,
+    Message,
+    SnapshotMessage,
+    Thought,
+)
+from .shards import conversation_db
+
+# Conversation snapshots, enabled with REMESH_SNAPSHOTS=1
+# A snapshot is a materialized read model of a conversation: one SnapshotMessage per
+# message, holding its text (compressed like the message's, see compression.py), sent
+# time, thought count and the previews of its thoughts in the order they were added.
+# The conversation page and the snapshot API page through the snapshot instead of
+# the messages, and the API doesn't load the thoughts of every message.
+# Snapshots are updated in the transaction that adds a message or thought, by
+# appending the delta: a new message inserts its row, and a new thought is appended
+# to its message's row by SQLite's json_insert(), so a conversation is never
+# rebuilt for a write. Edits and deletes of thoughts (from the admin) rebuild the
+# one message they touch, and edits of a message (from the admin) update its row.
+# A ConversationSnapshot row marks the conversations whose snapshot is complete, which are those created while snapshots were enabled and
+# those built by `manage.py check_snapshots`. The others are read from the tables.
+# Rows inserted without the models (seed_remesh, import_remesh) aren't added to
+# snapshots until check_snapshots compares them with the tables and rebuilds them.
+
+SNAPSHOTS = getattr(settings, "REMESH_SNAPSHOTS", False)
+
+# Thoughts appended per UPDATE, as SQLite functions take at most 127 arguments
+APPEND_BATCH_SIZE = 50
+
+
+class JSONInsert(Func):
+    function = "json_insert"
+    output_field = JSONField()
+
+
+def thought_preview(thought) -> dict:
+    return {
+        "id": thought.id,
+        "sent_datetime": thought.sent_datetime,
+        "preview": thought.preview,
+    }
+
+
+def encode(value):
+    """
+    Returns value as stored in a JSONField, with datetimes as strings
+    """
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def snapshot_message(message, thoughts=()) -> SnapshotMessage:
+    """
+    Returns an unsaved snapshot message for a message and its thoughts (in the order
+    they were added)
+    """
+    return SnapshotMessage(
+        id=message.id,
+        conversation_id=message.conversation_id,
+        text=message.text,
+        sent_datetime=message.sent_datetime,
+        thought_count=len(thoughts),
+        thoughts=encode([thought_preview(thought) for thought in thoughts]),
+    )
+
+
+def build_messages(messages, thoughts) -> list:
+    """
+    Returns unsaved snapshot messages for messages, from the thoughts of all of them
+    """
+    by_message = {}
+    for thought in thoughts.only("message", "sent_datetime", "preview").order_by("id"):
+        by_message.setdefault(thought.message_id, []).append(thought)
+    return [
+        snapshot_message(message, by_message.get(message.id, ()))
+        for message in messages
+    ]
+
+
+def add_conversations(conversations, using=None):
+    """
+    Marks the snapshots of new conversations as complete, as they have no messages
+    """
+    if not SNAPSHOTS:
+        return
+    ConversationSnapshot.objects.using(using).bulk_create(
+        [ConversationSnapshot(conversation_id=convo.id) for convo in conversations]
+    )
+
+
+def add_messages(messages, using=None):
+    """
+    Appends new messages to the snapshots of their conversations
+    """
+    if not SNAPSHOTS:
+        return
+    SnapshotMessage.objects.using(using).bulk_create(
+        [snapshot_message(message) for message in messages]
+    )
+
+
+def add_thoughts(message_id, thoughts, using=None):
+    """
+    Appends the previews of new thoughts to their message's snapshot, in SQL, so the
+    stored previews aren't loaded
+    """
+    if not SNAPSHOTS:
+        return
+    previews = [
+        json.dumps(thought_preview(thought), cls=DjangoJSONEncoder)
+        for thought in thoughts
+    ]
+    entries = SnapshotMessage.objects.using(using).filter(id=message_id)
+    for start in range(0, len(previews), APPEND_BATCH_SIZE):
+        batch = previews[start : start + APPEND_BATCH_SIZE]
+        arguments = []
+        for preview in batch:
+            arguments += [Value("$[#]"), Func(Value(preview), function="json")]
+        entries.update(
+            thought_count=F("thought_count") + len(batch),
+            thoughts=JSONInsert(F("thoughts"), *arguments),
+        )
+
+
+def refresh_message(message_id, using=None):
+    """
+    Rebuilds the snapshot of one message from the tables, after a thought was edited
+    or deleted
+    """
+    if not SNAPSHOTS:
+        return
+    messages = Message.objects.using(using).filter(id=message_id)
+    thoughts = Thought.objects.using(using).filter(message_id=message_id)
+    for entry in build_messages(messages, thoughts):
+        SnapshotMessage.objects.using(using).filter(id=entry.id).update(
+            thought_count=entry.thought_count, thoughts=entry.thoughts
+        )
+
+
+@receiver(post_save, sender=Conversation)
+def conversation_saved(sender, instance, created, raw=False, using=None, **kwargs):
+    if created and not raw:
+        add_conversations([instance], using)
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    if created:
+        add_messages([instance], using)
+    elif SNAPSHOTS:
+        SnapshotMessage.objects.using(using).filter(id=instance.id).update(
+            text=instance.text, sent_datetime=instance.sent_datetime
+        )
+
+
+@receiver(post_save, sender=Thought)
+def thought_saved(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    if created:
+        add_thoughts(instance.message_id, [instance], using)
+    else:
+        refresh_message(instance.message_id, using)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, using=None, **kwargs):
+    # The snapshot messages of a deleted conversation are deleted by the cascade
+    if SNAPSHOTS and not isinstance(origin, Conversation):
+        SnapshotMessage.objects.using(using).filter(id=instance.id).delete()
+
+
+@receiver(post_delete, sender=Thought)
+def thought_deleted(sender, instance, origin=None, using=None, **kwargs):
+    if not isinstance(origin, (Conversation, Message)):
+        refresh_message(instance.message_id, using)
+
+
+def snapshot_messages(conversation_id):
+    """
+    Returns the snapshot messages of a conversation as a queryset, or None if
+    snapshots are disabled or its snapshot isn't complete
+    """
+    if not SNAPSHOTS:
+        return None
+    if not ConversationSnapshot.objects.filter(
+        conversation_id=conversation_id
+    ).exists():
+        return None
+    return SnapshotMessage.objects.filter(conversation_id=conversation_id)
+
+
+async def asnapshot_messages(conversation_id):
+    """
+    Async version of snapshot_messages()
+    """
+    if not SNAPSHOTS:
+        return None
+    if not await ConversationSnapshot.objects.filter(
+        conversation_id=conversation_id
+    ).aexists():
+        return None
+    return SnapshotMessage.objects.filter(conversation_id=conversation_id)
+
+
+def conversation_messages(convo):
+    """
+    Returns the messages of a conversation to page through: its snapshot messages if
+    its snapshot is complete, else its messages
+    Both have the id, text, sent_datetime and thought_count the pages show, and their
+    cursors are the same.
+    """
+    entries = snapshot_messages(convo.id)
+    return convo.message_set.all() if entries is None else entries
+
+
+async def aconversation_messages(convo):
+    """
+    Async version of conversation_messages()
+    """
+    entries = await asnapshot_messages(convo.id)
+    return convo.message_set.all() if entries is None else entries
+
+
+def as_snapshot_messages(messages) -> list:
+    """
+    Returns a page from conversation_messages() as snapshot messages, built from the
+    tables in the same format if they are messages
+    """
+    if not messages or isinstance(messages[0], SnapshotMessage):
+        return list(messages)
+    return build_messages(messages, Thought.objects.filter(message__in=messages))
+
+
+def snapshot_matches(conversation_id) -> bool:
+    """
+    Returns whether a conversation's snapshot is complete and the same as the
+    messages and thoughts in the tables
+    """
+    stored = snapshot_messages(conversation_id)
+    if stored is None:
+        return False
+    expected = build_messages(
+        Message.objects.filter(conversation_id=conversation_id).order_by("id"),
+        Thought.objects.filter(message__conversation_id=conversation_id),
+    )
+    fields = (
+        "id",
+        "conversation_id",
+        "text",
+        "sent_datetime",
+        "thought_count",
+        "thoughts",
+    )
+    return [
+        tuple(getattr(entry, field) for field in fields) for entry in expected
+    ] == list(stored.order_by("id").values_list(*fields))
+
+
+def rebuild_snapshot(conversation_id) -> bool:
+    """
+    Rebuilds the snapshot of a conversation from the tables, in one transaction
+    Returns False if snapshots are disabled or the conversation doesn't exist
+    """
+    if not SNAPSHOTS:
+        return False
+    using = conversation_db()
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # Any write takes the lock in SQLite, so nothing can be added meanwhile
+        cursor.execute(
+            f"UPDATE {Conversation._meta.db_table} SET id = id WHERE id = %s",
+            [conversation_id],
+        )
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute(
+            f"DELETE FROM {SnapshotMessage._meta.db_table} WHERE conversation_id = %s",
+            [conversation_id],
+        )
+        messages = Message.objects.filter(conversation_id=conversation_id)
+        SnapshotMessage.objects.bulk_create(
+            build_messages(
+                messages,
+                Thought.objects.filter(message__conversation_id=conversation_id),
+            )
+        )
+        ConversationSnapshot.objects.update_or_create(conversation_id=conversation_id)
+        # Its page may have been rendered from a snapshot that was wrong
+        bump_version("conversation", conversation_id)
+    return True
+
+
+def check_snapshot(conversation_id) -> bool:
+    """
+    Compares a conversation's snapshot with the tables, and rebuilds it if they
+    differ or it isn't complete
+    Returns whether it was rebuilt
+    """
+    with transaction.atomic(using=conversation_db()):
+        # Read in one transaction, so the tables and the snapshot are from the same
+        # moment
+        if snapshot_matches(conversation_id):
+            return False
+    return rebuild_snapshot(conversation_id)
+
+
+def check_snapshots() -> tuple:
+    """
+    Checks the snapshot of every conversation
+    Returns the number of (conversations checked, snapshots rebuilt)
+    """
+    conversation_ids = list(
+        Conversation.objects.order_by("id").values_list("id", flat=True)
+    )
+    rebuilt = sum(
+        check_snapshot(conversation_id) for conversation_id in conversation_ids
+    )
+    return len(conversation_ids), rebuilt
@@ -0,0 +1,22 @@
+from django.db.backends.sqlite3 import base
+
+# SQLite database backend used by the production database profile
+# Adds two settings to the entries in settings.DATABASES:
+#   "PRAGMAS": {"journal_mode": "WAL", ...}, applied whenever a connection is opened
+#   "TRANSACTION_MODE": "IMMEDIATE", the BEGIN mode used for transactions
+# With the default (deferred) mode, a transaction that reads before it writes can fail
+# right away with "database is locked" when another connection commits first, since
+# waiting would not help it. Immediate transactions take the write lock when they
+# start, so they wait for the busy timeout instead.
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in (self.settings_dict.get("PRAGMAS") or {}).items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict.get("TRANSACTION_MODE") or "DEFERRED"
+        self.cursor().execute(f"BEGIN {mode}")
@@ -1,10 +1,65 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.db import DatabaseError, connection, connections
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import reverse
 
-from .models import Conversation, Message, Thought
+from . import async_views
+from .archive import archive_conversation, load_archive
+from .cache import bump_version, cached_page
+from .compression import compress_existing
+from .events import LocalBroker, MAX_PENDING_EVENTS
+from .models import (
+    ArchivedConversation,
+    ArchivedMessage,
+    Conversation,
+    ConversationShard,
+    ConversationSnapshot,
+    ImportBatch,
+    Message,
+    SnapshotMessage,
+    Thought,
+)
 
+from .counters import reconcile_counters
 from .forms import ConversationForm, MessageForm, ThoughtForm
+from .importer import Importer, read_records
+from .metrics import install_query_recorder, registry
+from .routers import (
+    PRIMARY_COOKIE,
+    ReadWriteRouter,
+    ReadYourWritesMiddleware,
+    RequestState,
+    request_state,
+)
+from .search import ranked_search, ranked_search_query
+from .shards import SHARD_ID_SPAN, shard_for_conversation, shard_for_row, use_shard
+from .snapshots import APPEND_BATCH_SIZE, rebuild_snapshot, snapshot_matches
+from .sqlite_backend.base import DatabaseWrapper as SQLiteWrapper
+from .writes import GroupCommitQueue, PendingWrite
 
 
 class ConversationModelTests(TestCase):
@@ -154,6 +209,24 @@ class ThoughtModelTests(TestCase):
         """
         self.assertEqual(str(self.thought_short), self.thought_text_short)
 
+    def test_thought_preview(self):
+        """
+        Test that the stored preview follows the text, also for bulk created Thoughts
+        """
+        thought = Thought.objects.get(id=self.thought_long.id)
+        self.assertEqual(thought.preview, self.thought_text_long[:100] + "...")
+        thought.text = "Edited thought"
+        thought.save()
+        self.assertEqual(Thought.objects.get(id=thought.id).preview, "Edited thought")
+
+        [bulk] = Thought.objects.bulk_create(
+            [Thought(message=self.message, text=self.thought_text_long)]
+        )
+        self.assertEqual(
+            Thought.objects.get(id=bulk.id).preview,
+            self.thought_text_long[:100] + "...",
+        )
+
 
 class FormsTestCase(TestCase):
     def test_conversation_form_valid_data(self):
@@ -252,16 +325,16 @@ class RemeshAppViewsTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "remesh_app/conversation.html")
         self.assertEqual(response.context["conversation"], self.convo)
-        self.assertEqual(
-            response.context["message_dict"][str(self.msg.id)][0], self.msg
-        )
-        self.assertQuerysetEqual(
-            response.context["message_dict"][str(self.msg.id)][1],
-            [self.thought_2, self.thought_1],
-        )
+        self.assertEqual(response.context["message_dict"][str(self.msg.id)], self.msg)
         # Test front-end elements
         self.assertContains(response, "Test Conversation")
         self.assertContains(response, "Test Message")
+        # Thoughts are only counted, they are loaded when the message is expanded
+        self.assertContains(response, "2 thoughts")
+        self.assertNotContains(response, "Test Thought 1")
+        self.assertContains(
+            response, reverse("remesh_app:message_thoughts", args=[self.msg.id])
+        )
 
     def test_conversation_view_empty(self):
         url = reverse("remesh_app:conversation", args=[self.convo_empty.id])
@@ -281,16 +354,63 @@ class RemeshAppViewsTestCase(TestCase):
         self.assertTemplateUsed(response, "remesh_app/conversation.html")
         self.assertEqual(response.context["conversation"], self.convo_empty_message)
         self.assertEqual(
-            response.context["message_dict"][str(self.msg_empty.id)][0], self.msg_empty
-        )
-        self.assertQuerysetEqual(
-            response.context["message_dict"][str(self.msg_empty.id)][1], []
+            response.context["message_dict"][str(self.msg_empty.id)], self.msg_empty
         )
         # Test front-end elements
         self.assertContains(response, "Test Conversation Empty Message")
         self.assertContains(response, "Test Message Empty")
         self.assertContains(response, "No thoughts")
 
+    def test_conversation_view_query_count(self):
+        """
+        Test that the number of queries for the conversation page does not grow
+        with the number of messages and thoughts
+        """
+        url = reverse("remesh_app:conversation", args=[self.convo.id])
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+
+        for i in range(10):
+            msg = Message.objects.create(conversation=self.convo, text=f"Message {i}")
+            Thought.objects.create(message=msg, text=f"Thought {i}")
+
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(len(response.context["message_dict"]), 11)
+
+    def test_message_thoughts_view(self):
+        url = reverse("remesh_app:message_thoughts", args=[self.msg.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "remesh_app/thoughts.html")
+        self.assertQuerysetEqual(
+            response.context["thoughts"], [self.thought_2, self.thought_1]
+        )
+        self.assertContains(response, "Test Thought 1")
+        self.assertNotContains(response, "More thoughts")
+
+        # Paginated, the next page is loaded by the "More thoughts" button
+        response = self.client.get(url, {"page_size": 1})
+        self.assertEqual(response.context["thoughts"], [self.thought_2])
+        page = response.context["page"]
+        self.assertContains(response, "More thoughts")
+        self.assertContains(response, "page_size=1&amp;before=")
+        response = self.client.get(f"{url}?{page.next_query}")
+        self.assertEqual(response.context["thoughts"], [self.thought_1])
+
+    def test_message_thoughts_view_skips_text(self):
+        url = reverse("remesh_app:message_thoughts", args=[self.msg.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, "Test Thought 1")
+        thought_queries = [
+            q["sql"] for q in queries if "remesh_app_thought" in q["sql"]
+        ]
+        self.assertTrue(thought_queries)
+        for sql in thought_queries:
+            self.assertNotIn('"remesh_app_thought"."text"', sql)
+
     def test_message_view(self):
         url = reverse("remesh_app:message", args=[self.msg.id])
         response = self.client.get(url)
@@ -439,6 +559,88 @@ class SearchViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertNotContains(response, "Test Conversation")
 
+    def test_search_ranking_and_highlighting(self):
+        """
+        Test that results are ordered by rank and the matched text is highlighted
+        """
+        # The same length, so only the number of matches differs
+        weaker = Message.objects.create(
+            conversation=self.conversation, text="Cookies, oranges and bananas"
+        )
+        best = Message.objects.create(
+            conversation=self.conversation, text="Cookies, cookies and cookies"
+        )
+        url = reverse("remesh_app:search", args=["messages", self.conversation.id])
+        response = self.client.get(url, {"q": "cookie"})
+        results = response.context["results"]
+        self.assertEqual([result.id for result in results], [best.id, weaker.id])
+        self.assertLess(results[0].rank, results[1].rank)
+        self.assertContains(response, "<mark>Cookie</mark>")
+
+    def test_search_escapes_text(self):
+        Message.objects.create(
+            conversation=self.conversation, text="<script>alert('hi')</script>"
+        )
+        url = reverse("remesh_app:search", args=["messages", self.conversation.id])
+        response = self.client.get(url, {"q": "script"})
+        self.assertNotContains(response, "<script>")
+        self.assertContains(response, "&lt;<mark>script</mark>&gt;")
+
+    def test_search_index_follows_edits_and_deletes(self):
+        url = reverse("remesh_app:search", args=["messages", self.conversation.id])
+        self.message.text = "Edited text"
+        self.message.save()
+        self.assertEqual(
+            len(self.client.get(url, {"q": "Message"}).context["results"]), 0
+        )
+        self.assertEqual(
+            len(self.client.get(url, {"q": "Edited"}).context["results"]), 1
+        )
+        self.message.delete()
+        self.assertEqual(
+            len(self.client.get(url, {"q": "Edited"}).context["results"]), 0
+        )
+
+    def test_search_other_conversation(self):
+        other = Conversation.objects.create(title="Other Conversation")
+        Message.objects.create(conversation=other, text="Test Message Elsewhere")
+        url = reverse("remesh_app:search", args=["messages", self.conversation.id])
+        response = self.client.get(url, {"q": "Message"})
+        self.assertEqual(len(response.context["results"]), 1)
+        self.assertNotContains(response, "Elsewhere")
+
+    def test_search_thoughts(self):
+        Thought.objects.create(message=self.message, text="A thoughtful reply")
+        url = reverse("remesh_app:search", args=["thoughts", self.conversation.id])
+        response = self.client.get(url, {"q": "thoughtful"})
+        self.assertContains(response, "<mark>thoughtful</mark>")
+        self.assertContains(
+            response, reverse("remesh_app:message", args=[self.message.id])
+        )
+
+        response = self.client.get(url, {"q": "Cookies"})
+        self.assertContains(response, "No results found.")
+
+    def test_search_short_terms(self):
+        """
+        Test that terms too short for the index still return results
+        """
+        url = reverse("remesh_app:search", args=["messages", self.conversation.id])
+        response = self.client.get(url, {"q": "Te"})
+        self.assertContains(response, "Test Message")
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM remesh_app_message_fts")
+        url = reverse("remesh_app:search", args=["messages", self.conversation.id])
+        self.assertEqual(
+            len(self.client.get(url, {"q": "Message"}).context["results"]), 0
+        )
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(
+            len(self.client.get(url, {"q": "Message"}).context["results"]), 1
+        )
+
     def test_invalid_search_type(self):
         url = reverse("remesh_app:search", args=["invalid"])
         response = self.client.get(url, {"q": "Test"})
@@ -447,3 +649,1835 @@ class SearchViewTestCase(TestCase):
             response,
             "Invalid search type. Please contact the developer and tell them to fix their app.",
         )
+
+
+class CompressedTextTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.long_text = " ".join(f"word{i % 50}" for i in range(1000)) + " needle"
+        self.message = Message.objects.create(
+            conversation=self.convo, text=self.long_text
+        )
+        self.short = Message.objects.create(conversation=self.convo, text="Short")
+
+    def stored(self, table, row_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT typeof(text), length(text) FROM {table} WHERE id = %s",
+                [row_id],
+            )
+            return cursor.fetchone()
+
+    def test_long_texts_are_compressed(self):
+        kind, length = self.stored("remesh_app_message", self.message.id)
+        self.assertEqual(kind, "blob")
+        self.assertLess(length, len(self.long_text) / 4)
+        self.assertEqual(self.stored("remesh_app_message", self.short.id)[0], "text")
+        self.assertEqual(Message.objects.get(id=self.message.id).text, self.long_text)
+        self.assertEqual(self.message.preview, self.long_text[:100] + "...")
+
+        thought = Thought.objects.create(message=self.short, text=self.long_text)
+        self.assertEqual(self.stored("remesh_app_thought", thought.id)[0], "blob")
+        Thought.objects.filter(id=thought.id).update(text="Now short")
+        self.assertEqual(self.stored("remesh_app_thought", thought.id)[0], "text")
+        self.assertEqual(Thought.objects.get().text, "Now short")
+
+        form = MessageForm(instance=Message.objects.get(id=self.message.id))
+        self.assertIn("needle", form.as_p())
+
+    def test_lookups_and_search(self):
+        messages = self.convo.message_set
+        self.assertEqual(list(messages.filter(text__contains="ne")), [self.message])
+        self.assertEqual(list(messages.filter(text=self.long_text)), [self.message])
+        self.assertEqual(
+            list(messages.filter(text__iendswith="NEEDLE")), [self.message]
+        )
+
+        results = ranked_search("messages", "needle", self.convo.id)
+        self.assertEqual(results, [self.message])
+        self.assertTrue(results[0].snippet.endswith("<mark>needle</mark>"))
+        self.assertTrue(results[0].snippet.startswith("..."))
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(ranked_search("messages", "needle", self.convo.id), results)
+
+        self.message.delete()
+        self.assertEqual(ranked_search("messages", "needle", self.convo.id), [])
+
+    def test_compress_existing(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE remesh_app_message SET text = %s WHERE id = %s",
+                [self.long_text, self.short.id],
+            )
+            self.assertEqual(
+                self.stored("remesh_app_message", self.short.id)[0], "text"
+            )
+            self.assertEqual(compress_existing(cursor, "remesh_app_message", "text"), 1)
+        self.assertEqual(self.stored("remesh_app_message", self.short.id)[0], "blob")
+        self.assertEqual(Message.objects.get(id=self.short.id).text, self.long_text)
+        self.assertEqual(len(ranked_search("messages", "needle", self.convo.id)), 2)
+
+
+class PaginationTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.messages = [
+            Message.objects.create(conversation=self.convo, text=f"Message {i}")
+            for i in range(5)
+        ]
+        self.url = reverse("remesh_app:conversation", args=[self.convo.id])
+
+    def test_first_page(self):
+        response = self.client.get(self.url, {"page_size": 2})
+        page = response.context["page"]
+        self.assertEqual(page.items, [self.messages[4], self.messages[3]])
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+        self.assertContains(response, "Older")
+        self.assertNotContains(response, "Newer")
+
+    def test_walk_forward_and_back(self):
+        """
+        Test that following the before/after cursors visits every message once
+        and returns to the same pages
+        """
+        seen = []
+        pages = []
+        params = {"page_size": 2}
+        while True:
+            page = self.client.get(self.url, params).context["page"]
+            pages.append(page.items)
+            seen.extend(page.items)
+            if not page.has_next:
+                break
+            params = {"page_size": 2, "before": page.next_cursor}
+        self.assertEqual(seen, self.messages[::-1])
+
+        params = {"page_size": 2, "after": page.previous_cursor}
+        page = self.client.get(self.url, params).context["page"]
+        self.assertEqual(page.items, pages[-2])
+        self.assertTrue(page.has_next)
+        self.assertTrue(page.has_previous)
+
+    def test_ties_are_broken_by_id(self):
+        """
+        Test that messages sharing a sent_datetime are not skipped or repeated
+        """
+        Message.objects.filter(conversation=self.convo).update(
+            sent_datetime=self.messages[0].sent_datetime
+        )
+        seen = []
+        params = {"page_size": 2}
+        while True:
+            page = self.client.get(self.url, params).context["page"]
+            seen.extend(page.items)
+            if not page.has_next:
+                break
+            params = {"page_size": 2, "before": page.next_cursor}
+        self.assertEqual(seen, self.messages[::-1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"before": "not-a-cursor"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["page"]), 5)
+
+    def test_message_and_conversations_pages(self):
+        for i in range(3):
+            Thought.objects.create(message=self.messages[0], text=f"Thought {i}")
+        url = reverse("remesh_app:message", args=[self.messages[0].id])
+        response = self.client.get(url, {"page_size": 2})
+        self.assertEqual(len(response.context["thoughts"]), 2)
+        self.assertContains(response, "Older")
+
+        Conversation.objects.create(title="Another Conversation")
+        url = reverse("remesh_app:conversations")
+        response = self.client.get(url, {"page_size": 1})
+        self.assertEqual(response.context["conversations"], [self.convo])
+        page = response.context["page"]
+        response = self.client.get(url, {"page_size": 1, "before": page.next_cursor})
+        self.assertEqual(
+            [c.title for c in response.context["conversations"]],
+            ["Another Conversation"],
+        )
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query made by the read views and checks that
+    each one is answered from an index, without a table scan or a sort
+    """
+
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.messages = [
+            Message.objects.create(conversation=self.convo, text=f"Message {i}")
+            for i in range(3)
+        ]
+        for message in self.messages:
+            Thought.objects.create(message=message, text="Thought")
+
+    def assertIndexedQueries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                # Full-text indexes are read with MATCH, shown as a virtual table
+                # scan with an M constraint
+                indexed = "USING" in step or re.search(
+                    r"VIRTUAL TABLE INDEX \d+:M", step
+                )
+                self.assertFalse(
+                    step.startswith("SCAN") and not indexed,
+                    f"Table scan in {query['sql']}: {plan}",
+                )
+                if "ORDER BY rank" in query["sql"]:
+                    # Ranked searches sort their matches (see test_ranked_search_plan)
+                    continue
+                self.assertNotIn("TEMP B-TREE", step, f"Sort in {query['sql']}: {plan}")
+        return response
+
+    def test_conversations_plan(self):
+        url = reverse("remesh_app:conversations")
+        Conversation.objects.create(title="Another Conversation")
+        page = self.assertIndexedQueries(url, {"page_size": 1}).context["page"]
+        self.assertIndexedQueries(url, {"page_size": 1, "before": page.next_cursor})
+        params = {"page_size": 1, "sort": "activity"}
+        page = self.assertIndexedQueries(url, params).context["page"]
+        self.assertIndexedQueries(url, {**params, "before": page.next_cursor})
+
+    def test_conversation_plan(self):
+        url = reverse("remesh_app:conversation", args=[self.convo.id])
+        page = self.assertIndexedQueries(url, {"page_size": 1}).context["page"]
+        page = self.assertIndexedQueries(
+            url, {"page_size": 1, "before": page.next_cursor}
+        ).context["page"]
+        self.assertIndexedQueries(url, {"page_size": 1, "after": page.previous_cursor})
+
+    def test_snapshot_plan(self):
+        with mock.patch("remesh_app.snapshots.SNAPSHOTS", True):
+            rebuild_snapshot(self.convo.id)
+            for name in ("conversation", "api_conversation_snapshot"):
+                url = reverse(f"remesh_app:{name}", args=[self.convo.id])
+                response = self.assertIndexedQueries(url, {"page_size": 1})
+                if name == "conversation":
+                    cursor = response.context["page"].next_cursor
+                else:
+                    cursor = response.json()["next"]
+                self.assertIndexedQueries(url, {"page_size": 1, "before": cursor})
+
+    def test_message_plan(self):
+        Thought.objects.create(message=self.messages[0], text="Another Thought")
+        url = reverse("remesh_app:message", args=[self.messages[0].id])
+        page = self.assertIndexedQueries(url, {"page_size": 1}).context["page"]
+        page = self.assertIndexedQueries(
+            url, {"page_size": 1, "before": page.next_cursor}
+        ).context["page"]
+        self.assertIndexedQueries(url, {"page_size": 1, "after": page.previous_cursor})
+
+    def test_message_thoughts_plan(self):
+        Thought.objects.create(message=self.messages[0], text="Another Thought")
+        url = reverse("remesh_app:message_thoughts", args=[self.messages[0].id])
+        page = self.assertIndexedQueries(url, {"page_size": 1}).context["page"]
+        self.assertIndexedQueries(url, {"page_size": 1, "before": page.next_cursor})
+
+    def test_archived_conversations_plan(self):
+        archive_conversation(self.convo.id)
+        archive_conversation(
+            Conversation.objects.create(title="Another Conversation").id
+        )
+        url = reverse("remesh_app:archived_conversations")
+        page = self.assertIndexedQueries(url, {"page_size": 1}).context["page"]
+        self.assertIndexedQueries(url, {"page_size": 1, "before": page.next_cursor})
+
+    def test_search_plan(self):
+        for search_type in ("messages", "thoughts"):
+            url = reverse("remesh_app:search", args=[search_type, self.convo.id])
+            self.assertIndexedQueries(url, {"q": "Message"})
+            # Too short for the index, so the conversation's rows are compared
+            self.assertIndexedQueries(url, {"q": "M"})
+        url = reverse("remesh_app:search", args=["conversations"])
+        self.assertIndexedQueries(url, {"q": "Test"})
+        self.assertIndexedQueries(url, {"q": "T"})
+
+    def test_ranked_search_plan(self):
+        """
+        Test that searches read the full-text index with MATCH and join the rows by
+        their keys, so only the matches are sorted (by rank)
+        """
+        for search_type in ("messages", "thoughts", "conversations"):
+            raw = ranked_search_query(search_type, "Test", self.convo.id)
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + raw.raw_query, raw.params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            self.assertRegex(plan[0], r"^SCAN \w+_fts VIRTUAL TABLE INDEX \d+:M", plan)
+            for step in plan[1:-1]:
+                self.assertTrue(step.startswith("SEARCH"), plan)
+            self.assertEqual(plan[-1], "USE TEMP B-TREE FOR ORDER BY", plan)
+
+
+class CounterTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+        self.thought = Thought.objects.create(message=self.msg, text="Test Thought")
+
+    def assertCounts(self, messages, thoughts, message_thoughts=None):
+        self.convo.refresh_from_db()
+        self.assertEqual(self.convo.message_count, messages)
+        self.assertEqual(self.convo.thought_count, thoughts)
+        if message_thoughts is not None:
+            self.msg.refresh_from_db()
+            self.assertEqual(self.msg.thought_count, message_thoughts)
+
+    def test_counts_on_create(self):
+        self.assertCounts(1, 1, 1)
+        self.assertEqual(self.convo.last_activity, self.thought.sent_datetime)
+
+    def test_counts_from_views(self):
+        self.client.post(
+            reverse("remesh_app:new_message", args=[self.convo.id]), {"text": "New"}
+        )
+        self.client.post(
+            reverse("remesh_app:new_thought", args=[self.msg.id]), {"text": "New"}
+        )
+        self.assertCounts(2, 2, 2)
+        newest = Thought.objects.latest("sent_datetime")
+        self.assertEqual(self.convo.last_activity, newest.sent_datetime)
+
+    def test_counts_on_delete(self):
+        Thought.objects.create(message=self.msg, text="Another Thought")
+        self.thought.delete()
+        self.assertCounts(1, 1, 1)
+
+        Message.objects.create(conversation=self.convo, text="Another Message")
+        Thought.objects.create(message=self.msg, text="Late Thought")
+        # Loaded before the last thought was added, so its thought_count is out of date
+        self.msg.delete()
+        self.assertCounts(1, 0)
+
+        Message.objects.all().delete()
+        self.assertCounts(0, 0)
+
+    def test_conversations_sorted_by_activity(self):
+        other = Conversation.objects.create(title="Other Conversation")
+        url = reverse("remesh_app:conversations")
+        response = self.client.get(url, {"sort": "activity"})
+        self.assertEqual(response.context["conversations"], [other, self.convo])
+        self.assertContains(response, "1 message, 1 thought")
+
+        Thought.objects.create(message=self.msg, text="Newest Thought")
+        response = self.client.get(url, {"sort": "activity"})
+        self.assertEqual(response.context["conversations"], [self.convo, other])
+
+    def test_reconcile_counters(self):
+        Conversation.objects.update(message_count=5, thought_count=7)
+        Message.objects.update(thought_count=3)
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("Fixed 2 rows", out.getvalue())
+        self.assertCounts(1, 1, 1)
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("Fixed 0 rows", out.getvalue())
+
+
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+        self.url = reverse("remesh_app:conversation", args=[self.convo.id])
+
+    def test_second_request_is_cached(self):
+        self.client.get(self.url)
+        # Only the ETag / Last-Modified lookup hits the database
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Test Message")
+
+    def test_new_thought_invalidates_pages(self):
+        message_url = reverse("remesh_app:message", args=[self.msg.id])
+        list_url = reverse("remesh_app:conversations")
+        for url in (self.url, message_url, list_url):
+            self.client.get(url)
+        self.client.post(
+            reverse("remesh_app:new_thought", args=[self.msg.id]),
+            {"text": "Fresh Thought"},
+        )
+        self.assertContains(self.client.get(self.url), "1 thought")
+        self.assertContains(self.client.get(message_url), "Fresh Thought")
+        self.assertContains(self.client.get(list_url), "1 message, 1 thought")
+
+    def test_edit_invalidates_pages(self):
+        self.client.get(self.url)
+        self.convo.title = "Renamed Conversation"
+        self.convo.save()
+        self.assertContains(self.client.get(self.url), "Renamed Conversation")
+
+    def test_message_fragments_are_reused(self):
+        other = Message.objects.create(conversation=self.convo, text="Other Message")
+        self.client.get(self.url)
+        key = make_template_fragment_key(
+            "conversation_message", [self.msg.id, 0, self.msg.text]
+        )
+        fragment = caches["template_fragments"].get(key)
+        self.assertIn("Test Message", fragment)
+
+        # The page is rendered again for the new thought, from the cached fragment
+        # of the unchanged message
+        caches["template_fragments"].set(key, fragment.replace("Test", "Cached"))
+        Thought.objects.create(message=other, text="Fresh Thought")
+        response = self.client.get(self.url)
+        self.assertContains(response, "Cached Message")
+        self.assertContains(response, "1 thought")
+        caches["template_fragments"].delete(key)
+
+    def test_cached_page_keeps_headers(self):
+        @cached_page("message", "message_id")
+        def view(request, message_id):
+            response = HttpResponse('{"id": 1}', content_type="application/json")
+            response["Vary"] = "Accept-Language"
+            return response
+
+        request = RequestFactory().get("/headers/")
+        view(request, message_id=self.msg.id)
+        response = view(request, message_id=self.msg.id)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response["Vary"], "Accept-Language")
+        self.assertEqual(response.content, b'{"id": 1}')
+
+    def test_cache_stats(self):
+        before = self.client.get(reverse("remesh_app:cache_stats")).json()
+        self.client.get(self.url)
+        self.client.get(self.url)
+        after = self.client.get(reverse("remesh_app:cache_stats")).json()
+        self.assertEqual(after["hits"] - before["hits"], 1)
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertGreater(after["hit_ratio"], 0)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+        self.urls = [
+            reverse("remesh_app:conversations"),
+            reverse("remesh_app:conversation", args=[self.convo.id]),
+            reverse("remesh_app:message", args=[self.msg.id]),
+        ]
+
+    def test_not_modified(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertTrue(response.has_header("ETag"))
+            self.assertTrue(response.has_header("Last-Modified"))
+            with self.assertNumQueries(1):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response.headers["ETag"]
+                )
+            self.assertEqual(response.status_code, 304)
+
+    def test_modified_after_write(self):
+        etags = [self.client.get(url).headers["ETag"] for url in self.urls]
+        Thought.objects.create(message=self.msg, text="New Thought")
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_modified_after_edit(self):
+        url = self.urls[1]
+        etag = self.client.get(url).headers["ETag"]
+        self.convo.title = "Renamed Conversation"
+        self.convo.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Renamed Conversation")
+
+    def test_if_modified_since_is_ignored(self):
+        # Last-Modified has a resolution of one second, so the thought is most
+        # likely added in the same second the page was sent
+        url = self.urls[2]
+        last_modified = self.client.get(url).headers["Last-Modified"]
+        Thought.objects.create(message=self.msg, text="New Thought")
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertContains(response, "New Thought")
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+
+    def post_json(self, url, data, **extra):
+        return self.client.post(
+            url, json.dumps(data), content_type="application/json", **extra
+        )
+
+    def test_list_and_detail(self):
+        response = self.client.get(reverse("remesh_app:api_conversations"))
+        self.assertEqual(response.json()["results"][0]["title"], "Test Conversation")
+        response = self.client.get(
+            reverse("remesh_app:api_messages", args=[self.convo.id])
+        )
+        self.assertEqual(response.json()["results"][0]["text"], "Test Message")
+        response = self.client.get(
+            reverse("remesh_app:api_message", args=[self.msg.id])
+        )
+        self.assertEqual(response.json()["conversation"], self.convo.id)
+        response = self.client.get(reverse("remesh_app:api_conversation", args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_create(self):
+        response = self.post_json(
+            reverse("remesh_app:api_thoughts", args=[self.msg.id]), {"text": "Hi"}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Thought.objects.filter(id=response.json()["id"]).exists())
+        response = self.post_json(
+            reverse("remesh_app:api_conversations"), {"title": ""}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("title", response.json()["errors"])
+
+    def test_body_must_be_an_object(self):
+        urls = [
+            reverse("remesh_app:api_conversations"),
+            reverse("remesh_app:api_messages", args=[self.convo.id]),
+            reverse("remesh_app:api_thoughts", args=[self.msg.id]),
+            reverse("remesh_app:api_bulk_thoughts", args=[self.msg.id]),
+        ]
+        for url in urls:
+            for body in ("[1, 2]", '"text"', "3", "null", "{"):
+                response = self.client.post(url, body, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["error"], "Expected a JSON object")
+
+    def test_bulk_messages(self):
+        url = reverse("remesh_app:api_bulk_messages", args=[self.convo.id])
+        items = [{"text": f"Bulk Message {i}"} for i in range(1000)]
+        response = self.post_json(url, {"messages": items})
+        self.assertEqual(response.status_code, 201)
+        ids = response.json()["ids"]
+        self.assertEqual(len(ids), 1000)
+        self.assertEqual(Message.objects.get(id=ids[-1]).text, "Bulk Message 999")
+        self.convo.refresh_from_db()
+        self.assertEqual(self.convo.message_count, 1001)
+
+    def test_bulk_thoughts(self):
+        url = reverse("remesh_app:api_bulk_thoughts", args=[self.msg.id])
+        items = [{"text": f"Bulk Thought {i}"} for i in range(10)]
+        response = self.post_json(url, {"thoughts": items})
+        self.assertEqual(len(response.json()["ids"]), 10)
+        self.msg.refresh_from_db()
+        self.assertEqual(self.msg.thought_count, 10)
+        page = reverse("remesh_app:message", args=[self.msg.id])
+        self.assertContains(self.client.get(page), "Bulk Thought 9")
+
+    def test_bulk_is_all_or_nothing(self):
+        url = reverse("remesh_app:api_bulk_messages", args=[self.convo.id])
+        response = self.post_json(url, {"messages": [{"text": "Good"}, {"text": ""}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("1", response.json()["errors"])
+        self.assertFalse(Message.objects.filter(text="Good").exists())
+
+        response = self.post_json(url, {"messages": "not a list"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_large_bulk_request(self):
+        url = reverse("remesh_app:api_bulk_messages", args=[self.convo.id])
+        items = [{"text": "x" * 400} for i in range(8000)]
+        body = json.dumps({"messages": items})
+        self.assertGreater(len(body), settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        response = self.client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["ids"]), 8000)
+
+    def test_body_too_large(self):
+        body = json.dumps({"text": "x" * 200})
+        with mock.patch("remesh_app.api.MAX_BODY_BYTES", 100):
+            response = self.client.post(
+                reverse("remesh_app:api_messages", args=[self.convo.id]),
+                body,
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(
+            response.json()["error"], "Request bodies are limited to 100 bytes"
+        )
+        body = json.dumps({"messages": [{"text": "x" * 200}]})
+        with mock.patch("remesh_app.api.MAX_BULK_BYTES", 100):
+            response = self.client.post(
+                reverse("remesh_app:api_bulk_messages", args=[self.convo.id]),
+                body,
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Message.objects.filter(text="x" * 200).exists())
+
+    @mock.patch("remesh_app.api.API_TOKEN", "secret")
+    def test_api_token(self):
+        url = reverse("remesh_app:api_messages", args=[self.convo.id])
+        for headers in (
+            {},
+            {"HTTP_AUTHORIZATION": "Bearer wrong"},
+            {"HTTP_AUTHORIZATION": "secret"},
+        ):
+            response = self.post_json(url, {"text": "Hi"}, **headers)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.json()["error"], "Invalid API token")
+        response = self.post_json(
+            url, {"text": "Hi"}, HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 201)
+        # Reads don't need it
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_bulk_conversations(self):
+        url = reverse("remesh_app:api_bulk_conversations")
+        response = self.post_json(
+            url, {"conversations": [{"title": "One"}, {"title": "Two"}]}
+        )
+        self.assertEqual(len(response.json()["ids"]), 2)
+        self.assertContains(self.client.get(reverse("remesh_app:conversations")), "Two")
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg_1 = Message.objects.create(conversation=self.convo, text="Message 1")
+        self.msg_2 = Message.objects.create(conversation=self.convo, text="Message 2")
+        self.thought = Thought.objects.create(message=self.msg_1, text="Thought, 1")
+
+    def test_ndjson_export(self):
+        url = reverse("remesh_app:export_conversation", args=[self.convo.id, "ndjson"])
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        content = b"".join(response.streaming_content).decode()
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(
+            [(record["type"], record["id"]) for record in records],
+            [
+                ("conversation", self.convo.id),
+                ("message", self.msg_1.id),
+                ("message", self.msg_2.id),
+                ("thought", self.thought.id),
+            ],
+        )
+        self.assertEqual(records[3]["message"], self.msg_1.id)
+
+    def test_csv_export(self):
+        url = reverse("remesh_app:export_conversation", args=[self.convo.id, "csv"])
+        response = self.client.get(url)
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]["title"], "Test Conversation")
+        self.assertEqual(rows[3]["text"], "Thought, 1")
+
+    def test_unknown_format(self):
+        url = reverse("remesh_app:export_conversation", args=[self.convo.id, "xml"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_export_command(self):
+        url = reverse("remesh_app:export_conversation", args=[self.convo.id, "csv"])
+        expected = b"".join(self.client.get(url).streaming_content).decode()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.csv")
+            call_command(
+                "export_conversation", self.convo.id, format="csv", output=path
+            )
+            with open(path, newline="") as output:
+                self.assertEqual(output.read(), expected)
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        load_archive.cache_clear()
+        self.convo = Conversation.objects.create(title="Quiet conversation")
+        self.msg_1 = Message.objects.create(conversation=self.convo, text="First words")
+        self.msg_2 = Message.objects.create(conversation=self.convo, text="Last words")
+        self.thought = Thought.objects.create(message=self.msg_1, text="Faded thought")
+        Conversation.objects.filter(id=self.convo.id).update(
+            last_activity=timezone.now() - timezone.timedelta(days=100)
+        )
+        self.convo.refresh_from_db()
+        self.active = Conversation.objects.create(title="Busy conversation")
+
+    def archive(self):
+        out = StringIO()
+        call_command("archive_conversations", days=30, stdout=out)
+        self.assertIn("Archived 1 conversations", out.getvalue())
+
+    def test_archive_moves_inactive_conversations(self):
+        self.archive()
+        self.assertEqual(list(Conversation.objects.all()), [self.active])
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(Thought.objects.exists())
+        archived = ArchivedConversation.objects.get()
+        self.assertEqual(archived.id, self.convo.id)
+        self.assertEqual((archived.message_count, archived.thought_count), (2, 1))
+        self.assertEqual(
+            set(ArchivedMessage.objects.values_list("id", flat=True)),
+            {self.msg_1.id, self.msg_2.id},
+        )
+        # Gone from the search index too
+        self.assertEqual(ranked_search("messages", "words", self.convo.id), [])
+        self.assertEqual(ranked_search("conversations", "quiet"), [])
+
+    def test_archived_pages(self):
+        self.archive()
+        url = reverse("remesh_app:conversation", args=[self.convo.id])
+        response = self.client.get(url, {"page_size": 1})
+        self.assertContains(response, "Quiet conversation")
+        self.assertContains(response, "This conversation is archived")
+        self.assertNotContains(response, "Send a message")
+        self.assertEqual(list(response.context["message_dict"]), [str(self.msg_2.id)])
+        response = self.client.get(f"{url}?{response.context['page'].next_query}")
+        self.assertEqual(list(response.context["message_dict"]), [str(self.msg_1.id)])
+        self.assertContains(response, "1 thought")
+
+        response = self.client.get(reverse("remesh_app:message", args=[self.msg_1.id]))
+        self.assertContains(response, "Faded thought")
+        self.assertNotContains(response, "Add a new thought")
+        response = self.client.get(
+            reverse("remesh_app:message_thoughts", args=[self.msg_1.id])
+        )
+        self.assertContains(response, "Faded thought")
+        # Decoded once, then read from the cache
+        self.assertEqual(load_archive.cache_info().misses, 1)
+
+        # Conditional requests work for archived pages too
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_archived_list_and_search(self):
+        self.archive()
+        response = self.client.get(reverse("remesh_app:conversations"))
+        self.assertNotContains(response, "Quiet conversation")
+        self.assertContains(response, reverse("remesh_app:archived_conversations"))
+        response = self.client.get(reverse("remesh_app:archived_conversations"))
+        self.assertContains(response, "Quiet conversation")
+        self.assertContains(response, "2 messages, 1 thought")
+
+        for url in (
+            reverse("remesh_app:search", args=["conversations"]),
+            reverse("remesh_app:async_search", args=["conversations"]),
+        ):
+            response = self.client.get(url, {"q": "conversation"})
+            self.assertEqual(
+                [result.id for result in response.context["results"]],
+                [self.active.id, self.convo.id],
+            )
+            self.assertContains(response, "(archived)", count=1)
+            response = self.client.get(url, {"q": "quiet conv"})
+            self.assertEqual(
+                [result.id for result in response.context["results"]], [self.convo.id]
+            )
+
+    async def test_archived_async_pages(self):
+        await sync_to_async(self.archive)()
+        response = await self.async_client.get(
+            reverse("remesh_app:async_conversation", args=[self.convo.id])
+        )
+        self.assertContains(response, "Last words")
+        response = await self.async_client.get(
+            reverse("remesh_app:async_message", args=[self.msg_1.id])
+        )
+        self.assertContains(response, "Faded thought")
+
+    def test_restore(self):
+        self.archive()
+        out = StringIO()
+        call_command("restore_conversation", self.convo.id, stdout=out)
+        self.assertIn("2 messages and 1 thoughts", out.getvalue())
+        self.assertFalse(ArchivedConversation.objects.exists())
+        self.assertFalse(ArchivedMessage.objects.exists())
+
+        restored = Conversation.objects.get(id=self.convo.id)
+        self.assertEqual(restored.title, self.convo.title)
+        self.assertEqual(restored.start_date, self.convo.start_date)
+        self.assertEqual(restored.last_activity, self.convo.last_activity)
+        self.assertEqual((restored.message_count, restored.thought_count), (2, 1))
+        message = Message.objects.get(id=self.msg_1.id)
+        self.assertEqual(message.sent_datetime, self.msg_1.sent_datetime)
+        self.assertEqual(message.preview, self.msg_1.preview)
+        self.assertEqual(message.thought_set.get().id, self.thought.id)
+        self.assertEqual(
+            {m.id for m in ranked_search("messages", "words", self.convo.id)},
+            {self.msg_1.id, self.msg_2.id},
+        )
+
+        with self.assertRaises(CommandError):
+            call_command("restore_conversation", self.convo.id, stdout=StringIO())
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        patch = mock.patch("remesh_app.snapshots.SNAPSHOTS", True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.convo = Conversation.objects.create(title="Snapshot conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="First message")
+        self.thought = Thought.objects.create(message=self.msg, text="First thought")
+        self.url = reverse("remesh_app:api_conversation_snapshot", args=[self.convo.id])
+
+    def test_new_rows_are_appended(self):
+        self.client.post(
+            reverse("remesh_app:new_message", args=[self.convo.id]),
+            {"text": "Second message"},
+        )
+        self.client.post(
+            reverse("remesh_app:new_thought", args=[self.msg.id]),
+            {"text": "Second thought"},
+        )
+        entry = SnapshotMessage.objects.get(id=self.msg.id)
+        self.assertEqual(entry.thought_count, 2)
+        self.assertEqual(
+            [thought["preview"] for thought in entry.thoughts],
+            ["First thought", "Second thought"],
+        )
+        self.assertTrue(snapshot_matches(self.convo.id))
+
+    def test_bulk_thoughts_are_appended_in_order(self):
+        count = APPEND_BATCH_SIZE + 10
+        response = self.client.post(
+            reverse("remesh_app:api_bulk_thoughts", args=[self.msg.id]),
+            json.dumps({"thoughts": [{"text": f"Bulk {i}"} for i in range(count)]}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        entry = SnapshotMessage.objects.get(id=self.msg.id)
+        self.assertEqual(entry.thought_count, count + 1)
+        self.assertEqual(entry.thoughts[-1]["id"], response.json()["ids"][-1])
+        self.assertTrue(snapshot_matches(self.convo.id))
+
+    def test_api_snapshot(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data["conversation"]["id"], self.convo.id)
+        (message,) = data["results"]
+        self.assertEqual(message["text"], "First message")
+        self.assertEqual(message["thought_count"], 1)
+        self.assertEqual(message["thoughts"][0]["id"], self.thought.id)
+        self.assertEqual(message["thoughts"][0]["preview"], "First thought")
+
+        # The page is read from the snapshot alone
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+        # Built from the tables, in the same format, without a complete snapshot
+        ConversationSnapshot.objects.all().delete()
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get(self.url).json(), data)
+
+    def test_conversation_page(self):
+        # The page is read from the snapshot, not from the messages
+        SnapshotMessage.objects.filter(id=self.msg.id).update(text="Snapshot text")
+        for name in ("async_conversation", "conversation"):
+            url = reverse(f"remesh_app:{name}", args=[self.convo.id])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, "Snapshot text")
+            self.assertContains(response, "1 thought")
+            for query in queries.captured_queries:
+                self.assertNotIn('FROM "remesh_app_message"', query["sql"])
+
+        # Read from the messages without a complete snapshot
+        ConversationSnapshot.objects.all().delete()
+        bump_version("conversation", self.convo.id)
+        self.assertContains(self.client.get(url), "First message")
+
+    def test_edits_and_deletes_refresh_the_message(self):
+        self.msg.refresh_from_db()
+        self.msg.text = "Edited message"
+        self.msg.save()
+        self.assertEqual(
+            SnapshotMessage.objects.get(id=self.msg.id).text, "Edited message"
+        )
+        self.thought.text = "Edited thought"
+        self.thought.save()
+        entry = SnapshotMessage.objects.get(id=self.msg.id)
+        self.assertEqual(entry.thoughts[0]["preview"], "Edited thought")
+        self.thought.delete()
+        entry = SnapshotMessage.objects.get(id=self.msg.id)
+        self.assertEqual((entry.thought_count, entry.thoughts), (0, []))
+        self.msg.delete()
+        self.assertFalse(SnapshotMessage.objects.exists())
+        self.assertTrue(snapshot_matches(self.convo.id))
+
+    def test_check_snapshots_rebuilds_divergent_ones(self):
+        # Inserted without the models, like seed_remesh
+        older = Conversation.objects.bulk_create([Conversation(title="Older")])[0]
+        Message.objects.bulk_create([Message(conversation=older, text="Unseen")])
+        SnapshotMessage.objects.filter(id=self.msg.id).update(thoughts=[])
+        self.assertFalse(snapshot_matches(self.convo.id))
+
+        out = StringIO()
+        call_command("check_snapshots", stdout=out)
+        self.assertIn("Checked 2 conversations, rebuilt 2 snapshots", out.getvalue())
+        self.assertTrue(snapshot_matches(self.convo.id))
+        self.assertTrue(snapshot_matches(older.id))
+
+        out = StringIO()
+        call_command("check_snapshots", stdout=out)
+        self.assertIn("rebuilt 0 snapshots", out.getvalue())
+
+        with mock.patch("remesh_app.snapshots.SNAPSHOTS", False):
+            with self.assertRaises(CommandError):
+                call_command("check_snapshots", stdout=StringIO())
+
+    def test_archive_and_restore(self):
+        Conversation.objects.filter(id=self.convo.id).update(
+            last_activity=timezone.now() - timezone.timedelta(days=100)
+        )
+        call_command("archive_conversations", days=30, stdout=StringIO())
+        self.assertFalse(SnapshotMessage.objects.exists())
+        self.assertFalse(ConversationSnapshot.objects.exists())
+        call_command("restore_conversation", self.convo.id, stdout=StringIO())
+        self.assertTrue(snapshot_matches(self.convo.id))
+
+
+class ImportTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "import.ndjson")
+        records = [
+            {
+                "type": "conversation",
+                "id": 7,
+                "title": "Imported",
+                "start_date": "2020-01-02",
+            }
+        ]
+        for i in range(5):
+            records.append(
+                {
+                    "type": "message",
+                    "id": 100 + i,
+                    "conversation": 7,
+                    "text": f"Imported Message {i}",
+                    "sent_datetime": f"2020-01-02T10:0{i}:00+00:00",
+                }
+            )
+            records.append(
+                {
+                    "type": "thought",
+                    "id": 200 + i,
+                    "message": 100 + i,
+                    "text": f"Imported Thought {i}",
+                    "sent_datetime": f"2020-01-02T11:0{i}:00+00:00",
+                }
+            )
+        with open(self.path, "w") as file:
+            file.writelines(json.dumps(record) + "\n" for record in records)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_import(self):
+        out = StringIO()
+        call_command(
+            "import_remesh",
+            self.path,
+            preserve_timestamps=True,
+            batch_size=4,
+            stdout=out,
+        )
+        self.assertIn("Imported 11 records", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        convo = Conversation.objects.get(title="Imported")
+        self.assertEqual(convo.start_date.isoformat(), "2020-01-02")
+        self.assertEqual(convo.message_count, 5)
+        self.assertEqual(convo.thought_count, 5)
+        self.assertEqual(convo.last_activity.isoformat(), "2020-01-02T11:04:00+00:00")
+        message = convo.get_messages()[0]
+        self.assertEqual(message.text, "Imported Message 4")
+        self.assertEqual(message.sent_datetime.isoformat(), "2020-01-02T10:04:00+00:00")
+        self.assertEqual(message.get_thoughts()[0].text, "Imported Thought 4")
+
+    def test_counters_are_updated_per_batch(self):
+        importer = Importer(self.path, preserve_timestamps=True)
+        with open(self.path) as file, CaptureQueriesContext(connection) as queries:
+            importer.run(read_records(file, "ndjson"))
+        updates = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("UPDATE")
+        ]
+        # Message counts of the conversation, then thought counts of the messages and
+        # of the conversation
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(reconcile_counters(), 0)
+        # The timestamps from the file are only kept during the import
+        convo = Conversation.objects.get(title="Imported")
+        message = Message.objects.create(conversation=convo, text="New")
+        self.assertEqual(message.sent_datetime.date(), timezone.now().date())
+
+    def test_resume_after_interruption(self):
+        def interrupted(records):
+            for i, record in enumerate(records):
+                if i == 6:
+                    raise KeyboardInterrupt
+                yield record
+
+        importer = Importer(self.path, batch_size=3)
+        with open(self.path) as file:
+            with self.assertRaises(KeyboardInterrupt):
+                importer.run(interrupted(read_records(file, "ndjson")))
+        self.assertEqual(Message.objects.count(), 3)
+
+        out = StringIO()
+        call_command("import_remesh", self.path, batch_size=3, stdout=out)
+        self.assertIn("Resuming after 6 records", out.getvalue())
+        self.assertEqual(Conversation.objects.filter(title="Imported").count(), 1)
+        self.assertEqual(Message.objects.count(), 5)
+        self.assertEqual(Thought.objects.count(), 5)
+
+    def test_import_again(self):
+        call_command("import_remesh", self.path, batch_size=4, stdout=StringIO())
+        self.assertFalse(ImportBatch.objects.exists())
+        out = StringIO()
+        call_command("import_remesh", self.path, batch_size=4, stdout=out)
+        self.assertNotIn("Resuming", out.getvalue())
+        self.assertEqual(Conversation.objects.filter(title="Imported").count(), 2)
+        self.assertEqual(Message.objects.count(), 10)
+
+    def test_import_export_round_trip(self):
+        call_command(
+            "import_remesh", self.path, preserve_timestamps=True, stdout=StringIO()
+        )
+        convo = Conversation.objects.get(title="Imported")
+        export_path = os.path.join(self.directory.name, "export.csv")
+        call_command("export_conversation", convo.id, format="csv", output=export_path)
+        call_command(
+            "import_remesh", export_path, preserve_timestamps=True, stdout=StringIO()
+        )
+        copy = Conversation.objects.filter(title="Imported").last()
+        self.assertNotEqual(copy.id, convo.id)
+        self.assertEqual(
+            [m.text for m in copy.get_messages()],
+            [m.text for m in convo.get_messages()],
+        )
+        self.assertEqual(copy.thought_count, 5)
+
+
+class SeedTestCase(TestCase):
+    def seed(self, **options):
+        call_command(
+            "seed_remesh",
+            conversations=20,
+            messages=5,
+            thoughts=2,
+            stdout=StringIO(),
+            **options,
+        )
+
+    def test_seed(self):
+        self.seed()
+        self.assertEqual(Conversation.objects.count(), 20)
+        self.assertGreater(Message.objects.count(), 0)
+        self.assertGreater(Thought.objects.count(), 0)
+        # The counters are filled in as the signals would have
+        self.assertEqual(reconcile_counters(), 0)
+        # Timestamps are spread over the past instead of all being now
+        today = timezone.now().date()
+        dates = set(Conversation.objects.values_list("start_date", flat=True))
+        self.assertGreater(len(dates), 1)
+        self.assertTrue(all(date < today for date in dates))
+        message = Message.objects.order_by("id").first()
+        thought = message.get_thoughts().last()
+        if thought:
+            self.assertGreater(thought.sent_datetime, message.sent_datetime)
+
+    def test_text_lengths(self):
+        self.seed(message_length=(5, 10), thought_length=(30, 30))
+        for text in Message.objects.values_list("text", flat=True):
+            self.assertLessEqual(len(text), 10)
+        for text in Thought.objects.values_list("text", flat=True):
+            self.assertLessEqual(len(text), 30)
+
+    def test_long_texts_are_compressed(self):
+        self.seed(message_length=(2000, 2000))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT DISTINCT typeof(text) FROM {Message._meta.db_table}"
+            )
+            self.assertEqual(cursor.fetchall(), [("blob",)])
+        message = Message.objects.order_by("id").first()
+        self.assertGreater(len(message.text), 1900)
+        term = message.text.split()[0]
+        results = ranked_search("messages", term, message.conversation_id)
+        self.assertIn(message.id, [result.id for result in results])
+
+    def test_same_seed_same_data(self):
+        self.seed(seed=3)
+        first = list(Message.objects.order_by("id").values_list("text", flat=True))
+        Conversation.objects.all().delete()
+        self.seed(seed=3)
+        second = list(Message.objects.order_by("id").values_list("text", flat=True))
+        self.assertEqual(first, second)
+        self.seed(seed=4)
+        third = list(
+            Message.objects.order_by("id").values_list("text", flat=True)[len(first) :]
+        )
+        self.assertNotEqual(first, third)
+
+    def test_seeded_rows_are_searchable(self):
+        self.seed()
+        message = Message.objects.order_by("-id").first()
+        term = message.text.split()[0]
+        results = ranked_search("messages", term, message.conversation_id)
+        self.assertIn(message.id, [result.id for result in results])
+        # The triggers are back, so rows created afterwards are indexed too
+        new = Message.objects.create(conversation=message.conversation, text="zebra")
+        results = ranked_search("messages", "zebra", message.conversation_id)
+        self.assertEqual([result.id for result in results], [new.id])
+
+
+class DatabaseSettingsTestCase(TestCase):
+    def test_pragmas_applied_on_connect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {
+                **connection.settings_dict,
+                "NAME": os.path.join(directory, "test.sqlite3"),
+                "PRAGMAS": {"journal_mode": "WAL", "busy_timeout": 1234},
+            }
+            wrapper = SQLiteWrapper(settings_dict, alias="pragma_test")
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("PRAGMA busy_timeout")
+                    self.assertEqual(cursor.fetchone()[0], 1234)
+            finally:
+                wrapper.close()
+
+    def test_transaction_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {
+                **connection.settings_dict,
+                "NAME": os.path.join(directory, "test.sqlite3"),
+                "TRANSACTION_MODE": "IMMEDIATE",
+            }
+            wrapper = SQLiteWrapper(settings_dict, alias="transaction_test")
+            try:
+                statements = []
+                wrapper.ensure_connection()
+                wrapper.connection.set_trace_callback(statements.append)
+                # What transaction.atomic() does on SQLite
+                wrapper.set_autocommit(
+                    False, force_begin_transaction_with_broken_autocommit=True
+                )
+                wrapper.rollback()
+                wrapper.set_autocommit(True)
+                self.assertIn("BEGIN IMMEDIATE", statements)
+            finally:
+                wrapper.close()
+
+    def test_read_write_router(self):
+        router = ReadWriteRouter()
+        self.assertEqual(router.db_for_write(Message), "default")
+        self.assertTrue(router.allow_migrate("default", "remesh_app"))
+        self.assertFalse(router.allow_migrate("read", "remesh_app"))
+        # TestCase wraps each test in a transaction, so reads stay on "default"
+        self.assertEqual(router.db_for_read(Message), "default")
+
+
+@override_settings(REMESH_READ_DATABASES=["replica1", "replica2"])
+class ReplicaRouterTestCase(SimpleTestCase):
+    def test_reads_go_to_replicas(self):
+        router = ReadWriteRouter()
+        reads = {router.db_for_read(Message) for _ in range(50)}
+        self.assertEqual(reads, {"replica1", "replica2"})
+        self.assertEqual(router.db_for_write(Message), "default")
+        self.assertFalse(router.allow_migrate("replica1", "remesh_app"))
+
+    @override_settings(REMESH_READ_DATABASES=[])
+    def test_no_replicas(self):
+        self.assertEqual(ReadWriteRouter().db_for_read(Message), "default")
+
+    def test_reads_follow_writes_in_request(self):
+        router = ReadWriteRouter()
+        state = RequestState()
+        token = request_state.set(state)
+        try:
+            self.assertIn(router.db_for_read(Message), ["replica1", "replica2"])
+            router.db_for_write(Message)
+            self.assertTrue(state.wrote)
+            self.assertEqual(router.db_for_read(Message), "default")
+        finally:
+            request_state.reset(token)
+
+    def test_other_apps_writes_dont_pin(self):
+        router = ReadWriteRouter()
+        state = RequestState()
+        token = request_state.set(state)
+        try:
+            router.db_for_write(User)
+            self.assertFalse(state.wrote)
+            self.assertIn(router.db_for_read(Message), ["replica1", "replica2"])
+        finally:
+            request_state.reset(token)
+
+    def test_pages_from_lagging_replicas_arent_cached(self):
+        router = ReadWriteRouter()
+        reads = []
+
+        @cached_page("conversations")
+        def view(request):
+            reads.append(router.db_for_read(Message))
+            return HttpResponse("Page")
+
+        request = RequestFactory().get("/lagging/")
+        ReadYourWritesMiddleware(view)(request)
+        ReadYourWritesMiddleware(view)(request)
+        self.assertEqual(len(reads), 2)
+
+        # A query only connection to the primary's file is never behind
+        with self.settings(REMESH_READ_DATABASES=["default"]):
+            router = ReadWriteRouter()
+            request = RequestFactory().get("/primary-file/")
+            ReadYourWritesMiddleware(view)(request)
+            ReadYourWritesMiddleware(view)(request)
+        self.assertEqual(len(reads), 3)
+
+    def test_middleware_pins_after_write(self):
+        router = ReadWriteRouter()
+        reads = []
+
+        def write_view(request):
+            router.db_for_write(Message)
+            return HttpResponse()
+
+        def read_view(request):
+            reads.append(router.db_for_read(Message))
+            return HttpResponse()
+
+        factory = RequestFactory()
+        response = ReadYourWritesMiddleware(write_view)(factory.post("/"))
+        cookie = response.cookies[PRIMARY_COOKIE]
+        self.assertEqual(cookie["max-age"], 10)
+
+        # Within the window the client reads from the primary
+        request = factory.get("/")
+        request.COOKIES[PRIMARY_COOKIE] = cookie.value
+        response = ReadYourWritesMiddleware(read_view)(request)
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+        # After the window, or without the cookie, reads go to a replica again
+        request = factory.get("/")
+        request.COOKIES[PRIMARY_COOKIE] = "0"
+        ReadYourWritesMiddleware(read_view)(request)
+        ReadYourWritesMiddleware(read_view)(factory.get("/"))
+        self.assertEqual(reads[0], "default")
+        self.assertIn(reads[1], ["replica1", "replica2"])
+        self.assertIn(reads[2], ["replica1", "replica2"])
+
+
+@override_settings(
+    DATABASE_ROUTERS=["remesh_app.routers.ReadWriteRouter"], REMESH_READ_DATABASES=[]
+)
+class ReadYourWritesTestCase(TestCase):
+    def test_write_sets_primary_cookie(self):
+        convo = Conversation.objects.create(title="Replica")
+        response = self.client.get(
+            reverse("remesh_app:conversation", kwargs={"conversation_id": convo.id})
+        )
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+        response = self.client.post(
+            reverse("remesh_app:new_message", kwargs={"conversation_id": convo.id}),
+            data={"text": "Mine"},
+        )
+        self.assertIn(PRIMARY_COOKIE, response.cookies)
+
+
+class AsyncViewTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+        Thought.objects.create(message=self.msg, text="Test Thought")
+        self.pages = [
+            ("conversations", []),
+            ("conversation", [self.convo.id]),
+            ("message", [self.msg.id]),
+        ]
+
+    def test_views_are_async(self):
+        for view in [
+            async_views.conversations,
+            async_views.conversation,
+            async_views.message,
+            async_views.search,
+        ]:
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    async def test_same_pages_as_sync_views(self):
+        for name, args in self.pages:
+            response = await self.async_client.get(
+                reverse(f"remesh_app:async_{name}", args=args)
+            )
+            self.assertEqual(response.status_code, 200)
+            expected = await self.async_client.get(
+                reverse(f"remesh_app:{name}", args=args)
+            )
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response.headers["ETag"], expected.headers["ETag"])
+
+    async def test_not_modified(self):
+        url = reverse("remesh_app:async_message", args=[self.msg.id])
+        response = await self.async_client.get(url)
+        response = await self.async_client.get(
+            url, headers={"If-None-Match": response.headers["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_pagination(self):
+        await Message.objects.abulk_create(
+            [Message(conversation=self.convo, text=f"Message {i}") for i in range(5)]
+        )
+        url = reverse("remesh_app:async_conversation", args=[self.convo.id])
+        response = await self.async_client.get(url, {"page_size": 4})
+        self.assertEqual(len(response.context["message_dict"]), 4)
+        page = response.context["page"]
+        response = await self.async_client.get(f"{url}?{page.next_query}")
+        self.assertEqual(len(response.context["message_dict"]), 2)
+
+    async def test_search(self):
+        url = reverse(
+            "remesh_app:async_search",
+            kwargs={"search_type": "thoughts", "conversation_id": self.convo.id},
+        )
+        response = await self.async_client.get(url, {"q": "Thought"})
+        self.assertContains(response, "<mark>Thought</mark>")
+        # Too short for the index
+        response = await self.async_client.get(url, {"q": "Te"})
+        self.assertContains(response, "Test Thought")
+        url = reverse("remesh_app:async_search", args=["conversations"])
+        response = await self.async_client.get(url, {"q": "Conversation"})
+        self.assertContains(response, "Test Conversation")
+
+
+class GroupCommitTestCase(TransactionTestCase):
+    # A TransactionTestCase, since the queue commits from its own thread
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+        self.queue = GroupCommitQueue(delay=0.2, max_batch=100)
+        patches = [
+            mock.patch("remesh_app.writes.GROUP_COMMIT", True),
+            mock.patch("remesh_app.writes.group_commit_queue", self.queue),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_concurrent_thoughts_share_commits(self):
+        url = reverse("remesh_app:new_thought", args=[self.msg.id])
+        responses = []
+
+        def submit(i):
+            responses.append(self.client_class().post(url, {"text": f"Thought {i}"}))
+
+        threads = [threading.Thread(target=submit, args=[i]) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        message_url = reverse("remesh_app:message", args=[self.msg.id])
+        for response in responses:
+            self.assertRedirects(response, message_url, fetch_redirect_response=False)
+        self.assertEqual(self.msg.thought_set.count(), 10)
+        self.msg.refresh_from_db()
+        self.assertEqual(self.msg.thought_count, 10)
+        self.assertEqual(self.queue.rows, 10)
+        self.assertLess(self.queue.commits, 10)
+
+    def test_new_message(self):
+        url = reverse("remesh_app:new_message", args=[self.convo.id])
+        response = self.client.post(url, {"text": "Queued Message"})
+        self.assertRedirects(
+            response,
+            reverse("remesh_app:conversation", args=[self.convo.id]),
+            fetch_redirect_response=False,
+        )
+        self.convo.refresh_from_db()
+        self.assertEqual(self.convo.message_count, 2)
+        self.assertEqual(self.queue.commits, 1)
+
+    def test_invalid_form_is_not_queued(self):
+        url = reverse("remesh_app:new_thought", args=[self.msg.id])
+        response = self.client.post(url, {"text": ""})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "remesh_app/new_thought.html")
+        self.assertEqual(self.queue.commits, 0)
+
+    def test_failed_write_only_fails_its_group(self):
+        good = PendingWrite(Thought(message=self.msg, text="Good Thought"))
+        orphan = Message(conversation=self.convo, text="Orphan")
+        orphan.conversation_id = self.convo.id + 1000
+        bad = PendingWrite(orphan)
+        self.queue.flush([good, bad])
+        self.assertIsNone(good.error)
+        self.assertIsNotNone(bad.error)
+        self.assertTrue(Thought.objects.filter(text="Good Thought").exists())
+        self.assertFalse(Message.objects.filter(text="Orphan").exists())
+
+    def test_unexpected_error_fails_the_whole_batch(self):
+        writes = [
+            PendingWrite(Thought(message=self.msg, text=f"Thought {i}"))
+            for i in range(3)
+        ]
+        error = DatabaseError("unable to open database file")
+        with mock.patch("remesh_app.writes.close_old_connections", side_effect=error):
+            self.queue.flush(writes)
+        for write in writes:
+            self.assertTrue(write.done.is_set())
+            self.assertIs(write.error, error)
+        self.assertFalse(Thought.objects.filter(text__startswith="Thought").exists())
+
+    def test_save_times_out(self):
+        # Without a thread to save them, writes stay in the queue
+        self.queue.timeout = 0.1
+        with mock.patch.object(self.queue, "start"), self.assertRaises(DatabaseError):
+            self.queue.save(Thought(message=self.msg, text="Stuck Thought"))
+
+
+SHARDS = ["shard0", "shard1"]
+
+
+@override_settings(
+    REMESH_SHARD_DATABASES=SHARDS,
+    DATABASE_ROUTERS=["remesh_app.routers.ShardRouter"],
+)
+class ShardingTestCase(TransactionTestCase):
+    # A TransactionTestCase, since the shards are queried in parallel threads
+
+    @classmethod
+    def setUpClass(cls):
+        # The shards are temporary files, added to the databases for these tests only
+        # (after the test runner set up the databases it knows of)
+        cls.databases = {"default", *SHARDS}
+        cls.directory = tempfile.TemporaryDirectory()
+        shards = {
+            alias: {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(cls.directory.name, f"{alias}.sqlite3"),
+            }
+            for alias in SHARDS
+        }
+        connections.settings = connections.configure_settings(
+            {**connections.settings, **shards}
+        )
+        super().setUpClass()
+        for alias in SHARDS:
+            call_command("migrate", database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.directory.cleanup()
+
+    def create_conversation(self, shard, title="Test Conversation", **kwargs):
+        with use_shard(shard):
+            return Conversation.objects.create(title=title, **kwargs)
+
+    def test_new_conversations_are_placed_on_a_shard(self):
+        for i in range(6):
+            self.client.post(
+                reverse("remesh_app:new_conversation"), {"title": f"Conversation {i}"}
+            )
+        entries = ConversationShard.objects.all()
+        self.assertEqual(len(entries), 6)
+        for entry in entries:
+            other = SHARDS[1 - SHARDS.index(entry.shard)]
+            self.assertTrue(Conversation.objects.using(entry.shard).filter(id=entry.id))
+            self.assertFalse(Conversation.objects.using(other).filter(id=entry.id))
+
+    def test_pages_use_the_shard_of_their_conversation(self):
+        self.create_conversation("shard0")
+        convo = self.create_conversation("shard1", title="Second Conversation")
+        response = self.client.post(
+            reverse("remesh_app:new_message", args=[convo.id]), {"text": "Hello"}
+        )
+        self.assertEqual(response.status_code, 302)
+        message = Message.objects.using("shard1").get()
+        # Messages on shard1 are numbered after the ids of shard0
+        self.assertGreater(message.id, SHARD_ID_SPAN)
+        self.assertEqual(shard_for_row(message.id), "shard1")
+
+        response = self.client.post(
+            reverse("remesh_app:new_thought", args=[message.id]), {"text": "Thought"}
+        )
+        self.assertEqual(response.status_code, 302)
+        convo = Conversation.objects.using("shard1").get()
+        self.assertEqual((convo.message_count, convo.thought_count), (1, 1))
+
+        response = self.client.get(reverse("remesh_app:conversation", args=[convo.id]))
+        self.assertContains(response, "Second Conversation")
+        self.assertContains(response, "Hello")
+        response = self.client.get(reverse("remesh_app:message", args=[message.id]))
+        self.assertContains(response, "Thought")
+        response = self.client.get(
+            reverse("remesh_app:api_thoughts", args=[message.id])
+        )
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_conversations_page_merges_the_shards(self):
+        today = timezone.now().date()
+        for days in range(6):
+            shard = SHARDS[days % 2]
+            convo = self.create_conversation(shard, title=f"Conversation {days}")
+            # start_date is set on insert
+            Conversation.objects.using(shard).filter(id=convo.id).update(
+                start_date=today - timezone.timedelta(days=days)
+            )
+        url = reverse("remesh_app:conversations")
+        response = self.client.get(url, {"page_size": 4})
+        titles = [convo.title for convo in response.context["conversations"]]
+        self.assertEqual(titles, [f"Conversation {days}" for days in range(4)])
+        response = self.client.get(f"{url}?{response.context['page'].next_query}")
+        titles = [convo.title for convo in response.context["conversations"]]
+        self.assertEqual(titles, ["Conversation 4", "Conversation 5"])
+        response = self.client.get(f"{url}?{response.context['page'].previous_query}")
+        titles = [convo.title for convo in response.context["conversations"]]
+        self.assertEqual(titles, [f"Conversation {days}" for days in range(4)])
+
+    def test_title_search_covers_every_shard(self):
+        first = self.create_conversation("shard0", title="Climate policy")
+        second = self.create_conversation("shard1", title="Policy on remote work")
+        self.create_conversation("shard1", title="Something else")
+        for query in ["policy", "po"]:
+            response = self.client.get(
+                reverse("remesh_app:search", args=["conversations"]), {"q": query}
+            )
+            self.assertEqual(
+                {result.id for result in response.context["results"]},
+                {first.id, second.id},
+            )
+
+    def test_api_bulk_conversations(self):
+        response = self.client.post(
+            reverse("remesh_app:api_bulk_conversations"),
+            {"conversations": [{"title": f"Bulk {i}"} for i in range(6)]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        for convo_id in response.json()["ids"]:
+            shard = shard_for_conversation(convo_id)
+            self.assertTrue(Conversation.objects.using(shard).filter(id=convo_id))
+
+    def test_move_conversation(self):
+        convo = self.create_conversation("shard0")
+        with use_shard("shard0"):
+            message = Message.objects.create(conversation=convo, text="Moving along")
+            Thought.objects.create(message=message, text="Along with it")
+            sent_datetime = Message.objects.get().sent_datetime
+        out = StringIO()
+        call_command("move_conversation", convo.id, "shard1", stdout=out)
+        self.assertIn("1 messages and 1 thoughts", out.getvalue())
+
+        self.assertEqual(shard_for_conversation(convo.id), "shard1")
+        self.assertFalse(Message.objects.using("shard0").exists())
+        moved = Message.objects.using("shard1").get()
+        self.assertEqual(shard_for_row(moved.id), "shard1")
+        self.assertEqual(moved.sent_datetime, sent_datetime)
+        self.assertEqual(moved.thought_set.get().text, "Along with it")
+        moved_convo = Conversation.objects.using("shard1").get()
+        self.assertEqual((moved_convo.message_count, moved_convo.thought_count), (1, 1))
+
+        # The search index of the new shard has the moved rows
+        response = self.client.get(
+            reverse("remesh_app:search", args=["messages", convo.id]), {"q": "along"}
+        )
+        self.assertEqual(
+            [result.id for result in response.context["results"]], [moved.id]
+        )
+        response = self.client.get(reverse("remesh_app:message", args=[moved.id]))
+        self.assertContains(response, "Along with it")
+
+    @mock.patch("remesh_app.snapshots.SNAPSHOTS", True)
+    def test_move_rebuilds_snapshot(self):
+        convo = self.create_conversation("shard0")
+        with use_shard("shard0"):
+            message = Message.objects.create(conversation=convo, text="Snapshotted")
+            Thought.objects.create(message=message, text="Kept in the snapshot")
+        call_command("move_conversation", convo.id, "shard1", stdout=StringIO())
+        self.assertFalse(SnapshotMessage.objects.using("shard0").exists())
+        entry = SnapshotMessage.objects.using("shard1").get()
+        self.assertEqual(entry.id, Message.objects.using("shard1").get().id)
+        self.assertEqual(entry.thoughts[0]["preview"], "Kept in the snapshot")
+        response = self.client.get(
+            reverse("remesh_app:api_conversation_snapshot", args=[convo.id])
+        )
+        self.assertEqual(response.json()["results"][0]["id"], entry.id)
+
+    def test_archive_and_restore(self):
+        load_archive.cache_clear()
+        convo = self.create_conversation("shard1", title="Archived on a shard")
+        with use_shard("shard1"):
+            message = Message.objects.create(conversation=convo, text="Stored away")
+            Conversation.objects.update(
+                last_activity=timezone.now() - timezone.timedelta(days=100)
+            )
+        call_command("archive_conversations", days=30, stdout=StringIO())
+        self.assertFalse(Message.objects.using("shard1").exists())
+        self.assertTrue(ArchivedConversation.objects.using("shard1").exists())
+        response = self.client.get(reverse("remesh_app:message", args=[message.id]))
+        self.assertContains(response, "Stored away")
+        response = self.client.get(reverse("remesh_app:conversation", args=[convo.id]))
+        self.assertContains(response, "Archived on a shard")
+
+        call_command("restore_conversation", convo.id, stdout=StringIO())
+        self.assertEqual(Message.objects.using("shard1").get().id, message.id)
+
+    def test_counters_and_index_commands(self):
+        convo = self.create_conversation("shard1")
+        with use_shard("shard1"):
+            Message.objects.create(conversation=convo, text="Counted")
+            Conversation.objects.update(message_count=5)
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("Fixed 1 rows", out.getvalue())
+        self.assertEqual(Conversation.objects.using("shard1").get().message_count, 1)
+        call_command("rebuild_search_index", stdout=StringIO())
+
+    def test_seed_fills_every_shard(self):
+        call_command(
+            "seed_remesh", conversations=5, messages=3, thoughts=1, stdout=StringIO()
+        )
+        self.assertEqual(ConversationShard.objects.count(), 5)
+        for entry in ConversationShard.objects.all():
+            self.assertTrue(Conversation.objects.using(entry.shard).filter(id=entry.id))
+        for shard in SHARDS:
+            for message_id in Message.objects.using(shard).values_list("id", flat=True):
+                self.assertEqual(shard_for_row(message_id), shard)
+
+    def test_failed_seed_releases_its_ids(self):
+        with mock.patch(
+            "remesh_app.seeding.Seeder.index_new_rows", side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            call_command(
+                "seed_remesh",
+                conversations=5,
+                messages=3,
+                thoughts=1,
+                stdout=StringIO(),
+            )
+        self.assertFalse(ConversationShard.objects.exists())
+        for shard in SHARDS:
+            self.assertFalse(Conversation.objects.using(shard).exists())
+
+    def test_admin_lists_one_shard(self):
+        User.objects.create_superuser("admin", password="password")
+        self.client.login(username="admin", password="password")
+        self.create_conversation("shard0", title="On the first shard")
+        convo = self.create_conversation("shard1", title="On the second shard")
+        url = reverse("admin:remesh_app_conversation_changelist")
+        response = self.client.get(url)
+        self.assertContains(response, "On the first shard")
+        self.assertNotContains(response, "On the second shard")
+        response = self.client.get(url, {"shard": "shard1"})
+        self.assertContains(response, "On the second shard")
+        response = self.client.get(
+            reverse("admin:remesh_app_conversation_change", args=[convo.id])
+        )
+        self.assertContains(response, "On the second shard")
+
+
+class LiveEventsTestCase(TestCase):
+    def setUp(self):
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+        self.url = reverse("remesh_app:conversation_events", args=[self.convo.id])
+
+    def create(self, model, **kwargs):
+        # Runs the on commit callbacks, which publish the new row
+        with self.captureOnCommitCallbacks(execute=True):
+            return model.objects.create(**kwargs)
+
+    async def test_local_broker(self):
+        broker = LocalBroker()
+        subscription = broker.subscribe("channel")
+        # Published from another thread, like a sync view does
+        thread = threading.Thread(
+            target=broker.publish, args=("channel", {"type": "test"})
+        )
+        thread.start()
+        thread.join()
+        broker.publish("other channel", {"type": "other"})
+        self.assertEqual(await subscription.__anext__(), {"type": "test"})
+        subscription.close()
+        self.assertEqual(broker.subscriptions, {})
+
+    async def test_slow_subscriber_dropped(self):
+        broker = LocalBroker()
+        subscription = broker.subscribe("channel")
+        for i in range(MAX_PENDING_EVENTS + 1):
+            broker.publish("channel", {"type": "test", "id": i})
+        await asyncio.sleep(0)
+        events = [event async for event in subscription]
+        self.assertEqual(len(events), MAX_PENDING_EVENTS - 1)
+        self.assertEqual(broker.subscriptions, {})
+
+    async def test_stream_new_rows(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertEqual(await stream.__anext__(), b"retry: 3000\n\n")
+
+        message = await sync_to_async(self.create)(
+            Message, conversation=self.convo, text="Live Message"
+        )
+        event = (await stream.__anext__()).decode()
+        self.assertTrue(event.startswith("event: message\ndata: "))
+        data = json.loads(event.split("data: ", 1)[1])
+        self.assertEqual(data["id"], message.id)
+        self.assertEqual(data["summary"], "Live Message")
+        self.assertNotIn("text", data)
+
+        thought = await sync_to_async(self.create)(
+            Thought, message=self.msg, text="Live Thought"
+        )
+        event = (await stream.__anext__()).decode()
+        self.assertTrue(event.startswith("event: thought\n"))
+        data = json.loads(event.split("data: ", 1)[1])
+        self.assertEqual(data["id"], thought.id)
+        self.assertEqual(data["message"], self.msg.id)
+        await stream.aclose()
+
+    def test_published_on_commit(self):
+        broker = mock.Mock()
+        with mock.patch("remesh_app.events._broker", broker):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post(
+                    reverse("remesh_app:new_thought", args=[self.msg.id]),
+                    data={"text": "New Thought"},
+                )
+                broker.publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+        channel, event = broker.publish.call_args.args
+        self.assertEqual(channel, f"conversation:{self.convo.id}")
+        self.assertEqual(event["summary"], "New Thought")
+
+    def test_bulk_api_publishes(self):
+        broker = mock.Mock()
+        with mock.patch("remesh_app.events._broker", broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse("remesh_app:api_bulk_messages", args=[self.convo.id]),
+                    data={"messages": [{"text": "One"}, {"text": "Two"}]},
+                    content_type="application/json",
+                )
+        events = [call.args[1] for call in broker.publish.call_args_list]
+        self.assertEqual([event["summary"] for event in events], ["One", "Two"])
+
+    async def test_unknown_conversation(self):
+        response = await self.async_client.get(
+            reverse("remesh_app:conversation_events", args=[self.convo.id + 1])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_conversation_page_subscribes(self):
+        url = reverse("remesh_app:conversation", args=[self.convo.id])
+        response = await self.async_client.get(url)
+        self.assertContains(response, self.url)
+        # Older pages don't get live updates
+        await Message.objects.acreate(conversation=self.convo, text="Newer Message")
+        page = (await self.async_client.get(url, {"page_size": 1})).context["page"]
+        response = await self.async_client.get(url + f"?{page.next_query}")
+        self.assertNotContains(response, self.url)
+
+    def test_no_live_events_under_wsgi(self):
+        response = self.client.get(
+            reverse("remesh_app:conversation", args=[self.convo.id])
+        )
+        self.assertNotContains(response, self.url)
+        self.assertEqual(self.client.get(self.url).status_code, 204)
+
+
+METRICS_TEMPLATES = [
+    {**settings.TEMPLATES[0], "BACKEND": "remesh_app.metrics.DjangoTemplates"}
+]
+
+
+@override_settings(
+    MIDDLEWARE=["remesh_app.metrics.MetricsMiddleware"] + settings.MIDDLEWARE,
+    TEMPLATES=METRICS_TEMPLATES,
+)
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.convo = Conversation.objects.create(title="Test Conversation")
+        self.msg = Message.objects.create(conversation=self.convo, text="Test Message")
+
+    def test_records_view_metrics(self):
+        url = reverse("remesh_app:conversation", args=[self.convo.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.client.get(url)
+
+        view = 'view="remesh_app:conversation"'
+        histogram = registry.histograms["remesh_db_queries"]["remesh_app:conversation"]
+        self.assertEqual(histogram.count, 2)
+        self.assertGreaterEqual(histogram.sum, len(queries))
+        render = registry.histograms["remesh_template_duration_seconds"]
+        self.assertGreater(render["remesh_app:conversation"].sum, 0)
+
+        text = self.client.get(reverse("remesh_app:metrics")).content.decode()
+        self.assertIn("# TYPE remesh_request_duration_seconds histogram", text)
+        self.assertIn(
+            f'remesh_request_duration_seconds_bucket{{{view},le="+Inf"}} 2', text
+        )
+        self.assertIn(f"remesh_request_duration_seconds_count{{{view}}} 2", text)
+        self.assertIn(f"remesh_db_queries_count{{{view}}} 2", text)
+        self.assertIn(f"remesh_duplicate_queries_total{{{view}}} 0", text)
+
+    async def test_async_view(self):
+        # Under an ASGI server request_started does this in the thread running the
+        # queries, the test client sends it from another thread
+        await sync_to_async(install_query_recorder)(None, connection)
+        await self.async_client.get(
+            reverse("remesh_app:async_message", args=[self.msg.id])
+        )
+        histogram = registry.histograms["remesh_db_queries"]["remesh_app:async_message"]
+        self.assertGreater(histogram.sum, 0)
+
+    def test_duplicate_queries(self):
+        # The message page of each thought loads the same message
+        for i in range(5):
+            Thought.objects.create(message=self.msg, text=f"Thought {i}")
+        with mock.patch("remesh_app.metrics.DUPLICATE_THRESHOLD", 3):
+            with self.assertLogs("remesh_app.metrics", "WARNING") as logs:
+                with mock.patch(
+                    "remesh_app.views.keyset_paginate",
+                    lambda queryset, ordering, request: [
+                        Message.objects.get(id=self.msg.id) for _ in range(3)
+                    ],
+                ):
+                    self.client.get(
+                        reverse("remesh_app:conversation", args=[self.convo.id])
+                    )
+        self.assertIn("Possible N+1 queries in remesh_app:conversation", logs.output[0])
+        self.assertEqual(registry.duplicates["remesh_app:conversation"], 2)
+
+    def test_server_timing(self):
+        url = reverse("remesh_app:message", args=[self.msg.id])
+        self.assertNotIn("Server-Timing", self.client.get(url))
+        with mock.patch("remesh_app.metrics.SERVER_TIMING", True):
+            response = self.client.get(url)
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries, 0 duplicate", tpl;dur=[\d.]+, '
+            r"total;dur=[\d.]+$",
+        )
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
 
 app_name = "remesh_app"
 
@@ -9,12 +9,24 @@ urlpatterns = [
     path("", views.index, name="index"),
     # Conversations view will show all conversations
     path("conversations/", views.conversations, name="conversations"),
+    # Archived conversations, read-only
+    path(
+        "conversations/archived/",
+        views.archived_conversations,
+        name="archived_conversations",
+    ),
     # Conversation view will show messages and thoughts for the conversation
     path(
         "conversation/<int:conversation_id>/", views.conversation, name="conversation"
     ),
     # Thoughts view will show thoughts for each message
     path("message/<int:message_id>/", views.message, name="message"),
+    # Thoughts for a message, loaded into the conversation page when it is expanded
+    path(
+        "message/<int:message_id>/thoughts/",
+        views.message_thoughts,
+        name="message_thoughts",
+    ),
     # New conversation
     path("new_conversation/", views.new_conversation, name="new_conversation"),
     # New message
@@ -24,4 +36,80 @@ urlpatterns = [
     # Search
     path("search/<str:search_type>/", views.search, name="search"),
     path("search/<str:search_type>/<int:conversation_id>", views.search, name="search"),
+    # Export a conversation as ndjson or csv
+    path(
+        "export/<int:conversation_id>/<str:export_format>/",
+        views.export_conversation,
+        name="export_conversation",
+    ),
+    # Async versions of the read views, for ASGI servers
+    path(
+        "async/conversations/",
+        async_views.conversations,
+        name="async_conversations",
+    ),
+    path(
+        "async/conversation/<int:conversation_id>/",
+        async_views.conversation,
+        name="async_conversation",
+    ),
+    path(
+        "async/message/<int:message_id>/",
+        async_views.message,
+        name="async_message",
+    ),
+    path(
+        "async/search/<str:search_type>/",
+        async_views.search,
+        name="async_search",
+    ),
+    path(
+        "async/search/<str:search_type>/<int:conversation_id>",
+        async_views.search,
+        name="async_search",
+    ),
+    # Live updates for the conversation page, as Server-Sent Events
+    path(
+        "events/<int:conversation_id>/",
+        async_views.conversation_events,
+        name="conversation_events",
+    ),
+    # Page cache hit/miss counters
+    path("cache_stats/", views.cache_stats, name="cache_stats"),
+    # Request metrics for Prometheus
+    path("metrics/", views.metrics, name="metrics"),
+    # JSON API
+    path("api/conversations/", api.conversations, name="api_conversations"),
+    path(
+        "api/conversations/bulk/",
+        api.bulk_conversations,
+        name="api_bulk_conversations",
+    ),
+    path(
+        "api/conversations/<int:conversation_id>/",
+        api.conversation,
+        name="api_conversation",
+    ),
+    path(
+        "api/conversations/<int:conversation_id>/snapshot/",
+        api.conversation_snapshot,
+        name="api_conversation_snapshot",
+    ),
+    path(
+        "api/conversations/<int:conversation_id>/messages/",
+        api.messages,
+        name="api_messages",
+    ),
+    path(
+        "api/conversations/<int:conversation_id>/messages/bulk/",
+        api.bulk_messages,
+        name="api_bulk_messages",
+    ),
+    path("api/messages/<int:message_id>/", api.message, name="api_message"),
+    path("api/messages/<int:message_id>/thoughts/", api.thoughts, name="api_thoughts"),
+    path(
+        "api/messages/<int:message_id>/thoughts/bulk/",
+        api.bulk_thoughts,
+        name="api_bulk_thoughts",
+    ),
 ]
@@ -1,8 +1,24 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 
-from .models import Conversation, Message, Thought
+from .archive import find_archived_message, get_archive
+from .cache import CACHE_TIMEOUT, cached_page, get_stats
+from .conditional import (
+    conditional_page,
+    conversation_validators,
+    conversations_validators,
+    message_validators,
+)
+from .events import live_events
+from .export import EXPORT_FORMATS, export_lines
+from .metrics import registry
+from .models import ArchivedConversation, Conversation, Message, Thought
 from .forms import ConversationForm, MessageForm, ThoughtForm
+from .pagination import keyset_paginate, keyset_paginate_list
+from .search import ranked_search, search_conversations
+from .shards import keyset_paginate_shards
+from .snapshots import conversation_messages
+from .writes import save_new
 
 
 def index(request):
@@ -12,52 +28,141 @@ def index(request):
     return render(request, "remesh_app/index.html")
 
 
+@conditional_page(conversations_validators)
+@cached_page("conversations")
 def conversations(request):
     """
     Returns a page showing all the conversations
+    Sorted by start date, or by most recent activity with ?sort=activity
     """
-    conversations = Conversation.objects.all().order_by("-start_date")
+    sort = request.GET.get("sort")
+    if sort == "activity":
+        ordering = ("-last_activity", "-id")
+    else:
+        ordering = ("-start_date", "id")
+    page = keyset_paginate_shards(Conversation.objects.all(), ordering, request)
     return render(
-        request, "remesh_app/conversations.html", {"conversations": conversations}
+        request,
+        "remesh_app/conversations.html",
+        {"conversations": page.items, "page": page, "sort": sort},
     )
 
 
+@cached_page("conversations")
+def archived_conversations(request):
+    """
+    Returns a page showing the archived conversations, most recently active first
+    """
+    page = keyset_paginate_shards(
+        ArchivedConversation.objects.defer("data"), ("-last_activity", "-id"), request
+    )
+    return render(
+        request,
+        "remesh_app/archived_conversations.html",
+        {"conversations": page.items, "page": page},
+    )
+
+
+@conditional_page(conversation_validators)
+@cached_page("conversation", "conversation_id")
 def conversation(request, conversation_id):
     """
-    Returns a page for a conversation, showing the messages and shortened thoughts
+    Returns a page for a conversation, showing the messages and their thought counts
     """
-    convo = Conversation.objects.get(id=conversation_id)
-    messages = convo.get_messages()
+    ordering = ("-sent_datetime", "-id")
+    archived = False
+    try:
+        convo = Conversation.objects.get(id=conversation_id)
+    except Conversation.DoesNotExist:
+        # Shown read-only from its archive, if it was archived
+        archive = get_archive(conversation_id)
+        convo = archive.conversation
+        page = keyset_paginate_list(archive.messages, Message, ordering, request)
+        archived = True
+    else:
+        # Only the messages are loaded here, with their thought counts, from the
+        # conversation's snapshot if it has one. The thoughts of a message are loaded
+        # from message_thoughts when it is expanded, so the page costs the same no
+        # matter how many thoughts there are.
+        page = keyset_paginate(conversation_messages(convo), ordering, request)
     message_dict = {}
-    # Showing all the thoughts for each message is pretty inefficient.
-    # It would be better to allow the thoughts to be loaded only in the message page.
-    # Or dynamically by using some kind of accordion
-    for message in messages:
-        thoughts = message.get_thoughts()
-        message_dict[str(message.id)] = (message, thoughts)
+    for message in page:
+        message_dict[str(message.id)] = message
     return render(
         request,
         "remesh_app/conversation.html",
-        {"conversation": convo, "message_dict": message_dict},
+        {
+            "conversation": convo,
+            "message_dict": message_dict,
+            "page": page,
+            "fragment_timeout": CACHE_TIMEOUT,
+            "archived": archived,
+            "live_events": live_events(request),
+        },
     )
 
 
+@conditional_page(message_validators)
+@cached_page("message", "message_id")
 def message(request, message_id):
     """
     Returns a page for a message, showing the thoughts
     """
-    message = Message.objects.get(id=message_id)
-    thoughts = message.get_thoughts()
+    ordering = ("-sent_datetime", "-id")
+    archived = False
+    try:
+        message = Message.objects.get(id=message_id)
+    except Message.DoesNotExist:
+        # Shown read-only from the archive of its conversation, if it was archived
+        archive, message = find_archived_message(message_id)
+        thoughts = archive.thoughts.get(message.id, [])
+        page = keyset_paginate_list(thoughts, Thought, ordering, request)
+        archived = True
+    else:
+        page = keyset_paginate(message.thought_set.all(), ordering, request)
     return render(
         request,
         "remesh_app/message.html",
         {
             "message": message,
-            "thoughts": thoughts,
+            "thoughts": page.items,
+            "page": page,
+            "archived": archived,
         },
     )
 
 
+@conditional_page(message_validators)
+@cached_page("message", "message_id")
+def message_thoughts(request, message_id):
+    """
+    Returns one page of shortened thoughts for a message, as an html fragment for
+    the conversation page
+    """
+    ordering = ("-sent_datetime", "-id")
+    # Only the stored previews are shown, so the full texts aren't loaded
+    page = keyset_paginate(
+        Thought.objects.filter(message_id=message_id).only("preview", "sent_datetime"),
+        ordering,
+        request,
+    )
+    if not page.items:
+        # Thoughts are only requested for messages that have some, so the message
+        # may be archived
+        try:
+            archive, message = find_archived_message(message_id)
+        except Message.DoesNotExist:
+            pass
+        else:
+            thoughts = archive.thoughts.get(message.id, [])
+            page = keyset_paginate_list(thoughts, Thought, ordering, request)
+    return render(
+        request,
+        "remesh_app/thoughts.html",
+        {"message_id": message_id, "thoughts": page.items, "page": page},
+    )
+
+
 def new_conversation(request):
     """
     Creates a new conversation
@@ -92,7 +197,7 @@ def new_message(request, conversation_id):
         if form.is_valid():
             new_message = form.save(commit=False)
             new_message.conversation = convo
-            new_message.save()
+            save_new(new_message)
             return redirect("remesh_app:conversation", conversation_id=conversation_id)
     else:
         form = MessageForm()
@@ -122,7 +227,7 @@ def new_thought(request, message_id):
         if form.is_valid():
             new_thought = form.save(commit=False)
             new_thought.message = msg
-            new_thought.save()
+            save_new(new_thought)
             return redirect("remesh_app:message", message_id=message_id)
     else:
         form = ThoughtForm()
@@ -140,20 +245,29 @@ def search(request, search_type, conversation_id=None):
     """
     Searches for objects based on their type
     object_id is an optional argument for searches within an element of another model
+    Results come from the full-text index, ranked best match first
     Returns a search result page
     """
-    query = request.GET.get("q")
+    query = request.GET.get("q", "")
     context = {}
-    if search_type == "messages":
+    if search_type in ("messages", "thoughts"):
         convo = Conversation.objects.get(id=conversation_id)
-        results = convo.message_set.filter(text__contains=query)
+        results = ranked_search(search_type, query, conversation_id)
+        if results is None:
+            # Terms shorter than 3 characters can't use the search index
+            if search_type == "messages":
+                results = convo.message_set.filter(text__contains=query)
+            else:
+                results = Thought.objects.filter(
+                    message__conversation=convo, text__contains=query
+                )
         context = {
             "results": results,
             "search_type": search_type,
             "conversation_id": conversation_id,
         }
     elif search_type == "conversations":
-        results = Conversation.objects.filter(title__contains=query)
+        results = search_conversations(query)
         context = {
             "results": results,
             "search_type": search_type,
@@ -165,3 +279,36 @@ def search(request, search_type, conversation_id=None):
         )
 
     return render(request, "remesh_app/search_results.html", context)
+
+
+def cache_stats(request):
+    """
+    Returns the page cache hit and miss counters as JSON
+    """
+    return JsonResponse(get_stats())
+
+
+def metrics(request):
+    """
+    Returns the request metrics in the Prometheus text format
+    """
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def export_conversation(request, conversation_id, export_format):
+    """
+    Streams a conversation with all its messages and thoughts as NDJSON or CSV
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format")
+    convo = Conversation.objects.get(id=conversation_id)
+    response = StreamingHttpResponse(
+        export_lines(convo, export_format),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="conversation_{convo.id}.{export_format}"'
+    )
+    return response
@@ -0,0 +1,241 @@
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, transaction
+
+from .cache import bump_version
+from .counters import messages_added, thoughts_added
+from .events import message_event, publish_on_commit, thought_event
+from .models import Conversation, Message, Thought
+from .shards import allocate_conversations, conversation_db, shard_aliases, use_shard
+from .snapshots import add_conversations, add_messages, add_thoughts
+
+# Creating new messages and thoughts
+# With REMESH_GROUP_COMMIT=1, the messages and thoughts created by the html views
+# are handed to a background thread, which saves everything submitted within
+# GROUP_COMMIT_DELAY seconds (or GROUP_COMMIT_MAX_BATCH rows) in one transaction.
+# Many writers then share one commit and one turn at the SQLite write lock instead of
+# queuing for it one by one. Each request still waits until its row is committed.
+# Requests must be handled in threads (WSGI) for their writes to be grouped. Under
+# ASGI the sync views share one thread, so they still commit one at a time.
+# A request waits at most GROUP_COMMIT_TIMEOUT seconds and then fails, in case the
+# thread is stuck. Its row may still be committed after that.
+
+GROUP_COMMIT = getattr(settings, "REMESH_GROUP_COMMIT", False)
+GROUP_COMMIT_DELAY = getattr(settings, "REMESH_GROUP_COMMIT_DELAY", 0.005)
+GROUP_COMMIT_MAX_BATCH = getattr(settings, "REMESH_GROUP_COMMIT_MAX_BATCH", 500)
+GROUP_COMMIT_TIMEOUT = getattr(settings, "REMESH_GROUP_COMMIT_TIMEOUT", 30)
+
+
+def create_conversations(conversations) -> list:
+    """
+    Inserts new conversations with bulk_create, each in its own transaction
+    With sharding, the conversations are placed on their shards and each shard's
+    conversations are inserted in one transaction.
+    """
+    if not shard_aliases():
+        with transaction.atomic():
+            created = Conversation.objects.bulk_create(conversations)
+            add_conversations(created)
+            bump_version("conversations")
+        return created
+
+    entries = allocate_conversations(len(conversations))
+    by_shard = {}
+    for convo, entry in zip(conversations, entries):
+        convo.id = entry.id
+        by_shard.setdefault(entry.shard, []).append(convo)
+    for alias, objects in by_shard.items():
+        with use_shard(alias), transaction.atomic(using=alias):
+            Conversation.objects.bulk_create(objects)
+            add_conversations(objects)
+            bump_version("conversations")
+    return conversations
+
+
+def create_messages(conversation_id, messages) -> list:
+    """
+    Inserts new messages of a conversation with bulk_create
+    bulk_create doesn't send signals, so the counters, snapshot, page cache versions
+    and live events are updated here. Must be called in a transaction.
+    """
+    created = Message.objects.bulk_create(messages)
+    if created:
+        last_sent = max(message.sent_datetime for message in created)
+        messages_added(conversation_id, len(created), last_sent)
+        add_messages(created)
+    bump_version("conversation", conversation_id)
+    bump_version("conversations")
+    publish_on_commit(conversation_id, [message_event(message) for message in created])
+    return created
+
+
+def create_thoughts(message, thoughts) -> list:
+    """
+    Inserts new thoughts for a message with bulk_create, like create_messages()
+    """
+    created = Thought.objects.bulk_create(thoughts)
+    if created:
+        last_sent = max(thought.sent_datetime for thought in created)
+        thoughts_added(message.id, len(created), last_sent)
+        add_thoughts(message.id, created)
+    bump_version("message", message.id)
+    bump_version("conversation", message.conversation_id)
+    bump_version("conversations")
+    publish_on_commit(
+        message.conversation_id, [thought_event(thought) for thought in created]
+    )
+    return created
+
+
+def save_new(obj):
+    """
+    Saves a new message or thought, through the group commit queue if it is enabled
+    Returns once the row is committed, raising the error if it couldn't be saved.
+    Inside a transaction the row is saved right away as part of it.
+    """
+    using = conversation_db()
+    if GROUP_COMMIT and not connections[using].in_atomic_block:
+        group_commit_queue.save(obj)
+    else:
+        # The counters are updated in the same transaction
+        with transaction.atomic(using=using):
+            obj.save()
+
+
+class PendingWrite:
+    def __init__(self, obj):
+        self.obj = obj
+        self.error = None
+        self.saved = False
+        self.done = threading.Event()
+
+
+class GroupCommitQueue:
+    """
+    Saves the objects submitted from any thread in batched transactions
+    """
+
+    def __init__(
+        self,
+        delay=GROUP_COMMIT_DELAY,
+        max_batch=GROUP_COMMIT_MAX_BATCH,
+        timeout=GROUP_COMMIT_TIMEOUT,
+    ):
+        self.delay = delay
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.pending = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+        # Transactions committed, and rows saved by them
+        self.commits = 0
+        self.rows = 0
+
+    def save(self, obj):
+        """
+        Submits a new message or thought and waits until it is committed
+        Raises DatabaseError if it isn't done within timeout seconds.
+        """
+        self.start()
+        write = PendingWrite(obj)
+        self.pending.put(write)
+        if not write.done.wait(self.timeout):
+            raise DatabaseError(
+                f"Group commit didn't save the row within {self.timeout} seconds"
+            )
+        if not write.saved:
+            raise write.error or DatabaseError("Group commit didn't save the row")
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="remesh-group-commit", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        """
+        Saves a batch in one transaction per database (one per shard with sharding)
+        If that fails, each message or conversation's rows are saved in their own
+        transaction, so only the writes that caused the error fail.
+        Any other error fails every write of the batch that isn't committed yet.
+        """
+        try:
+            # Like at the start of a request, replace the connection if it is too old
+            close_old_connections()
+            databases = {}
+            for write in batch:
+                obj = write.obj
+                if isinstance(obj, Message):
+                    key = ("message", obj.conversation_id)
+                else:
+                    key = ("thought", obj.message_id)
+                # The database was set when the conversation or message was assigned
+                groups = databases.setdefault(obj._state.db or conversation_db(), {})
+                groups.setdefault(key, []).append(write)
+
+            for using, groups in databases.items():
+                with use_shard(using):
+                    self.save_groups(using, groups)
+        except Exception as e:
+            for write in batch:
+                if not write.saved:
+                    write.error = e
+        finally:
+            for write in batch:
+                write.done.set()
+
+    def save_groups(self, using, groups):
+        writes = [write for group in groups.values() for write in group]
+        try:
+            with transaction.atomic(using=using):
+                for group in groups.values():
+                    save_group(group)
+            self.commits += 1
+            self.rows += len(writes)
+            for write in writes:
+                write.saved = True
+        except Exception:
+            for group in groups.values():
+                for write in group:
+                    # The ids given by the rolled back insert are not valid
+                    write.obj.pk = None
+                try:
+                    with transaction.atomic(using=using):
+                        save_group(group)
+                    self.commits += 1
+                    self.rows += len(group)
+                    for write in group:
+                        write.saved = True
+                except Exception as e:
+                    for write in group:
+                        write.error = e
+
+
+def save_group(writes):
+    objects = [write.obj for write in writes]
+    if isinstance(objects[0], Message):
+        create_messages(objects[0].conversation_id, objects)
+    else:
+        create_thoughts(objects[0].message, objects)
+
+
+group_commit_queue = GroupCommitQueue()